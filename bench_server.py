@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Load-testing and benchmark harness for the MCP front ends
+Starts server/server.py and server/web/app.py locally against a temporary
+allowlist of cheap stub commands and a fake `specify`, drives them with a
+configurable request mix and concurrency, and writes results as JSON.
+
+Examples:
+    python3 bench_server.py http --concurrency 16 --duration 10
+    python3 bench_server.py http --mix exec=6,batch=1,health=2,web=1 --output run.json
+    python3 bench_server.py http --transport both --concurrency 1 --mix exec=1,health=1
+    python3 bench_server.py stdio --requests 500
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from mcp_cmd import UnixSocketAdapter
+
+REPO_DIR = Path(__file__).resolve().parent
+SERVER_PY = REPO_DIR / "server" / "server.py"
+WEB_APP_PY = REPO_DIR / "server" / "web" / "app.py"
+SPEC_KIT_PY = REPO_DIR / "server" / "spec_kit_server.py"
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+TRANSPORTS = ("tcp", "unix")
+
+# Cheap commands that exercise the exec path without measuring the commands themselves
+STUB_ALLOWLIST = """\
+true
+echo
+printf
+uptime  # ttl=2
+"""
+STUB_COMMANDS = ["true", "echo ok", "printf bench", "uptime"]
+
+FAKE_SPECIFY = """\
+#!/bin/sh
+echo "specify $*"
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+    return round(samples[index], 3)
+
+
+def summarize(latencies_ms: list, errors: int, elapsed: float) -> dict:
+    latencies_ms = sorted(latencies_ms)
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "throughput_rps": round(len(latencies_ms) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "max_ms": round(latencies_ms[-1], 3) if latencies_ms else 0.0,
+    }
+
+
+class ProcessSampler:
+    """Samples RSS and CPU time of a server process in the background."""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.max_rss_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss_kb(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+        return 0
+
+    def _cpu_seconds(self) -> tuple:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime, stime, cutime, cstime (fields 14-17 of stat, after pid and comm)
+        utime, stime, cutime, cstime = (int(x) / CLK_TCK for x in fields[11:15])
+        return utime + stime, cutime + cstime
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.max_rss_kb = max(self.max_rss_kb, self._rss_kb())
+            except OSError:
+                return
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        self._cpu_start = self._cpu_seconds()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        wall = time.monotonic() - self._started
+        cpu_end = self._cpu_seconds()
+        # Growth since the last periodic sample would otherwise be missed
+        final_rss_kb = self._rss_kb()
+        self.max_rss_kb = max(self.max_rss_kb, final_rss_kb)
+        self.result = {
+            "max_rss_mb": round(self.max_rss_kb / 1024, 1),
+            "final_rss_mb": round(final_rss_kb / 1024, 1),
+            "cpu_percent": round((cpu_end[0] - self._cpu_start[0]) / wall * 100, 1),
+            "children_cpu_percent": round((cpu_end[1] - self._cpu_start[1]) / wall * 100, 1),
+        }
+
+
+class LocalServers:
+    """server.py and web/app.py running on free local ports and Unix sockets with stub commands."""
+
+    def __init__(self, env_overrides: dict):
+        self.tmp = Path(tempfile.mkdtemp(prefix="mcp-bench-"))
+        home = self.tmp / "home"
+        (home / ".local" / "bin").mkdir(parents=True)
+        specify = home / ".local" / "bin" / "specify"
+        specify.write_text(FAKE_SPECIFY)
+        specify.chmod(0o755)
+        (home / ".local" / "bin" / "env").write_text('export PATH="$HOME/.local/bin:$PATH"\n')
+        allowlist = self.tmp / "allowed_cmds.txt"
+        allowlist.write_text(STUB_ALLOWLIST)
+        self.api_port = free_port()
+        self.web_port = free_port()
+        self.api_socket = self.tmp / "api.sock"
+        self.web_socket = self.tmp / "web.sock"
+        self.env = dict(os.environ, HOME=str(home), MCP_ALLOWLIST_FILE=str(allowlist),
+                        MCP_JOBS_DB=str(self.tmp / "jobs.db"), MCP_HISTORY_DB=str(self.tmp / "history.db"),
+                        MCP_PORT=str(self.api_port), MCP_UDS=str(self.api_socket),
+                        MCP_WEB_PORT=str(self.web_port), MCP_WEB_UDS=str(self.web_socket),
+                        MCP_TEMPLATES_DIR=str(REPO_DIR / "templates"), MCP_AUDIT_DIR=str(self.tmp / "audit"),
+                        MCP_TEMPLATE_CACHE_DIR=str(self.tmp / "template-cache"))
+        self.env.update(env_overrides)
+        self.procs = {}
+
+    def urls(self, transport: str) -> tuple:
+        """(api, web) base URLs for a transport; unix ones only work with session("unix")."""
+        if transport == "unix":
+            return "http+unix://api", "http+unix://web"
+        return f"http://127.0.0.1:{self.api_port}", f"http://127.0.0.1:{self.web_port}"
+
+    def session(self, transport: str) -> requests.Session:
+        session = requests.Session()
+        if transport == "unix":
+            session.trust_env = False
+            session.mount("http+unix://api", UnixSocketAdapter(str(self.api_socket)))
+            session.mount("http+unix://web", UnixSocketAdapter(str(self.web_socket)))
+        return session
+
+    def start(self, transports=("tcp",)):
+        log = open(self.tmp / "servers.log", "w")
+        self.procs["api"] = subprocess.Popen([sys.executable, str(SERVER_PY)], env=self.env,
+                                             stdout=log, stderr=subprocess.STDOUT)
+        self.procs["web"] = subprocess.Popen([sys.executable, str(WEB_APP_PY)], env=self.env,
+                                             stdout=log, stderr=subprocess.STDOUT)
+        for transport in transports:
+            session = self.session(transport)
+            for url in self.urls(transport):
+                self._wait_healthy(session, url)
+            session.close()
+
+    def _wait_healthy(self, session: requests.Session, url: str):
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                session.get(f"{url}/health", timeout=1).raise_for_status()
+                break
+            except requests.exceptions.RequestException:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"{url} did not become healthy; see {self.tmp / 'servers.log'}")
+                time.sleep(0.1)
+
+    def stop(self):
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def build_scenarios(api_url: str, web_url: str) -> dict:
+    """Request kinds for --mix; each takes a requests.Session and returns an HTTP response."""
+    return {
+        "exec": lambda s: s.post(f"{api_url}/exec", json={"cmd": random.choice(STUB_COMMANDS)}),
+        "batch": lambda s: s.post(f"{api_url}/exec/batch", json={"cmds": STUB_COMMANDS}),
+        "health": lambda s: s.get(f"{api_url}/health"),
+        "commands": lambda s: s.get(f"{api_url}/commands"),
+        "web": lambda s: s.post(f"{web_url}/api/process", json={"command": "version", "wait": True}),
+        "web_health": lambda s: s.get(f"{web_url}/health"),
+    }
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def drive(servers: LocalServers, transport: str, mix: dict, args) -> dict:
+    """Run the request mix over one transport for args.duration seconds."""
+    scenarios = build_scenarios(*servers.urls(transport))
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    results = {name: {"latencies": [], "errors": 0} for name in names}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker():
+        session = servers.session(transport)
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = scenarios[name](session).status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                results[name]["latencies"].append(elapsed_ms)
+                if not ok:
+                    results[name]["errors"] += 1
+        session.close()
+
+    with ProcessSampler(servers.procs["api"].pid) as api_sampler, \
+            ProcessSampler(servers.procs["web"].pid) as web_sampler:
+        started = time.monotonic()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            for _ in range(args.concurrency):
+                pool.submit(worker)
+        elapsed = time.monotonic() - started
+
+    all_latencies = [ms for r in results.values() for ms in r["latencies"]]
+    return {
+        "duration_s": round(elapsed, 3),
+        "total": summarize(all_latencies, sum(r["errors"] for r in results.values()), elapsed),
+        "scenarios": {name: summarize(r["latencies"], r["errors"], elapsed) for name, r in results.items()},
+        "api_process": api_sampler.result,
+        "web_process": web_sampler.result,
+    }
+
+
+def compare(runs: dict) -> dict:
+    """Unix socket latency and throughput relative to loopback TCP (negative = faster)."""
+    tcp, unix = runs["tcp"]["total"], runs["unix"]["total"]
+    delta = {}
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        delta[key] = round(unix[key] - tcp[key], 3)
+        delta[key.replace("_ms", "_percent")] = round((unix[key] - tcp[key]) / tcp[key] * 100, 1) if tcp[key] else 0.0
+    delta["throughput_percent"] = (round((unix["throughput_rps"] - tcp["throughput_rps"])
+                                         / tcp["throughput_rps"] * 100, 1) if tcp["throughput_rps"] else 0.0)
+    return delta
+
+
+def run_http(args) -> dict:
+    overrides = dict(item.split("=", 1) for item in args.env)
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - set(build_scenarios("", ""))
+    if unknown:
+        raise SystemExit(f"unknown scenario(s) in --mix: {', '.join(sorted(unknown))}")
+    transports = TRANSPORTS if args.transport == "both" else (args.transport,)
+    servers = LocalServers(overrides)
+    servers.start(transports)
+    try:
+        runs = {transport: drive(servers, transport, mix, args) for transport in transports}
+    finally:
+        servers.stop()
+    result = {
+        "mode": "http",
+        "concurrency": args.concurrency,
+        "mix": mix,
+        "server_env": overrides,
+    }
+    if len(runs) == 1:
+        result["transport"] = transports[0]
+        result.update(runs[transports[0]])
+    else:
+        # Same servers, one transport after the other, so the comparison is like for like
+        result["transports"] = runs
+        result["unix_vs_tcp"] = compare(runs)
+    return result
+
+
+def run_stdio(args) -> dict:
+    tmp = Path(tempfile.mkdtemp(prefix="mcp-bench-"))
+    try:
+        bin_dir = tmp / "bin"
+        bin_dir.mkdir()
+        specify = bin_dir / "specify"
+        specify.write_text(FAKE_SPECIFY)
+        specify.chmod(0o755)
+        # Keep the child's audit log and template cache inside the scratch dir, and off the network
+        env = dict(os.environ, HOME=str(tmp), PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+                   MCP_AUDIT_DIR=str(tmp / "audit"), MCP_TEMPLATE_CACHE_DIR=str(tmp / "templates"),
+                   MCP_TEMPLATE_OFFLINE="1")
+        requests_mix = [
+            {"type": "tools/list"},
+            {"type": "tools/call", "name": "specify_version", "arguments": {}},
+            {"type": "tools/call", "name": "specify_check", "arguments": {}},
+        ]
+        proc = subprocess.Popen([sys.executable, str(SPEC_KIT_PY)], env=env, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        try:
+            # Round trips: one request in flight at a time
+            latencies = []
+            with ProcessSampler(proc.pid) as sampler:
+                started = time.monotonic()
+                for i in range(args.requests):
+                    t0 = time.perf_counter()
+                    proc.stdin.write(json.dumps(requests_mix[i % len(requests_mix)]) + "\n")
+                    proc.stdin.flush()
+                    proc.stdout.readline()
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                round_trip_elapsed = time.monotonic() - started
+
+                # Pipelined: write the whole stream while reading responses
+                def write_all():
+                    for i in range(args.requests):
+                        proc.stdin.write(json.dumps(requests_mix[i % len(requests_mix)]) + "\n")
+                    proc.stdin.flush()
+
+                started = time.monotonic()
+                writer = threading.Thread(target=write_all)
+                writer.start()
+                for _ in range(args.requests):
+                    proc.stdout.readline()
+                writer.join()
+                pipelined_elapsed = time.monotonic() - started
+        finally:
+            proc.stdin.close()
+            proc.wait(timeout=10)
+        return {
+            "mode": "stdio",
+            "requests": args.requests,
+            "round_trip": summarize(latencies, 0, round_trip_elapsed),
+            "pipelined": {
+                "requests": args.requests,
+                "duration_s": round(pipelined_elapsed, 3),
+                "throughput_rps": round(args.requests / pipelined_elapsed, 1),
+            },
+            "process": sampler.result,
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MCP command server and spec-kit front ends")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    http = sub.add_parser("http", help="drive server.py and web/app.py over HTTP")
+    http.add_argument("--concurrency", type=int, default=8)
+    http.add_argument("--duration", type=float, default=10.0, help="seconds")
+    http.add_argument("--mix", default="exec=6,batch=1,health=2,web=1",
+                      help="weighted scenarios: exec, batch, health, commands, web, web_health")
+    http.add_argument("--transport", choices=TRANSPORTS + ("both",), default="tcp",
+                      help="loopback TCP, the servers' Unix sockets, or both one after the other")
+    http.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                      help="extra server environment, e.g. MCP_EXEC_MODE=argv (repeatable)")
+    stdio = sub.add_parser("stdio", help="pipe JSON requests through spec_kit_server.py")
+    stdio.add_argument("--requests", type=int, default=300)
+    for p in (http, stdio):
+        p.add_argument("--output", help="write results JSON to this file (default: stdout only)")
+    args = parser.parse_args()
+
+    result = run_http(args) if args.mode == "http" else run_stdio(args)
+    result["timestamp"] = datetime.now().isoformat()
+    result["python"] = sys.version.split()[0]
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
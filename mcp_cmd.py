@@ -7,14 +7,98 @@ Run allowlisted commands remotely via the MCP API
 import requests
 import json
 import os
+import socket
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool
+from urllib3.connection import HTTPConnection
 
+# http://host:port, or unix:///path/to/server.sock for a server in the same container (MCP_UDS)
 MCP_URL = os.environ.get("MCP_URL", "http://10.10.10.24:3030")
+# Fan-out mode: concurrent requests across all hosts
+DEFAULT_PARALLELISM = int(os.environ.get("MCP_PARALLELISM", 8))
+# Requests to a unix:// server go to this pseudo origin, routed to the socket by UnixSocketAdapter
+UNIX_BASE = "http+unix://mcp"
+
+class UnixHTTPConnection(HTTPConnection):
+    """urllib3 connection over a Unix domain socket instead of TCP"""
+
+    def __init__(self, socket_path, **kwargs):
+        super().__init__("localhost", **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+    def __init__(self, socket_path, **kwargs):
+        super().__init__("localhost", **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        self.num_connections += 1
+        return UnixHTTPConnection(self.socket_path, timeout=self.timeout.connect_timeout)
+
+class UnixSocketAdapter(HTTPAdapter):
+    """Sends every request through one keep-alive pool of Unix socket connections"""
+
+    def __init__(self, socket_path, pool_size=1):
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+        self.pool = UnixHTTPConnectionPool(socket_path, maxsize=pool_size)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.pool
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def close(self):
+        self.pool.close()
+        super().close()
+
+def open_session(url, pool_size=1):
+    """(session, base URL) for a server URL, with a keep-alive pool of up to pool_size connections.
+
+    unix:///path.sock URLs get a session whose requests to UNIX_BASE go over that socket.
+    """
+    session = requests.Session()
+    if url.startswith("unix://"):
+        # Proxy settings from the environment cannot apply to a local socket
+        session.trust_env = False
+        session.mount(UNIX_BASE, UnixSocketAdapter(url[len("unix://"):], pool_size))
+        return session, UNIX_BASE
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session, url.rstrip("/")
+
+_client = None
+
+def client():
+    """(session, base URL) for MCP_URL, shared so consecutive requests reuse one connection"""
+    global _client
+    if _client is None or _client[2] != MCP_URL:
+        session, base = open_session(MCP_URL)
+        _client = (session, base, MCP_URL)
+    return _client[:2]
 
 def run_remote_cmd(cmd):
     """Execute a command on the remote MCP server"""
+    session, base = client()
     try:
-        response = requests.post(f"{MCP_URL}/exec", json={"cmd": cmd}, timeout=30)
+        response = session.post(f"{base}/exec", json={"cmd": cmd}, timeout=30)
         response.raise_for_status()
         result = response.json()
 
@@ -33,10 +117,43 @@ def run_remote_cmd(cmd):
         print(f"❌ Connection error: {e}")
         return False
 
+def run_remote_cmd_stream(cmd):
+    """Execute a command via /exec/stream, printing output as it arrives"""
+    session, base = client()
+    try:
+        with session.post(f"{base}/exec/stream", json={"cmd": cmd}, stream=True, timeout=(10, 90)) as response:
+            if response.status_code != 200:
+                print(f"❌ Error: {response.json().get('error', response.status_code)}")
+                return False
+
+            event = None
+            returncode = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "stdout":
+                        sys.stdout.write(data["data"])
+                        sys.stdout.flush()
+                    elif event == "stderr":
+                        sys.stderr.write(data["data"])
+                        sys.stderr.flush()
+                    elif event == "exit":
+                        returncode = data.get("returncode")
+                        if data.get("timeout"):
+                            print("❌ Error: command timeout", file=sys.stderr)
+            return returncode == 0
+
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Connection error: {e}")
+        return False
+
 def print_commands():
     """Fetch and print allowlisted commands from the remote MCP server"""
+    session, base = client()
     try:
-        response = requests.get(f"{MCP_URL}/commands", timeout=15)
+        response = session.get(f"{base}/commands", timeout=15)
         response.raise_for_status()
         data = response.json()
         cmds = data.get("commands", [])
@@ -50,8 +167,9 @@ def print_commands():
 
 def check_health():
     """Check remote MCP health via /api/health"""
+    session, base = client()
     try:
-        response = requests.get(f"{MCP_URL}/api/health", timeout=10)
+        response = session.get(f"{base}/api/health", timeout=10)
         response.raise_for_status()
         print(json.dumps(response.json(), indent=2))
         return True
@@ -59,25 +177,165 @@ def check_health():
         print(f"❌ Health check failed: {e}")
         return False
 
+def normalize_host(host):
+    """'10.10.10.25' -> 'http://10.10.10.25:3030', '::1' -> 'http://[::1]:3030'.
+
+    Addresses with a scheme (including unix:// socket paths) are kept as given;
+    the default port is only added to bare addresses without one.
+    """
+    host = host.strip().rstrip("/")
+    if "://" in host:
+        return host
+    if host.count(":") > 1 and not host.startswith("["):
+        host = f"[{host}]"  # bare IPv6 literal
+    if urlsplit("http://" + host).port is None:
+        host += ":3030"
+    return "http://" + host
+
+def read_lines(source):
+    """Non-empty, non-comment lines from a file path, '@path' or '-' (stdin)"""
+    source = source[1:] if source.startswith("@") else source
+    handle = sys.stdin if source == "-" else open(source)
+    try:
+        return [line.strip() for line in handle if line.strip() and not line.lstrip().startswith("#")]
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+def exec_on(session, base, host, cmd):
+    """Run one command on one host (reached at base); returns a result record (never raises)"""
+    started = time.perf_counter()
+    record = {"host": host, "cmd": cmd}
+    try:
+        response = session.post(f"{base}/exec", json={"cmd": cmd}, timeout=30)
+        result = response.json()
+        if "error" in result:
+            record.update(returncode=None, error=result["error"])
+        else:
+            record.update(returncode=result.get("returncode"), stdout=result.get("stdout", ""),
+                          stderr=result.get("stderr", ""), cached=result.get("cached", False))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        record.update(returncode=None, error=f"Connection error: {e}")
+    record["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+def print_record(record):
+    status = f"rc={record['returncode']}" if record.get("error") is None else "error"
+    print(f"$ {record['cmd']}  ({status}, {record['duration_ms']} ms)")
+    if record.get("error"):
+        print(f"❌ Error: {record['error']}")
+    if record.get("stdout"):
+        print(record["stdout"].rstrip())
+    if record.get("stderr"):
+        print(record["stderr"].rstrip(), file=sys.stderr)
+
+def run_fanout(hosts, cmds, parallelism=DEFAULT_PARALLELISM, json_lines=False):
+    """Run every command on every host concurrently over per-host keep-alive pools.
+
+    JSON lines are printed as results complete; text output is grouped per host
+    and per command, in input order, once everything has finished.
+    """
+    sessions = {host: open_session(host, min(parallelism, len(cmds))) for host in hosts}
+    results = {}
+    output_lock = threading.Lock()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        futures = {
+            pool.submit(exec_on, *sessions[host], host, cmd): (host, i)
+            for i, cmd in enumerate(cmds) for host in hosts
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            results[futures[future]] = record
+            if json_lines:
+                with output_lock:
+                    print(json.dumps(record), flush=True)
+    elapsed = time.perf_counter() - started
+    for session, _ in sessions.values():
+        session.close()
+
+    failed = sum(1 for r in results.values() if r["returncode"] != 0)
+    if not json_lines:
+        for host in hosts:
+            print(f"== {host} ==")
+            for i in range(len(cmds)):
+                print_record(results[(host, i)])
+            print()
+    summary = (f"{len(results) - failed} ok, {failed} failed: {len(cmds)} command(s) on "
+               f"{len(hosts)} host(s) in {elapsed:.2f}s")
+    print(summary, file=sys.stderr if json_lines else sys.stdout)
+    return failed == 0
+
+def fanout_main(args):
+    """Parse fan-out options: --hosts, --file, --parallel, --json [command]"""
+    hosts, cmds, parallelism, json_lines = [], [], DEFAULT_PARALLELISM, False
+    rest = []
+    i = 0
+    while i < len(args):
+        if args[i] in ("--hosts", "--file") and i + 1 >= len(args):
+            print(f"❌ Error: {args[i]} needs a value")
+            return False
+        if args[i] == "--hosts":
+            value = args[i + 1]
+            hosts += read_lines(value) if value.startswith("@") else value.split(",")
+            i += 2
+        elif args[i] == "--file":
+            cmds += read_lines(args[i + 1])
+            i += 2
+        elif args[i] == "--parallel":
+            value = args[i + 1] if i + 1 < len(args) else ""
+            if not value.isdigit() or int(value) < 1:
+                print(f"❌ Error: --parallel needs a positive number of requests, got {value!r}")
+                return False
+            parallelism = int(value)
+            i += 2
+        elif args[i] == "--json":
+            json_lines = True
+            i += 1
+        else:
+            rest.append(args[i])
+            i += 1
+    if rest:
+        cmds.append(" ".join(rest))
+    if not cmds and not sys.stdin.isatty():
+        cmds = read_lines("-")
+    try:
+        hosts = list(dict.fromkeys(normalize_host(h) for h in hosts if h.strip()))
+    except ValueError as e:
+        print(f"❌ Error: invalid host: {e}")
+        return False
+    if not hosts or not cmds:
+        print("❌ Error: --hosts needs at least one host and one command (argument, --file or stdin)")
+        return False
+    return run_fanout(hosts, cmds, parallelism, json_lines)
+
 if __name__ == "__main__":
     # Optional: allow URL override via --url
     args = sys.argv[1:]
     if not args:
-        print("Usage: python3 mcp_cmd.py [--url http://host:3030] [--list|--health] <allowlisted_command>")
+        print("Usage: python3 mcp_cmd.py [--url http://host:3030|unix:///path.sock] [--list|--health|--stream] <allowlisted_command>")
+        print("       python3 mcp_cmd.py --hosts h1,h2|@hosts.txt [--file cmds.txt|-] [--parallel N] [--json] [command]")
         print("Examples:")
         print("  python3 mcp_cmd.py --url http://10.10.10.24:3030 'uptime'")
+        print("  python3 mcp_cmd.py --url unix:///run/mcp/linuxops.sock 'uptime'")
+        print("  python3 mcp_cmd.py --stream 'git log --oneline -10'")
         print("  python3 mcp_cmd.py --list")
         print("  python3 mcp_cmd.py --health")
+        print("  python3 mcp_cmd.py --hosts 10.10.10.24,10.10.10.25 --file checks.txt --parallel 16")
         sys.exit(1)
 
     if args[0] == "--url" and len(args) >= 3:
         MCP_URL = args[1]
         args = args[2:]
 
-    if args and args[0] == "--list":
+    if "--hosts" in args:
+        success = fanout_main(args)
+    elif args and args[0] == "--list":
         success = print_commands()
     elif args and args[0] == "--health":
         success = check_health()
+    elif args and args[0] == "--stream":
+        success = run_remote_cmd_stream(" ".join(args[1:]))
     else:
         cmd = " ".join(args)
         success = run_remote_cmd(cmd)
@@ -0,0 +1,223 @@
+"""
+Per-execution resource accounting for the MCP front ends
+Commands are reaped with wait4(), whose rusage covers the child and every
+descendant it waited for: user/sys CPU, max RSS, block I/O and context
+switches. Each execution's usage is returned with its result and rolled up
+per command by UsageStats, so the commands that load the host stand out.
+
+A child's max RSS starts at the high-water mark of the process that forked
+it (the kernel keeps it across exec), so small commands would all report
+roughly the size of the server. Only a peak above the forking process's own
+can be the command's; anything at or below it is reported as unknown (None).
+
+asyncio's own subprocess support reaps children in its child watcher and
+throws the rusage away, so `create_subprocess()` starts commands with
+subprocess.Popen and reaps them itself (woken by a pidfd where available),
+exposing the same pid/stdout/stderr/wait()/returncode interface.
+"""
+
+import asyncio
+import os
+import resource
+import subprocess
+import threading
+import time
+import weakref
+
+# Numeric fields of one execution's usage that are summed per command
+SUMMED = ("wall_ms", "queue_wait_ms", "cpu_user_ms", "cpu_sys_ms", "block_in", "block_out",
+          "ctx_voluntary", "ctx_involuntary")
+# Fields UsageStats.snapshot() can sort by
+SORT_KEYS = SUMMED + ("count", "errors", "cpu_ms", "avg_cpu_ms", "avg_wall_ms", "max_wall_ms", "max_rss_kb")
+
+
+def own_peak_rss_kb() -> int:
+    """High-water RSS of this process, which every child it forks starts from."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def usage(ru, wall_s: float, queue_wait_s: float = 0.0, rss_floor_kb: int = None) -> dict:
+    """Usage dict from a struct_rusage (or anything with the same ru_* attributes).
+
+    `rss_floor_kb` is the peak RSS of the process that forked the command
+    (default: this one); `max_rss_kb` is None unless the command exceeded it.
+    """
+    if rss_floor_kb is None:
+        rss_floor_kb = own_peak_rss_kb()
+    return {
+        "wall_ms": round(wall_s * 1000, 3),
+        "queue_wait_ms": round(queue_wait_s * 1000, 3),
+        "cpu_user_ms": round(ru.ru_utime * 1000, 3),
+        "cpu_sys_ms": round(ru.ru_stime * 1000, 3),
+        "max_rss_kb": ru.ru_maxrss if ru.ru_maxrss > rss_floor_kb else None,
+        "block_in": ru.ru_inblock,
+        "block_out": ru.ru_oublock,
+        "ctx_voluntary": ru.ru_nvcsw,
+        "ctx_involuntary": ru.ru_nivcsw,
+    }
+
+
+def wait(proc: subprocess.Popen):
+    """Reap a Popen with wait4(); sets proc.returncode and returns its rusage."""
+    _, status, ru = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return ru
+
+
+class _PipeProtocol(asyncio.StreamReaderProtocol):
+    def eof_received(self):
+        super().eof_received()
+        # A pipe has no write side to keep open; let the transport close (uvloop honours this)
+        return False
+
+
+class Process:
+    """A running command, like asyncio.subprocess.Process plus `rusage` once it exited."""
+
+    def __init__(self, popen: subprocess.Popen, started: float):
+        self._popen = popen
+        self.pid = popen.pid
+        self.stdout = None
+        self.stderr = None
+        self.returncode = None
+        self.rusage = None
+        self.started = started
+        self.ended = None
+        self._loop = asyncio.get_running_loop()
+        self._exited = self._loop.create_future()
+        self._transports = []
+        # Close pipe transports nobody read to EOF (e.g. after a timeout kill)
+        weakref.finalize(self, _close_all, self._transports)
+
+    async def _connect(self, pipe):
+        reader = asyncio.StreamReader(limit=2 ** 16, loop=self._loop)
+        transport, _ = await self._loop.connect_read_pipe(
+            lambda: _PipeProtocol(reader, loop=self._loop), pipe)
+        self._transports.append(transport)
+        return reader
+
+    def _watch(self):
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            # No pidfd (old kernel, non-Linux): block in wait4 on a thread of our own
+            threading.Thread(target=self._wait_thread, daemon=True).start()
+            return
+
+        def readable():
+            self._loop.remove_reader(pidfd)
+            os.close(pidfd)
+            self._reaped(self._wait4())
+
+        self._loop.add_reader(pidfd, readable)
+
+    def _wait4(self):
+        try:
+            return os.wait4(self.pid, 0)
+        except ChildProcessError:
+            # Reaped by someone else; like asyncio, report 255 without usage
+            return self.pid, 255 << 8, None
+
+    def _wait_thread(self):
+        result = self._wait4()
+        self._loop.call_soon_threadsafe(self._reaped, result)
+
+    def _reaped(self, result):
+        _, status, self.rusage = result
+        self.ended = time.perf_counter()
+        self.returncode = self._popen.returncode = os.waitstatus_to_exitcode(status)
+        self._exited.set_result(self.returncode)
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+    async def communicate(self) -> tuple:
+        """Read stdout and stderr to EOF and wait for exit; returns (stdout, stderr)."""
+        async def read(reader):
+            return await reader.read() if reader is not None else None
+
+        stdout, stderr, _ = await asyncio.gather(read(self.stdout), read(self.stderr), self.wait())
+        return stdout, stderr
+
+    def close(self):
+        """Stop reading stdout/stderr, e.g. after killing the command; unread output is dropped."""
+        _close_all(self._transports)
+
+    def usage(self, queue_wait_s: float = 0.0):
+        """Usage dict of the finished command (None while running or when unknown)."""
+        if self.rusage is None:
+            return None
+        return usage(self.rusage, self.ended - self.started, queue_wait_s)
+
+
+def _close_all(transports):
+    for transport in transports:
+        transport.close()
+
+
+async def create_subprocess(args, shell: bool = False, stdin=None, stdout=None, stderr=None,
+                            **popen_kwargs) -> Process:
+    """Start a command (argv list, or a string with shell=True) as an accounted Process.
+
+    stdin/stdout/stderr take asyncio.subprocess.PIPE/DEVNULL, file descriptors or None.
+    Raises FileNotFoundError like asyncio.create_subprocess_exec when the binary is missing.
+    """
+    started = time.perf_counter()
+    popen = subprocess.Popen(args, shell=shell, stdin=stdin, stdout=stdout, stderr=stderr, **popen_kwargs)
+    proc = Process(popen, started)
+    try:
+        if popen.stdout is not None:
+            proc.stdout = await proc._connect(popen.stdout)
+        if popen.stderr is not None:
+            proc.stderr = await proc._connect(popen.stderr)
+    finally:
+        proc._watch()
+    return proc
+
+
+class UsageStats:
+    """Per-command totals of execution usage; thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+
+    def record(self, command: str, usage: dict, ok: bool = True):
+        if usage is None:
+            return
+        with self._lock:
+            row = self._commands.get(command)
+            if row is None:
+                row = self._commands[command] = dict.fromkeys(SUMMED, 0)
+                row.update(count=0, errors=0, max_wall_ms=0.0, max_rss_kb=0)
+            row["count"] += 1
+            row["errors"] += not ok
+            for key in SUMMED:
+                row[key] += usage[key]
+            row["max_wall_ms"] = max(row["max_wall_ms"], usage["wall_ms"])
+            row["max_rss_kb"] = max(row["max_rss_kb"], usage["max_rss_kb"] or 0)
+
+    def snapshot(self, sort: str = "cpu_ms", limit: int = None) -> list:
+        """Per-command aggregates, heaviest first by `sort` (one of SORT_KEYS)."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        with self._lock:
+            rows = [(command, dict(row)) for command, row in self._commands.items()]
+        result = []
+        for command, row in rows:
+            cpu_ms = row["cpu_user_ms"] + row["cpu_sys_ms"]
+            entry = {"command": command, "count": row["count"], "errors": row["errors"], "cpu_ms": cpu_ms,
+                     "avg_cpu_ms": cpu_ms / row["count"], "avg_wall_ms": row["wall_ms"] / row["count"]}
+            entry.update(row)
+            result.append({k: round(v, 3) if isinstance(v, float) else v for k, v in entry.items()})
+        result.sort(key=lambda entry: entry[sort], reverse=True)
+        return result[:limit] if limit else result
+
+    def totals(self) -> dict:
+        with self._lock:
+            rows = list(self._commands.values())
+        return {
+            "commands": len(rows),
+            "executions": sum(row["count"] for row in rows),
+            "cpu_ms": round(sum(row["cpu_user_ms"] + row["cpu_sys_ms"] for row in rows), 3),
+        }
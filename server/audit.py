@@ -0,0 +1,242 @@
+"""
+Audit trail for the MCP front ends
+Every exec (server.py) and specify run (spec_kit_server.py, web/app.py) is
+appended as one JSON line: who asked, what, whether it was allowed, how long
+it took and how it exited.
+
+Records go into a bounded in-memory queue and a background thread writes them
+in batches, fsyncing at most once per flush interval, so a request never waits
+for the disk. When the queue is full (the disk is stalled or slower than the
+request rate) records are dropped and counted instead. Files are rotated by
+size, optionally gzip-compressed. Several processes may share one file:
+writers hold a shared flock on <file>.lock while appending and rotation an
+exclusive one, and a writer reopens the file once another process rotated it.
+"""
+
+import atexit
+import fcntl
+import gzip
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# Directory for <source>.jsonl audit logs; empty disables auditing
+AUDIT_DIR = os.environ.get("MCP_AUDIT_DIR", "/opt/mcp/data/audit")
+# Records buffered in memory before new ones are dropped
+BUFFER = int(os.environ.get("MCP_AUDIT_BUFFER", "10000"))
+# Seconds between fsyncs; records written in between are fsynced together (0 = every batch)
+FLUSH_INTERVAL = float(os.environ.get("MCP_AUDIT_FLUSH_INTERVAL", "1.0"))
+# Most records written per batch
+BATCH = 1000
+# Rotate once the file reaches this size; keep this many rotated files
+MAX_BYTES = int(os.environ.get("MCP_AUDIT_MAX_BYTES", str(64 * 1024 * 1024)))
+BACKUPS = int(os.environ.get("MCP_AUDIT_BACKUPS", "10"))
+# gzip rotated files
+COMPRESS = os.environ.get("MCP_AUDIT_COMPRESS", "1") == "1"
+
+_STOP = object()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class AuditLog:
+    """Append-only JSON lines log written by a background thread.
+
+    A log without a path records nothing, so callers never need to check
+    whether auditing is enabled.
+    """
+
+    def __init__(self, path, source: str, buffer: int = BUFFER, flush_interval: float = FLUSH_INTERVAL,
+                 max_bytes: int = MAX_BYTES, backups: int = BACKUPS, compress: bool = COMPRESS):
+        self.path = str(path) if path else None
+        self.source = source
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rotations = 0
+        self.last_error = None
+        self._queue = queue.Queue(maxsize=max(buffer, 1))
+        self._file = None
+        self._lock = None  # flock'ed shared while writing, exclusively while rotating
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def record(self, action: str, decision: str, **fields):
+        """Queue one record; never blocks, drops it when the buffer is full."""
+        if self.path is None:
+            return
+        if self._thread is None:
+            self._start()
+        record = {"ts": _now(), "source": self.source, "action": action, "decision": decision, **fields}
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5.0):
+        """Write and fsync what is still queued, then stop the writer."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queued": self._queue.qsize(),
+            "rotations": self.rotations,
+            "last_error": self.last_error,
+        }
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"audit-{self.source}", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        synced_at = time.monotonic()
+        unsynced = False
+        stopping = False
+        while not stopping:
+            timeout = max(synced_at + self.flush_interval - time.monotonic(), 0) if unsynced else None
+            batch = []
+            try:
+                item = self._queue.get(timeout=timeout)
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= BATCH:
+                        break
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            if batch and self._write(batch):
+                unsynced = True
+            if unsynced and (stopping or time.monotonic() - synced_at >= self.flush_interval):
+                self._sync()
+                synced_at = time.monotonic()
+                unsynced = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def _open(self):
+        """The open log file, reopened when another process rotated it away."""
+        if self._file is not None:
+            try:
+                current = os.stat(self.path)
+                opened = os.fstat(self._file.fileno())
+                if (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                    return self._file
+            except FileNotFoundError:
+                pass
+            self._file.close()
+            self._file = None
+        self._file = open(self.path, "ab")
+        return self._file
+
+    def _write(self, batch: list) -> bool:
+        data = b"".join(json.dumps(record, separators=(",", ":"), default=str).encode() + b"\n"
+                        for record in batch)
+        try:
+            if self._lock is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._lock = open(self.path + ".lock", "a")
+            fcntl.flock(self._lock, fcntl.LOCK_SH)
+            try:
+                f = self._open()
+                # One write per batch: O_APPEND keeps lines from several processes whole
+                f.write(data)
+                f.flush()
+                full = self.max_bytes and f.tell() >= self.max_bytes
+            finally:
+                fcntl.flock(self._lock, fcntl.LOCK_UN)
+        except OSError as e:
+            self._failed(len(batch), e)
+            return False
+        self.written += len(batch)
+        self.last_error = None
+        if full:
+            try:
+                self._rotate()
+            except OSError as e:
+                self._failed(0, e)
+        return True
+
+    def _sync(self):
+        if self._file is None:
+            return
+        try:
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            self._failed(0, e)
+
+    def _failed(self, count: int, error: OSError):
+        self.failed += count
+        if self.last_error is None:
+            sys.stderr.write(f"Audit log {self.path} not writable: {error}\n")
+        self.last_error = str(error)
+
+    def backup_path(self, n: int) -> str:
+        return f"{self.path}.{n}.gz" if self.compress else f"{self.path}.{n}"
+
+    def _rotate(self):
+        """Move the full file to .1 (compressed), shifting older ones up and dropping the oldest."""
+        os.fsync(self._file.fileno())
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            # Another process may have rotated it while we waited for the lock
+            try:
+                if os.stat(self.path).st_size < self.max_bytes:
+                    return
+            except FileNotFoundError:
+                return
+            for n in range(self.backups - 1, 0, -1):
+                if os.path.exists(self.backup_path(n)):
+                    os.replace(self.backup_path(n), self.backup_path(n + 1))
+            if self.backups < 1:
+                os.unlink(self.path)
+            elif self.compress:
+                rotated = f"{self.path}.rotating"
+                os.replace(self.path, rotated)
+                with open(rotated, "rb") as src, gzip.open(self.backup_path(1) + ".tmp", "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(self.backup_path(1) + ".tmp", self.backup_path(1))
+                os.unlink(rotated)
+            else:
+                os.replace(self.path, self.backup_path(1))
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        self.rotations += 1
+
+
+def open_log(source: str) -> AuditLog:
+    """The audit log of one front end, AUDIT_DIR/<source>.jsonl (disabled when AUDIT_DIR is empty)."""
+    return AuditLog(os.path.join(AUDIT_DIR, f"{source}.jsonl") if AUDIT_DIR else None, source)
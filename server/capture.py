@@ -0,0 +1,253 @@
+"""
+Bounded output capture for /exec
+Keeps the first and last bytes of a command's stdout/stderr in memory and
+spills the full stream to a temp file once it outgrows them, so a
+multi-hundred-MB `journalctl` costs a few hundred KiB of server memory instead
+of several copies of the whole output.
+
+Spilled files are kept for a limited time under a random handle and served in
+byte ranges (memory-mapped) by the API server. Each server process spills into
+its own <directory>/<pid> subdirectory, so instances sharing the directory
+never delete each other's output.
+"""
+
+import asyncio
+import mmap
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+STREAMS = ("stdout", "stderr")
+# Spill writes are batched into blocks of this size before going to disk
+WRITE_BLOCK = 1024 * 1024
+
+
+class StreamCapture:
+    """One stream: everything in memory up to head+tail bytes, then head, tail and a spill file."""
+
+    def __init__(self, path: Path, head_bytes: int, tail_bytes: int, store):
+        self.path = path
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.store = store
+        self.reserved = 0  # disk budget taken from the store for this spill
+        self.total = 0
+        self.memory = bytearray()  # whole output until it exceeds head+tail
+        self.head = None
+        self.tail = None
+        self.file = None
+        self.pending = bytearray()
+        self.spilled = 0
+        self.spill_complete = True
+
+    async def feed(self, data: bytes):
+        self.total += len(data)
+        if self.file is None:
+            self.memory += data
+            if len(self.memory) <= self.head_bytes + self.tail_bytes:
+                return
+            # Outgrew memory: keep head and tail, write everything so far to disk
+            self.head = bytes(self.memory[:self.head_bytes])
+            self.tail = bytearray(self.memory[-self.tail_bytes:] if self.tail_bytes else b"")
+            self.file = await asyncio.to_thread(open, self.path, "wb")
+            data, self.memory = bytes(self.memory), None
+        elif self.tail_bytes:
+            self.tail += data
+            if len(self.tail) > 2 * self.tail_bytes:
+                del self.tail[:-self.tail_bytes]
+        # Reserve disk space before writing, so concurrent spills share one budget;
+        # once it runs out the rest of this stream is only kept in the tail
+        granted = self.store.reserve(len(data)) if self.spill_complete else 0
+        if granted < len(data):
+            self.spill_complete = False
+            data = data[:granted]
+        self.reserved += granted
+        self.pending += data
+        if len(self.pending) >= WRITE_BLOCK:
+            await self._flush()
+
+    async def _flush(self):
+        if self.pending:
+            block, self.pending = bytes(self.pending), bytearray()
+            await asyncio.to_thread(self.file.write, block)
+            self.spilled += len(block)
+
+    async def close(self):
+        if self.file is not None:
+            await self._flush()
+            await asyncio.to_thread(self.file.close)
+
+    def info(self) -> dict:
+        tail = bytes(self.tail[-self.tail_bytes:]) if self.tail_bytes else b""
+        return {
+            "bytes": self.total,
+            "head_bytes": len(self.head),
+            "tail_bytes": len(tail),
+            "omitted_bytes": self.total - len(self.head) - len(tail),
+            "spilled_bytes": self.spilled,
+            "complete": self.spill_complete,
+        }
+
+
+class Capture:
+    """stdout and stderr of one command, sharing one output handle."""
+
+    def __init__(self, store, head_bytes: int, tail_bytes: int):
+        self.store = store
+        self.handle = uuid.uuid4().hex
+        self.streams = {
+            name: StreamCapture(store.path(self.handle, name), head_bytes, tail_bytes, store)
+            for name in STREAMS
+        }
+
+    async def feed(self, name: str, data: bytes):
+        await self.streams[name].feed(data)
+
+    async def finish(self, cmd: str) -> dict:
+        """stdout/stderr text for the response, plus truncation info and the handle when spilled."""
+        result = {}
+        truncated = {}
+        for name, stream in self.streams.items():
+            await stream.close()
+            if stream.file is None:
+                result[name] = stream.memory.decode(errors="replace")
+                continue
+            info = stream.info()
+            truncated[name] = info
+            tail = bytes(stream.tail[-stream.tail_bytes:]) if stream.tail_bytes else b""
+            marker = (f"\n[... {info['omitted_bytes']} bytes omitted; "
+                      f"GET /output/{self.handle}/{name}?offset={info['head_bytes']} for the full output ...]\n")
+            result[name] = stream.head.decode(errors="replace") + marker + tail.decode(errors="replace")
+        if truncated:
+            expires_at = self.store.register(self.handle, cmd, {n: s.spilled for n, s in self.streams.items()
+                                                                if s.file is not None},
+                                             sum(s.reserved for s in self.streams.values()))
+            result["truncated"] = truncated
+            result["output_handle"] = self.handle
+            result["output_expires_at"] = datetime.fromtimestamp(expires_at).isoformat()
+        return result
+
+    async def discard(self):
+        for stream in self.streams.values():
+            await stream.close()
+        self.store.remove_files(self.handle)
+        self.store.release(sum(s.reserved for s in self.streams.values()))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class OutputStore:
+    """Spilled output files by handle, expiring after `ttl` seconds and bounded to `max_bytes` on disk."""
+
+    def __init__(self, directory: Path, ttl: float, max_bytes: int):
+        self.directory = directory / str(os.getpid())
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # handle -> {"cmd", "created", "expires", "sizes"}
+        self._disk = 0  # bytes of registered outputs
+        self._reserved = 0  # bytes reserved by spills still being written
+        directory.mkdir(parents=True, exist_ok=True, mode=0o700)
+        # Files of exited servers (or of an earlier process with our pid) have no metadata
+        # and can never be served; those of live instances are left alone
+        for owner in directory.iterdir():
+            if owner.is_dir() and owner.name.isdigit() and (owner == self.directory or not _pid_alive(int(owner.name))):
+                shutil.rmtree(owner, ignore_errors=True)
+        self.directory.mkdir(mode=0o700)
+
+    def path(self, handle: str, name: str) -> Path:
+        return self.directory / f"{handle}.{name}.out"
+
+    def capture(self, head_bytes: int, tail_bytes: int) -> Capture:
+        return Capture(self, head_bytes, tail_bytes)
+
+    def reserve(self, size: int) -> int:
+        """How much of `size` bytes a spill may write, evicting the oldest outputs to make room."""
+        with self._lock:
+            while self._entries and self._disk + self._reserved + size > self.max_bytes:
+                oldest, entry = self._entries.popitem(last=False)
+                self._disk -= sum(entry["sizes"].values())
+                self.remove_files(oldest)
+            granted = max(min(size, self.max_bytes - self._disk - self._reserved), 0)
+            self._reserved += granted
+            return granted
+
+    def release(self, reserved: int):
+        with self._lock:
+            self._reserved -= reserved
+
+    def register(self, handle: str, cmd: str, sizes: dict, reserved: int) -> float:
+        """Publish a finished spill; its reservation becomes the registered size."""
+        now = time.time()
+        with self._lock:
+            self._entries[handle] = {"cmd": cmd, "created": now, "expires": now + self.ttl, "sizes": sizes}
+            self._reserved -= reserved
+            self._disk += sum(sizes.values())
+        return now + self.ttl
+
+    def disk_bytes(self) -> int:
+        return self._disk + self._reserved
+
+    def get(self, handle: str):
+        entry = self._entries.get(handle)
+        if entry is None or entry["expires"] < time.time():
+            return None
+        return {
+            "handle": handle,
+            "cmd": entry["cmd"],
+            "created_at": datetime.fromtimestamp(entry["created"]).isoformat(),
+            "expires_at": datetime.fromtimestamp(entry["expires"]).isoformat(),
+            "streams": entry["sizes"],
+        }
+
+    def read_range(self, handle: str, name: str, offset: int, length: int):
+        """(bytes, total size) of a range of a spilled stream, or None if unknown/expired."""
+        meta = self.get(handle)
+        if meta is None or name not in meta["streams"]:
+            return None
+        total = meta["streams"][name]
+        if offset >= total or length <= 0:
+            return b"", total
+        with open(self.path(handle, name), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[offset:offset + length], total
+
+    def delete(self, handle: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+            if entry is not None:
+                self._disk -= sum(entry["sizes"].values())
+        self.remove_files(handle)
+        return entry is not None
+
+    def remove_files(self, handle: str):
+        for name in STREAMS:
+            try:
+                os.unlink(self.path(handle, name))
+            except FileNotFoundError:
+                pass
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [h for h, entry in self._entries.items() if entry["expires"] < now]
+            for handle in expired:
+                self._disk -= sum(self._entries.pop(handle)["sizes"].values())
+        for handle in expired:
+            self.remove_files(handle)
+        return len(expired)
+
+    def stats(self) -> dict:
+        return {"outputs": len(self._entries), "disk_bytes": self.disk_bytes()}
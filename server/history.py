@@ -0,0 +1,245 @@
+"""
+Persistent execution history for the Spec-Kit web UI
+Entries are stored in SQLite (WAL) so history survives restarts and is shared
+by every worker process. Summaries and outputs live in separate tables: listing
+never touches the (zlib-compressed when large) stdout/stderr, which are only
+loaded when a single entry is requested.
+
+The most recent summaries are kept in an in-memory ring buffer that serves the
+unfiltered first page; `PRAGMA data_version` tells when another process has
+written and the ring must be reloaded.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+# Outputs larger than this (stdout+stderr bytes) are stored zlib-compressed
+COMPRESS_THRESHOLD = 4096
+# Retention is enforced every this many inserts
+PRUNE_EVERY = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    command TEXT NOT NULL,
+    args TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    returncode INTEGER,
+    duration_ms REAL,
+    output_bytes INTEGER NOT NULL,
+    stored_bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_command ON history(command, id);
+CREATE INDEX IF NOT EXISTS history_success ON history(success, id);
+CREATE INDEX IF NOT EXISTS history_created_at ON history(created_at);
+CREATE TABLE IF NOT EXISTS history_output (
+    id INTEGER PRIMARY KEY,
+    compressed INTEGER NOT NULL,
+    stdout BLOB NOT NULL,
+    stderr BLOB NOT NULL
+);
+"""
+
+SUMMARY_COLUMNS = "id, created_at, command, args, success, returncode, duration_ms, output_bytes"
+
+
+def _encode(text: str, compress: bool) -> bytes:
+    data = text.encode()
+    return zlib.compress(data, 6) if compress else data
+
+
+def _decode(blob: bytes, compressed: bool) -> str:
+    return (zlib.decompress(blob) if compressed else blob).decode(errors="replace")
+
+
+def parse_time(value) -> float:
+    """Epoch seconds from a number or an ISO 8601 string; raises ValueError."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class HistoryStore:
+    """SQLite-backed command history with a ring buffer of recent summaries."""
+
+    def __init__(self, path: Path, ring_size: int = 100, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._ring = deque(maxlen=ring_size)
+        self._ring_version = None
+        self._inserts = 0
+        self.ring_hits = 0
+        with self._lock:
+            self._reload_ring()
+
+    def _data_version(self) -> int:
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _reload_ring(self):
+        rows = self._db.execute(
+            f"SELECT {SUMMARY_COLUMNS} FROM history ORDER BY id DESC LIMIT ?", (self._ring.maxlen,)
+        ).fetchall()
+        self._ring.clear()
+        self._ring.extend(self._summary(row) for row in reversed(rows))
+        self._ring_version = self._data_version()
+
+    def record(self, command: str, args: list, result: dict, duration_ms: float = None) -> int:
+        """Store one run (result has success/stdout/stderr/returncode); returns its id."""
+        stdout, stderr = result.get("stdout") or "", result.get("stderr") or ""
+        output_bytes = len(stdout.encode()) + len(stderr.encode())
+        compress = output_bytes > COMPRESS_THRESHOLD
+        out_blob, err_blob = _encode(stdout, compress), _encode(stderr, compress)
+        created_at = time.time()
+        with self._lock:
+            stale = self._data_version() != self._ring_version
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._db.execute(
+                    "INSERT INTO history (created_at, command, args, success, returncode, duration_ms,"
+                    " output_bytes, stored_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (created_at, command, json.dumps(args), int(bool(result.get("success"))),
+                     result.get("returncode"), duration_ms, output_bytes, len(out_blob) + len(err_blob)),
+                )
+                entry_id = cursor.lastrowid
+                self._db.execute(
+                    "INSERT INTO history_output (id, compressed, stdout, stderr) VALUES (?, ?, ?, ?)",
+                    (entry_id, int(compress), out_blob, err_blob),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._inserts += 1
+            if self._inserts % PRUNE_EVERY == 0:
+                self._prune()
+                stale = True
+            if stale:
+                self._reload_ring()
+            else:
+                self._ring.append({
+                    "id": entry_id,
+                    "timestamp": datetime.fromtimestamp(created_at).isoformat(),
+                    "command": command,
+                    "args": args,
+                    "success": bool(result.get("success")),
+                    "returncode": result.get("returncode"),
+                    "duration_ms": duration_ms,
+                    "output_bytes": output_bytes,
+                })
+                self._ring_version = self._data_version()
+        return entry_id
+
+    def _prune(self):
+        """Keep at most max_entries rows and max_bytes of stored output (newest win)."""
+        row = self._db.execute(
+            "SELECT id FROM (SELECT id, SUM(stored_bytes) OVER (ORDER BY id DESC) AS total,"
+            " ROW_NUMBER() OVER (ORDER BY id DESC) AS n FROM history)"
+            " WHERE total > ? OR n > ? ORDER BY id DESC LIMIT 1",
+            (self.max_bytes, self.max_entries),
+        ).fetchone()
+        if row is not None:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("DELETE FROM history_output WHERE id <= ?", (row[0],))
+            self._db.execute("DELETE FROM history WHERE id <= ?", (row[0],))
+            self._db.execute("COMMIT")
+
+    def list(self, limit: int = 20, cursor: int = None, command: str = None, success: bool = None,
+             since: float = None, until: float = None) -> tuple:
+        """Summaries newest first; returns (entries, next_cursor) where next_cursor is None at the end."""
+        unfiltered = command is None and success is None and since is None and until is None
+        with self._lock:
+            if unfiltered and cursor is None:
+                if self._data_version() != self._ring_version:
+                    self._reload_ring()
+                # The ring is authoritative if it holds the requested page or the whole table
+                if limit < len(self._ring) or len(self._ring) < self._ring.maxlen:
+                    self.ring_hits += 1
+                    entries = list(self._ring)[::-1][:limit]
+                    more = len(self._ring) > limit
+                    return entries, entries[-1]["id"] if more else None
+            where, params = [], []
+            if cursor is not None:
+                where.append("id < ?")
+                params.append(cursor)
+            if command is not None:
+                where.append("command = ?")
+                params.append(command)
+            if success is not None:
+                where.append("success = ?")
+                params.append(int(success))
+            if since is not None:
+                where.append("created_at >= ?")
+                params.append(since)
+            if until is not None:
+                where.append("created_at < ?")
+                params.append(until)
+            sql = f"SELECT {SUMMARY_COLUMNS} FROM history"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            rows = self._db.execute(sql + " ORDER BY id DESC LIMIT ?", (*params, limit + 1)).fetchall()
+        entries = [self._summary(row) for row in rows[:limit]]
+        return entries, entries[-1]["id"] if len(rows) > limit else None
+
+    def get(self, entry_id: int):
+        """Full entry including (decompressed) stdout/stderr, or None."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {SUMMARY_COLUMNS}, compressed, stdout, stderr FROM history"
+                " JOIN history_output USING (id) WHERE id = ?", (entry_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = self._summary(row)
+        entry["result"] = {
+            "success": entry["success"],
+            "stdout": _decode(row["stdout"], row["compressed"]),
+            "stderr": _decode(row["stderr"], row["compressed"]),
+            "returncode": entry["returncode"],
+        }
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("DELETE FROM history_output")
+            self._db.execute("DELETE FROM history")
+            self._db.execute("COMMIT")
+            self._reload_ring()
+
+    def stats(self) -> dict:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(output_bytes), 0), COALESCE(SUM(stored_bytes), 0) FROM history"
+            ).fetchone()
+        return {"entries": row[0], "output_bytes": row[1], "stored_bytes": row[2],
+                "ring_entries": len(self._ring), "ring_hits": self.ring_hits}
+
+    @staticmethod
+    def _summary(row) -> dict:
+        return {
+            "id": row["id"],
+            "timestamp": datetime.fromtimestamp(row["created_at"]).isoformat(),
+            "command": row["command"],
+            "args": json.loads(row["args"]),
+            "success": bool(row["success"]),
+            "returncode": row["returncode"],
+            "duration_ms": row["duration_ms"],
+            "output_bytes": row["output_bytes"],
+        }
@@ -0,0 +1,242 @@
+"""
+Persistent job store for long-running allowlisted commands
+Job metadata and output chunks are kept in SQLite (WAL) so jobs survive
+client disconnects and server restarts. Each job records the process that
+owns it (host:pid:start), so a server sharing the database with others only
+recovers the jobs of owners that are gone.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+# Job states; everything except queued/running is final
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+FINAL_STATES = (SUCCEEDED, FAILED, TIMEOUT, CANCELLED, INTERRUPTED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    cmd TEXT NOT NULL,
+    status TEXT NOT NULL,
+    timeout REAL NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    pid INTEGER,
+    returncode INTEGER,
+    output_bytes INTEGER NOT NULL DEFAULT 0,
+    truncated INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs(finished_at);
+CREATE TABLE IF NOT EXISTS job_output (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    stream TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _process_start(pid: int):
+    """Start time of a process (clock ticks since boot, /proc/<pid>/stat field 22), or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm (field 2) may contain spaces and parentheses; fields after it start at 3
+    return stat.rpartition(")")[2].split()[19]
+
+
+class JobStore:
+    """SQLite-backed job metadata and output, safe to share between threads."""
+
+    def __init__(self, path: Path, owner: str = None):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.host = socket.gethostname()
+        # The start time tells this process apart from an earlier one that had the same pid
+        # (e.g. pid 1 before a container restart); without /proc a random id stands in
+        start = _process_start(os.getpid()) or uuid.uuid4().hex[:12]
+        self.owner = owner or f"{self.host}:{os.getpid()}:{start}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Add columns introduced after a database was created."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def create(self, cmd: str, timeout: float) -> str:
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, cmd, status, timeout, created_at, owner) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, cmd, QUEUED, timeout, time.time(), self.owner),
+        )
+        return job_id
+
+    def mark_running(self, job_id: str, pid: int):
+        self._execute(
+            "UPDATE jobs SET status = ?, pid = ?, started_at = ? WHERE id = ?",
+            (RUNNING, pid, time.time(), job_id),
+        )
+
+    def append_output(self, job_id: str, seq: int, stream: str, data: str, total_bytes: int, truncated: bool):
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT INTO job_output (job_id, seq, stream, data) VALUES (?, ?, ?, ?)",
+                (job_id, seq, stream, data),
+            )
+            self._db.execute(
+                "UPDATE jobs SET output_bytes = ?, truncated = ? WHERE id = ?",
+                (total_bytes, int(truncated), job_id),
+            )
+            self._db.execute("COMMIT")
+
+    def finish(self, job_id: str, status: str, returncode: int = None, error: str = None):
+        self._execute(
+            "UPDATE jobs SET status = ?, returncode = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, returncode, error, time.time(), job_id),
+        )
+
+    def get(self, job_id: str):
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._to_dict(rows[0]) if rows else None
+
+    def list(self, status: str = None, limit: int = 50) -> list:
+        if status:
+            rows = self._execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+            )
+        else:
+            rows = self._execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [self._to_dict(row) for row in rows]
+
+    def output(self, job_id: str, since: int = 0, limit: int = 200) -> list:
+        """Output chunks with seq >= since, oldest first."""
+        rows = self._execute(
+            "SELECT seq, stream, data FROM job_output WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+            (job_id, since, limit),
+        )
+        return [dict(row) for row in rows]
+
+    def _orphaned(self, owner) -> bool:
+        """Whether a job's owner is gone: a process on this host that has exited.
+
+        A live pid whose start time differs from the recorded one is a different
+        process that reused the pid. Jobs from before owners were recorded count
+        as orphaned; jobs owned by other hosts are never claimed, since their
+        processes cannot be checked.
+        """
+        if owner is None:
+            return True
+        if owner == self.owner:
+            return False
+        host, pid, start = (owner.split(":") + [None])[:3]
+        if host != self.host or not pid or not pid.isdigit():
+            return False
+        if not _pid_alive(int(pid)):
+            return True
+        current = _process_start(int(pid))
+        return start is not None and current is not None and current != start
+
+    def recover(self):
+        """After a restart: claim the unfinished jobs of owners that are gone.
+
+        Their running jobs are marked interrupted and their queued ones taken
+        over by this owner, whose ids/cmds are returned. Jobs of live servers
+        sharing the database are left alone.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = [row for row in self._db.execute(
+                    "SELECT id, cmd, status, owner FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                    (QUEUED, RUNNING),
+                ) if self._orphaned(row["owner"])]
+                for row in rows:
+                    if row["status"] == RUNNING:
+                        self._db.execute(
+                            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner = ? WHERE id = ?",
+                            (INTERRUPTED, "server restarted while the job was running", time.time(),
+                             self.owner, row["id"]),
+                        )
+                    else:
+                        self._db.execute("UPDATE jobs SET owner = ? WHERE id = ?", (self.owner, row["id"]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return [(row["id"], row["cmd"]) for row in rows if row["status"] == QUEUED]
+
+    def purge(self, finished_before: float) -> int:
+        """Delete final jobs (and their output) that finished before the given time."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (finished_before,)
+            )]
+            for job_id in ids:
+                self._db.execute("DELETE FROM job_output WHERE job_id = ?", (job_id,))
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._db.execute("COMMIT")
+        return len(ids)
+
+    def counts(self) -> dict:
+        return {row["status"]: row["n"] for row in
+                self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        job = dict(row)
+        job["truncated"] = bool(job["truncated"])
+        for key in ("created_at", "started_at", "finished_at"):
+            job[key] = _iso(job[key])
+        return job
@@ -0,0 +1,60 @@
+"""
+Listening sockets for the MCP front ends
+Builds the TCP and Unix domain sockets that server.py (uvicorn) and
+web/app.py (werkzeug) serve on, so co-located agents can skip the TCP/IP
+stack. A leftover socket file from a previous run is replaced, but one that
+another process is still serving is not.
+"""
+
+import os
+import socket
+import stat
+
+# Pending connections per listening socket
+BACKLOG = 2048
+
+
+def tcp_socket(host: str, port: int, backlog: int = BACKLOG) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.create_server((host, port), family=family, backlog=backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def unix_socket(path: str, mode: int = 0o660, backlog: int = BACKLOG) -> socket.socket:
+    """Bound, listening AF_UNIX socket at `path` with permissions `mode`."""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.unlink(path)  # stale: nobody is listening
+                else:
+                    raise OSError(f"{path} is in use by another server")
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Never expose the socket with looser permissions than asked, not even briefly
+        old_umask = os.umask(0o777 & ~mode)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(path, mode)
+        sock.listen(backlog)
+    except BaseException:
+        sock.close()
+        raise
+    sock.set_inheritable(True)
+    return sock
+
+
+def remove_unix_socket(path: str):
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
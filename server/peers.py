@@ -0,0 +1,203 @@
+"""
+Peer client for MCP federation
+Forwards requests from one MCP node to its peers over pooled keep-alive
+HTTP/1.1 connections (asyncio streams only, no extra dependency) and tracks
+peer health so unreachable nodes are skipped instead of timing out every
+fan-out.
+"""
+
+import asyncio
+import json
+import ssl
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+# Peer responses are small JSON documents; refuse anything absurd
+MAX_BODY = 64 * 1024 * 1024
+
+
+class PeerError(Exception):
+    pass
+
+
+def parse_peers(spec: str) -> list:
+    """'name=http://host:3030,http://other:3030' -> [(name, url), ...]; unnamed peers use host:port."""
+    peers = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, url = item.partition("=")
+        if not sep:
+            name, url = "", item
+        if "://" not in url:
+            url = "http://" + url
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"invalid peer URL: {item}")
+        peers.append((name or parts.netloc, url.rstrip("/")))
+    return peers
+
+
+class Peer:
+    """One peer node: a small pool of keep-alive connections plus health state."""
+
+    def __init__(self, name: str, url: str, pool_size: int = 8):
+        parts = urlsplit(url)
+        self.name = name
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.base_path = parts.path.rstrip("/")
+        self._idle = []  # (reader, writer) connections ready for reuse
+        self._slots = asyncio.Semaphore(pool_size)
+        self.healthy = True
+        self.failures = 0
+        self.last_error = None
+        self.last_check = None
+        self.latency_ms = None
+
+    async def request(self, method: str, path: str, payload=None, timeout: float = 30) -> tuple:
+        """Send a JSON request; returns (status_code, decoded JSON body)."""
+        async with self._slots:
+            return await asyncio.wait_for(self._request(method, path, payload), timeout)
+
+    async def _request(self, method: str, path: str, payload) -> tuple:
+        body = json.dumps(payload).encode() if payload is not None else b""
+        head = (f"{method} {self.base_path}{path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Accept: application/json\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n").encode()
+        while True:
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl, limit=MAX_BODY)
+            try:
+                conn[1].write(head + body)
+                await conn[1].drain()
+                status, data, keep_alive = await self._read_response(conn[0])
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                conn[1].close()
+                if reused:
+                    # The peer closed an idle keep-alive connection; retry on a fresh one
+                    continue
+                raise PeerError(f"connection failed: {e}") from e
+            except BaseException:
+                # Timeout/cancellation mid-response: the connection state is unknown
+                conn[1].close()
+                raise
+            if keep_alive:
+                self._idle.append(conn)
+            else:
+                conn[1].close()
+            try:
+                return status, json.loads(data) if data else None
+            except ValueError as e:
+                raise PeerError(f"invalid JSON from peer (HTTP {status})") from e
+
+    @staticmethod
+    async def _read_response(reader) -> tuple:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by peer")
+        version, _, rest = status_line.decode("latin-1").partition(" ")
+        status = int(rest.split(" ", 1)[0])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            if length > MAX_BODY:
+                raise PeerError(f"response too large ({length} bytes)")
+            data = await reader.readexactly(length)
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        else:
+            data = await reader.read(MAX_BODY)
+            keep_alive = False
+        return status, data, keep_alive
+
+    def mark(self, ok: bool, error: str = None, latency_ms: float = None):
+        """Record a request or probe outcome; failures exclude the peer until a probe succeeds."""
+        if ok:
+            self.healthy = True
+            self.failures = 0
+            self.last_error = None
+        else:
+            self.healthy = False
+            self.failures += 1
+            self.last_error = error
+        if latency_ms is not None:
+            self.latency_ms = round(latency_ms, 3)
+
+    async def probe(self, timeout: float):
+        started = time.perf_counter()
+        try:
+            status, _ = await self.request("GET", "/health", timeout=timeout)
+            self.mark(status == 200, None if status == 200 else f"HTTP {status}",
+                      (time.perf_counter() - started) * 1000)
+        except (PeerError, OSError, asyncio.TimeoutError) as e:
+            self.mark(False, str(e) or type(e).__name__)
+        self.last_check = time.time()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_check": datetime.fromtimestamp(self.last_check).isoformat() if self.last_check else None,
+            "latency_ms": self.latency_ms,
+            "idle_connections": len(self._idle),
+        }
+
+
+class Fleet:
+    """The configured peers of this node."""
+
+    def __init__(self, peers: list, pool_size: int = 8):
+        self.peers = {name: Peer(name, url, pool_size) for name, url in peers}
+
+    def select(self, names=None) -> tuple:
+        """(peers to contact, {name: reason} for skipped ones); unhealthy peers are skipped."""
+        selected, skipped = [], {}
+        for name in names if names is not None else self.peers:
+            peer = self.peers.get(name)
+            if peer is None:
+                skipped[name] = "unknown peer"
+            elif not peer.healthy:
+                skipped[name] = f"unhealthy: {peer.last_error}"
+            else:
+                selected.append(peer)
+        return selected, skipped
+
+    async def probe_all(self, timeout: float):
+        await asyncio.gather(*(peer.probe(timeout) for peer in self.peers.values()))
+
+    def close(self):
+        for peer in self.peers.values():
+            peer.close()
+
+    def stats(self) -> dict:
+        return {
+            "peers": len(self.peers),
+            "healthy": sum(1 for p in self.peers.values() if p.healthy),
+        }
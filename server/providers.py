@@ -0,0 +1,312 @@
+"""
+Native providers for hot Tier 1 monitoring commands
+`uptime`, `free`, `df`, `date`, `uname -a`, `who` and `cat /etc/os-release`
+are answered in-process from /proc, os.statvfs, os.uname and utmp instead of
+forking a shell and a binary to read a few kernel counters.
+
+Each provider returns the text the real command prints (procps-ng 4,
+GNU coreutils 9, C locale) and the same values as structured data, so
+clients do not have to parse the text. test_providers.py checks the text
+against the installed binaries. Under another locale the binaries would print
+translated headers and local date and number formats, so the server only
+uses the providers when c_locale() holds for its environment.
+"""
+
+import math
+import os
+import struct
+import time
+from datetime import datetime
+
+PROC = "/proc"
+UTMP = "/var/run/utmp"
+OS_RELEASE = "/etc/os-release"
+
+# struct utmp on Linux (glibc, 64-bit and 32-bit alike)
+UTMP_RECORD = struct.Struct("<h2xi32s4s32s256shhi2i4i20x")
+USER_PROCESS = 7
+
+# Locale categories that change what the provided commands print: headers, dates, decimal points
+LOCALE_CATEGORIES = ("LC_MESSAGES", "LC_TIME", "LC_NUMERIC")
+C_LOCALES = {"", "C", "POSIX", "C.UTF-8", "C.utf8"}
+
+# Mount types df never shows (gnulib ME_DUMMY)
+DUMMY_FS_TYPES = {"autofs", "proc", "subfs", "debugfs", "devpts", "fusectl", "fuse.portal", "mqueue",
+                  "rpc_pipefs", "sysfs", "devfs", "kernfs", "ignore", "none"}
+
+
+def c_locale(environ=None) -> bool:
+    """Whether commands started with this environment print the C-locale formats the providers reproduce."""
+    environ = os.environ if environ is None else environ
+    for category in LOCALE_CATEGORIES:
+        # setlocale(3) precedence: LC_ALL, then the category, then LANG
+        value = environ.get("LC_ALL") or environ.get(category) or environ.get("LANG", "")
+        if value not in C_LOCALES:
+            return False
+    return True
+
+
+def _cstr(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode(errors="replace")
+
+
+def read_utmp(path: str = None) -> list:
+    """Logged-in user sessions (USER_PROCESS records); empty when there is no utmp."""
+    try:
+        with open(path or UTMP, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    sessions = []
+    for offset in range(0, len(data) - UTMP_RECORD.size + 1, UTMP_RECORD.size):
+        (ut_type, pid, line, _, user, host, _, _, _, tv_sec, _, *_) = UTMP_RECORD.unpack_from(data, offset)
+        user = _cstr(user)
+        if ut_type == USER_PROCESS and user:
+            sessions.append({"user": user, "line": _cstr(line), "host": _cstr(host), "pid": pid,
+                             "login_time": tv_sec})
+    return sessions
+
+
+def uptime():
+    with open(os.path.join(PROC, "uptime")) as f:
+        uptime_s = float(f.read().split()[0])
+    with open(os.path.join(PROC, "loadavg")) as f:
+        load = [float(v) for v in f.read().split()[:3]]
+    users = len(read_utmp())
+    now = time.localtime()
+    # procps-ng sprint_uptime
+    text = f" {now.tm_hour:02d}:{now.tm_min:02d}:{now.tm_sec:02d} up "
+    days = int(uptime_s) // 86400
+    if days:
+        text += f"{days} day{'s' if days != 1 else ''}, "
+    minutes = int(uptime_s) // 60
+    hours, minutes = minutes // 60 % 24, minutes % 60
+    text += f"{hours:2d}:{minutes:02d}, " if hours else f"{minutes} min, "
+    text += f"{users:2d} {'users' if users > 1 else 'user'}, "
+    text += " load average: " + ", ".join(f"{v:.2f}" for v in load) + "\n"
+    return text, {
+        "time": time.strftime("%H:%M:%S", now),
+        "uptime_seconds": uptime_s,
+        "users": users,
+        "load_average": load,
+    }
+
+
+def _meminfo() -> dict:
+    """/proc/meminfo in KiB."""
+    info = {}
+    with open(os.path.join(PROC, "meminfo")) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            info[key] = int(value.split()[0])
+    return info
+
+
+def _float32(value: float) -> float:
+    # procps formats through a C float; round the same way
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def _free_size(kib: int, unit: str) -> str:
+    """procps-ng free scale_size(): -m (MiB, truncated) or -h (binary units, 4 significant chars)."""
+    size = kib * 1024
+    if unit == "m":
+        return str(size // 1024 ** 2)
+    if len(f"{size}B") <= 4:
+        return f"{size}B"
+    for i, prefix in enumerate("KMGTP", start=1):
+        scaled = size / 1024 ** i
+        for text in (f"{_float32(scaled):.1f}{prefix}i", f"{int(scaled)}{prefix}i"):
+            if len(text) <= 5:
+                return text
+    return text
+
+
+def free(unit: str):
+    info = _meminfo()
+    total, free_kib, available = info["MemTotal"], info["MemFree"], info.get("MemAvailable", info["MemFree"])
+    buff_cache = info.get("Buffers", 0) + info.get("Cached", 0) + info.get("SReclaimable", 0)
+    used = total - available if available <= total else total - free_kib
+    swap_total, swap_free = info.get("SwapTotal", 0), info.get("SwapFree", 0)
+    mem = {"total": total, "used": used, "free": free_kib, "shared": info.get("Shmem", 0),
+           "buff_cache": buff_cache, "available": available}
+    swap = {"total": swap_total, "used": swap_total - swap_free, "free": swap_free}
+    lines = ["               total        used        free      shared  buff/cache   available"]
+    for label, row in (("Mem:", mem), ("Swap:", swap)):
+        cells = [_free_size(v, unit) for v in row.values()]
+        lines.append(f"{label:<9s}{cells[0]:>11s}" + "".join(f" {c:>11s}" for c in cells[1:]))
+    to_bytes = lambda row: {k: v * 1024 for k, v in row.items()}
+    return "\n".join(lines) + "\n", {"mem": to_bytes(mem), "swap": to_bytes(swap)}
+
+
+def _unescape(field: str) -> str:
+    # mountinfo escapes space, tab, newline and backslash as \ooo
+    if "\\" not in field:
+        return field
+    return field.encode().decode("unicode_escape").encode("latin-1").decode(errors="replace")
+
+
+def _mounts() -> list:
+    """Mounts as df would list them: no dummy types, one entry per device, in mount order."""
+    devices = {}  # st_dev -> mount; dicts keep first-seen order like df's device list
+    with open(os.path.join(PROC, "self", "mountinfo")) as f:
+        for line in f:
+            fields = line.split()
+            sep = fields.index("-")
+            mount = {"root": _unescape(fields[3]), "target": _unescape(fields[4]),
+                     "fstype": fields[sep + 1], "source": _unescape(fields[sep + 2])}
+            if mount["fstype"] in DUMMY_FS_TYPES:
+                continue
+            try:
+                dev = os.stat(mount["target"]).st_dev
+            except OSError:
+                continue
+            seen = devices.get(dev)
+            if seen is None:
+                devices[dev] = mount
+                continue
+            # coreutils filter_mount_list: real devices, mounts nearer the root and
+            # over-mounts of the same directory replace the entry already seen
+            nearer_root = len(seen["target"]) > len(mount["target"])
+            source_below_root = len(seen["root"]) < len(mount["root"])
+            if (("/" in mount["source"] and "/" not in seen["source"])
+                    or (nearer_root and not source_below_root)
+                    or (seen["source"] != mount["source"] and seen["target"] == mount["target"])):
+                devices[dev] = mount
+    return list(devices.values())
+
+
+def _human(n: int) -> str:
+    """gnulib human_readable() as df -h uses it: powers of 1024, rounded up, one decimal below 10."""
+    base, amt, tenths, rounding, exponent, point = 1024, n, 0, 0, 0, None
+    if amt >= base:
+        while True:
+            r10 = (amt % base) * 10 + tenths
+            r2 = (r10 % base) * 2 + (rounding >> 1)
+            amt //= base
+            tenths = r10 // base
+            rounding = int(r2 + rounding != 0) if r2 < base else 2 + int(base < r2 + rounding)
+            exponent += 1
+            if amt < base or exponent >= 8:
+                break
+        if amt < 10:
+            if rounding > 0:
+                tenths, rounding = tenths + 1, 0
+                if tenths == 10:
+                    amt, tenths = amt + 1, 0
+            if amt < 10:
+                point, tenths, rounding = str(tenths), 0, 0
+    if tenths + rounding > 0:
+        amt += 1
+        if amt == base and exponent < 8:
+            exponent, point, amt = exponent + 1, "0", 1
+    return f"{amt}{'.' + point if point is not None else ''}{'KMGTPEZY'[exponent - 1] if exponent else ''}"
+
+
+def _percent(used: int, available: int) -> str:
+    if used + available <= 0:
+        return "-"
+    return f"{math.ceil(used * 100 / (used + available))}%" if used >= 0 else "-"
+
+
+def _table(rows: list, min_widths: list) -> str:
+    """Columns as df prints them: first and last left-aligned, numbers right-aligned."""
+    widths = [max([w] + [len(row[i]) for row in rows]) for i, w in enumerate(min_widths)]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(row[1:-1], widths[1:-1])] + [row[-1]]
+        lines.append(" ".join(cells))
+    return "\n".join(lines) + "\n"
+
+
+def df(inodes: bool):
+    rows, filesystems = [], []
+    for mount in _mounts():
+        try:
+            st = os.statvfs(mount["target"])
+        except OSError:
+            continue
+        if st.f_blocks == 0:
+            continue
+        entry = {"filesystem": mount["source"], "type": mount["fstype"], "mounted_on": mount["target"]}
+        if inodes:
+            used = st.f_files - st.f_ffree
+            entry.update(inodes=st.f_files, iused=used, ifree=st.f_ffree)
+            cells = [str(st.f_files), str(used), str(st.f_ffree), _percent(used, st.f_ffree)]
+        else:
+            used = st.f_blocks - st.f_bfree
+            entry.update(size=st.f_blocks * st.f_frsize, used=used * st.f_frsize,
+                         available=st.f_bavail * st.f_frsize)
+            cells = [_human(entry["size"]), _human(entry["used"]), _human(entry["available"]),
+                     _percent(used, st.f_bavail)]
+        entry["use_percent"] = None if cells[-1] == "-" else int(cells[-1][:-1])
+        filesystems.append(entry)
+        rows.append([mount["source"], *cells, mount["target"]])
+    if inodes:
+        header, min_widths = ["Filesystem", "Inodes", "IUsed", "IFree", "IUse%", "Mounted on"], [14, 5, 5, 5, 5, 0]
+    else:
+        header, min_widths = ["Filesystem", "Size", "Used", "Avail", "Use%", "Mounted on"], [14, 5, 5, 5, 4, 0]
+    return _table([header] + rows, min_widths), {"filesystems": filesystems}
+
+
+def date():
+    now = time.time()
+    local = time.localtime(now)
+    return time.strftime("%a %b %e %H:%M:%S %Z %Y", local) + "\n", {
+        "iso": datetime.fromtimestamp(now).astimezone().isoformat(),
+        "epoch": now,
+        "timezone": time.strftime("%Z", local),
+    }
+
+
+def uname():
+    u = os.uname()
+    # coreutils omits processor and hardware platform when they are "unknown", as on Linux
+    text = f"{u.sysname} {u.nodename} {u.release} {u.version} {u.machine} GNU/Linux\n"
+    return text, {"sysname": u.sysname, "nodename": u.nodename, "release": u.release,
+                  "version": u.version, "machine": u.machine, "operating_system": "GNU/Linux"}
+
+
+def who():
+    lines, users = [], []
+    for session in read_utmp():
+        login = time.localtime(session["login_time"])
+        host = f"({session['host']})" if session["host"] else ""
+        # coreutils print_line() in the C locale, trailing spaces removed
+        lines.append(f"{session['user']:<8s} {session['line']:<12s} {time.strftime('%b %e %H:%M', login):<12s} "
+                     f"{host}".rstrip())
+        users.append({"user": session["user"], "line": session["line"], "host": session["host"] or None,
+                      "login_time": datetime.fromtimestamp(session["login_time"]).astimezone().isoformat()})
+    return "".join(line + "\n" for line in lines), {"users": users}
+
+
+def os_release():
+    with open(OS_RELEASE) as f:
+        text = f.read()
+    data = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition("=")
+        if sep and not key.startswith("#"):
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            data[key.strip()] = value
+    return text, data
+
+
+PROVIDERS = {
+    "uptime": uptime,
+    "free -m": lambda: free("m"),
+    "free -h": lambda: free("h"),
+    "df -h": lambda: df(inodes=False),
+    "df -i": lambda: df(inodes=True),
+    "date": date,
+    "uname -a": uname,
+    "who": who,
+    "cat /etc/os-release": os_release,
+}
+
+
+def lookup(cmd: str):
+    """Provider for exactly this command (whitespace-normalized), or None."""
+    return PROVIDERS.get(" ".join(cmd.split()))
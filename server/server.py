@@ -1,61 +1,1843 @@
+import asyncio
+import codecs
+import contextlib
+import json
+import functools
+import gzip
+import heapq
+import ipaddress
+import math
 import os
-import subprocess
+import re
+import shlex
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import types
+from collections import OrderedDict, deque
+from datetime import datetime
 from pathlib import Path
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Query, Request
+import accounting
+import audit
+import capture
+import jobs
+import listeners
+import metrics
+import peers
+import providers
+import spawner
+import watches
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import uvicorn
 
 SERVER_NAME = "linuxOps"
+# Listeners: TCP on MCP_HOST:MCP_PORT unless MCP_TCP=0, and/or a Unix domain socket at
+# MCP_UDS (e.g. /run/mcp/linuxops.sock) with permissions MCP_UDS_MODE for co-located agents
+HOST = os.environ.get("MCP_HOST", "0.0.0.0")
+PORT = int(os.environ.get("MCP_PORT", 3030))
+LISTEN_TCP = os.environ.get("MCP_TCP", "1") == "1"
+UDS_PATH = os.environ.get("MCP_UDS", "")
+UDS_MODE = int(os.environ.get("MCP_UDS_MODE", "660"), 8)
+# Seconds an idle keep-alive connection stays open (uvicorn's default of 5 makes polling
+# agents reconnect all the time)
+KEEPALIVE_TIMEOUT = int(os.environ.get("MCP_KEEPALIVE_TIMEOUT", "75"))
+# Socket file this process bound (set by __main__), removed on shutdown
+bound_uds = None
 SAFE_BASE = Path("/opt/mcp/safefs").resolve()
-ALLOWLIST_FILE = Path("/opt/mcp/server/allowed_cmds.txt").resolve()
+ALLOWLIST_FILE = Path(os.environ.get("MCP_ALLOWLIST_FILE", "/opt/mcp/server/allowed_cmds.txt")).resolve()
+# How often (seconds) the allowlist file is stat()ed for changes
+ALLOWLIST_CHECK_INTERVAL = float(os.environ.get("MCP_ALLOWLIST_CHECK_INTERVAL", "1.0"))
+# Number of recent allow/deny decisions kept per allowlist generation
+DECISION_CACHE_SIZE = int(os.environ.get("MCP_DECISION_CACHE_SIZE", "4096"))
+# How allowed commands are started: "shell" (via /bin/sh, the historical behaviour) or
+# "argv" (shlex-split and exec'd directly); entries can override with `# exec=shell|argv`
+EXEC_MODE = os.environ.get("MCP_EXEC_MODE", "shell")
+# Answer the Tier 1 monitoring commands in providers.py in-process instead of spawning them:
+# "auto" only when the server runs in the C/POSIX locale whose output they reproduce, "1" always,
+# "0" never; entries that set `# exec=shell|argv` always spawn
+NATIVE_PROVIDERS = os.environ.get("MCP_NATIVE_PROVIDERS", "auto")
+NATIVE_PROVIDERS = NATIVE_PROVIDERS == "1" or (NATIVE_PROVIDERS == "auto" and providers.c_locale())
+# Per-command timeout in seconds
+EXEC_TIMEOUT = float(os.environ.get("MCP_EXEC_TIMEOUT", "60"))
+# Commands allowed to run at the same time across all requests
+MAX_CONCURRENCY = int(os.environ.get("MCP_MAX_CONCURRENCY", "8"))
+# Requests allowed to wait for a free slot before new ones are rejected
+MAX_QUEUE = int(os.environ.get("MCP_MAX_QUEUE", "32"))
+# Longest time (seconds) a queued request waits for a slot
+QUEUE_TIMEOUT = float(os.environ.get("MCP_QUEUE_TIMEOUT", "30"))
+# Retry-After value (seconds) sent with 503 responses when the queue is full
+RETRY_AFTER = int(os.environ.get("MCP_RETRY_AFTER", "2"))
+# Scheduling: allowlist tiers served by the fast lane and the slots reserved for it out of
+# MCP_MAX_CONCURRENCY; the rest are shared by weighted fair queueing across clients
+FAST_LANE_TIERS = {int(t) for t in os.environ.get("MCP_FAST_LANE_TIERS", "1").split(",") if t.strip()}
+FAST_LANE_SLOTS = int(os.environ.get("MCP_FAST_LANE_SLOTS", "2"))
+# Client identity: the peer address. A request header (e.g. X-MCP-Client; unset = never)
+# names the client instead, but only on requests from MCP_TRUSTED_PROXIES: addresses or
+# networks ("10.0.0.5,192.168.0.0/24"), plus "local" for Unix socket connections
+CLIENT_HEADER = os.environ.get("MCP_CLIENT_HEADER", "")
+TRUSTED_PROXIES = [item.strip() for item in os.environ.get("MCP_TRUSTED_PROXIES", "").split(",") if item.strip()]
+TRUSTED_NETWORKS = [ipaddress.ip_network(item, strict=False) for item in TRUSTED_PROXIES if item != "local"]
+# Fair-share weights per client ("alerting=4,ci=0.5"; default 1) and the per-client rate
+# limit in cost units per second with its burst (0 = unlimited)
+CLIENT_WEIGHTS = {name.strip(): float(weight) for name, _, weight in
+                  (item.partition("=") for item in os.environ.get("MCP_CLIENT_WEIGHTS", "").split(","))
+                  if name.strip()}
+CLIENT_RATE = float(os.environ.get("MCP_CLIENT_RATE", "0"))
+CLIENT_BURST = float(os.environ.get("MCP_CLIENT_BURST", "20"))
+# Max bytes read from a pipe per streamed chunk, and chunks buffered per stream
+STREAM_CHUNK_SIZE = int(os.environ.get("MCP_STREAM_CHUNK_SIZE", "65536"))
+STREAM_BUFFER_CHUNKS = 16
+# Upper bounds for /exec/batch: commands per request and commands run in parallel per request
+BATCH_MAX_CMDS = int(os.environ.get("MCP_BATCH_MAX_CMDS", "32"))
+BATCH_MAX_PARALLELISM = int(os.environ.get("MCP_BATCH_MAX_PARALLELISM", "4"))
+# Maximum number of stages in one /exec/pipeline request
+PIPELINE_MAX_STAGES = int(os.environ.get("MCP_PIPELINE_MAX_STAGES", "8"))
+# /exec output capture: bytes of each stream's head and tail kept in memory; beyond that the
+# full stream is spilled to MCP_OUTPUT_SPILL_DIR and served by /output/{handle} for
+# MCP_OUTPUT_TTL seconds, with at most MCP_OUTPUT_SPILL_MAX_BYTES on disk
+OUTPUT_HEAD_BYTES = int(os.environ.get("MCP_OUTPUT_HEAD_BYTES", str(256 * 1024)))
+OUTPUT_TAIL_BYTES = int(os.environ.get("MCP_OUTPUT_TAIL_BYTES", str(256 * 1024)))
+OUTPUT_SPILL_DIR = Path(os.environ.get(
+    "MCP_OUTPUT_SPILL_DIR", os.path.join(tempfile.gettempdir(), f"mcp-output-{os.getuid()}")))
+OUTPUT_TTL = float(os.environ.get("MCP_OUTPUT_TTL", "900"))
+OUTPUT_SPILL_MAX_BYTES = int(os.environ.get("MCP_OUTPUT_SPILL_MAX_BYTES", str(2 * 1024 ** 3)))
+# Largest range served by one /output request
+OUTPUT_RANGE_MAX = 16 * 1024 * 1024
+OUTPUT_PURGE_INTERVAL = 60
+# /watch: shortest and longest interval (seconds), distinct (command, interval) watches
+# running at once, events buffered per subscriber before it is resynchronized with a
+# snapshot, and seconds between SSE keep-alive comments while nothing changes
+WATCH_MIN_INTERVAL = float(os.environ.get("MCP_WATCH_MIN_INTERVAL", "1"))
+WATCH_MAX_INTERVAL = 3600
+WATCH_MAX_ACTIVE = int(os.environ.get("MCP_WATCH_MAX_ACTIVE", "64"))
+WATCH_BUFFER = 16
+WATCH_KEEPALIVE = 15
+# Distinct commands kept in the TTL result cache (entries opt in with `# ttl=<seconds>`)
+RESULT_CACHE_SIZE = int(os.environ.get("MCP_RESULT_CACHE_SIZE", "256"))
+# Launch commands through the pre-started spawner helper (spawner.py) instead of forking
+# this process; the helper is shared with the web UI when both use the same socket
+USE_SPAWNER = os.environ.get("MCP_SPAWNER", "0") == "1"
+SPAWNER_SOCKET = os.environ.get("MCP_SPAWNER_SOCKET", spawner.DEFAULT_SOCKET)
+# Background jobs (/jobs): SQLite store, concurrency, queue bound, default timeout
+# (entries override with `# timeout=<seconds>`), stored output cap and retention
+JOBS_DB = Path(os.environ.get("MCP_JOBS_DB", "/opt/mcp/data/jobs.db"))
+JOB_CONCURRENCY = int(os.environ.get("MCP_JOB_CONCURRENCY", "2"))
+JOB_MAX_QUEUED = int(os.environ.get("MCP_JOB_MAX_QUEUED", "64"))
+JOB_TIMEOUT = float(os.environ.get("MCP_JOB_TIMEOUT", "3600"))
+JOB_MAX_OUTPUT = int(os.environ.get("MCP_JOB_MAX_OUTPUT", str(16 * 1024 * 1024)))
+JOB_RETENTION = float(os.environ.get("MCP_JOB_RETENTION", str(7 * 24 * 3600)))
+JOB_CLEANUP_INTERVAL = 3600
+# Federation: peer nodes this node forwards /fleet/* requests to ("name=http://host:3030,...");
+# per-peer request timeout, keep-alive connections per peer and health probe interval
+PEERS = peers.parse_peers(os.environ.get("MCP_PEERS", ""))
+PEER_TIMEOUT = float(os.environ.get("MCP_PEER_TIMEOUT", str(EXEC_TIMEOUT + 5)))
+PEER_POOL_SIZE = int(os.environ.get("MCP_PEER_POOL_SIZE", "8"))
+PEER_HEALTH_INTERVAL = float(os.environ.get("MCP_PEER_HEALTH_INTERVAL", "15"))
+# Pseudo-peer name for running on this node as part of a fan-out
+SELF_PEER = "self"
 SAFE_BASE.mkdir(parents=True, exist_ok=True)
 
-app = FastAPI()
+# Spawner helper started by this process (None when using one started elsewhere)
+spawner_proc = None
+
+def ensure_spawner():
+    """Start the spawner helper unless one is already listening on SPAWNER_SOCKET."""
+    global spawner_proc
+    proc = spawner.start_spawner(SPAWNER_SOCKET)
+    if proc is not None:
+        spawner.stop_spawner(spawner_proc)
+        spawner_proc = proc
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    if USE_SPAWNER:
+        ensure_spawner()
+    await job_runner.recover()
+    cleanup = asyncio.create_task(purge_jobs_periodically())
+    output_cleanup = asyncio.create_task(purge_outputs_periodically())
+    probes = asyncio.create_task(probe_peers_periodically()) if fleet else None
+    try:
+        yield
+    finally:
+        cleanup.cancel()
+        output_cleanup.cancel()
+        if probes:
+            probes.cancel()
+            fleet.close()
+        await watch_hub.close()
+        await job_runner.stop()
+        spawner.stop_spawner(spawner_proc)
+        # After uvicorn stopped listening; it re-raises SIGTERM once shutdown completes,
+        # so code after Server.run() never gets to clean up
+        if bound_uds:
+            listeners.remove_unix_socket(bound_uds)
+        await asyncio.to_thread(audit_log.close)
+
+app = FastAPI(lifespan=lifespan)
+
+# Prometheus-style metrics served on /metrics. Per-command series are labelled with the
+# matched allowlist entry, not the raw request, to keep label cardinality bounded.
+registry = metrics.Registry()
+EXEC_REQUESTS = registry.counter(
+    "mcp_exec_requests_total", "Executions by allowlist entry and outcome", ["command", "outcome"])
+EXEC_DENIED = registry.counter("mcp_exec_denied_total", "Requests rejected by the allowlist")
+EXEC_QUEUE_WAIT = registry.histogram(
+    "mcp_exec_queue_wait_seconds", "Time spent waiting for an exec slot", ["command"])
+EXEC_SPAWN = registry.histogram("mcp_exec_spawn_seconds", "Time to start the process", ["command"])
+EXEC_RUN = registry.histogram("mcp_exec_run_seconds", "Run time after the process started", ["command"])
+EXEC_OUTPUT = registry.histogram(
+    "mcp_exec_output_bytes", "stdout+stderr size per execution", ["command"], metrics.SIZE_BUCKETS)
+PEER_REQUESTS = registry.counter(
+    "mcp_peer_requests_total", "Requests forwarded to federation peers by outcome", ["peer", "outcome"])
+EXEC_CPU = registry.counter(
+    "mcp_exec_cpu_seconds_total", "User+system CPU of executed commands and their children", ["command"])
+JOBS_FINISHED = registry.counter("mcp_jobs_finished_total", "Background jobs by final status", ["status"])
+EXEC_LANE_WAIT = registry.histogram("mcp_exec_lane_wait_seconds", "Time waited for an exec slot per lane", ["lane"])
+registry.gauge_func("mcp_exec_in_flight", "Commands currently running", lambda: exec_scheduler.in_flight)
+registry.gauge_func("mcp_exec_queued", "Requests waiting for an exec slot", lambda: exec_scheduler.queued)
+registry.counter_func("mcp_exec_rejected_total", "Requests rejected because the queue was full",
+                      lambda: exec_scheduler.rejected)
+registry.counter_func("mcp_exec_rate_limited_total", "Requests rejected by per-client rate limits",
+                      lambda: exec_scheduler.rate_limited)
+registry.counter_func("mcp_cache_hits_total", "Result cache hits", lambda: result_cache.hits)
+registry.counter_func("mcp_cache_coalesced_total", "Requests that joined an in-flight execution",
+                      lambda: result_cache.coalesced)
+registry.gauge_func("mcp_watch_active", "Commands being watched", lambda: watch_hub.stats()["watches"])
+registry.gauge_func("mcp_watch_subscribers", "Clients subscribed to /watch",
+                    lambda: watch_hub.stats()["subscribers"])
+registry.gauge_func("mcp_jobs_running", "Background jobs running", lambda: job_runner.stats()["running"])
+registry.gauge_func("mcp_jobs_queued", "Background jobs waiting", lambda: job_runner.stats()["queued"])
+registry.counter_func("mcp_audit_written_total", "Audit records written", lambda: audit_log.written)
+registry.counter_func("mcp_audit_dropped_total", "Audit records dropped because the buffer was full",
+                      lambda: audit_log.dropped)
+
+def exec_outcome(error) -> str:
+    return {503: "rejected", 504: "timeout"}.get(error.status_code, "error")
+
+def observe_exec(entry, queue_wait: float, run_s: float, result: dict):
+    """Record one completed execution in the per-command metrics."""
+    command = entry.command
+    spawn_s = result["spawn_ms"] / 1000
+    EXEC_REQUESTS.inc(command, "ok" if result["returncode"] == 0 else "error")
+    EXEC_QUEUE_WAIT.observe(queue_wait, command)
+    EXEC_SPAWN.observe(spawn_s, command)
+    EXEC_RUN.observe(max(run_s - spawn_s, 0.0), command)
+    truncated = result.get("truncated", {})
+    EXEC_OUTPUT.observe(sum(truncated[name]["bytes"] if name in truncated else len(result[name])
+                            for name in capture.STREAMS), command)
+
+# Per-command CPU/RSS/IO totals served on /stats
+usage_stats = accounting.UsageStats()
+
+# Append-only JSON lines record of every exec request (audit.AUDIT_DIR/server.jsonl)
+audit_log = audit.open_log("server")
+
+def audit_exec(action: str, client: str, cmd, started: float, result: dict = None, error=None, **fields):
+    """Queue the audit record of one request; `started` is its time.perf_counter() at arrival.
+
+    Requests the allowlist (or validation) refused are `denied`; everything
+    else was allowed, whether or not it then ran to completion.
+    """
+    record = {"client": client, "cmd": cmd}
+    decision = "allowed"
+    if error is not None:
+        decision = "denied" if error.status_code in (400, 403) else "allowed"
+        record.update(status=error.status_code, error=error.error)
+    elif result is not None:
+        record.update(status=200, returncode=result["returncode"], cached=result.get("cached", False))
+    record.update(fields, duration_ms=round((time.perf_counter() - started) * 1000, 3))
+    audit_log.record(action, decision, **record)
+
+def record_usage(entry, usage: dict, returncode: int):
+    """Add one execution's resource usage to the per-command stats."""
+    if usage is None:
+        return
+    usage_stats.record(entry.command, usage, returncode == 0)
+    EXEC_CPU.inc(entry.command, amount=(usage["cpu_user_ms"] + usage["cpu_sys_ms"]) / 1000)
+
+class AllowEntry:
+    """One allowlist line: the command prefix plus its `key=value` annotations.
+
+    Annotations follow the command after ` #`, e.g. `lscpu  # ttl=3600`;
+    other words in the trailing comment are ignored.
+    """
+
+    __slots__ = ("command", "options")
+
+    def __init__(self, command: str, options: dict):
+        self.command = command
+        self.options = options
+
+    @classmethod
+    def parse(cls, line: str):
+        command, _, comment = line.partition(" #")
+        options = dict(word.split("=", 1) for word in comment.split() if "=" in word)
+        return cls(command.strip(), options)
+
+    def number(self, key: str, default: float = 0.0) -> float:
+        try:
+            return float(self.options[key])
+        except (KeyError, ValueError):
+            return default
+
+    @property
+    def exec_mode(self) -> str:
+        return self.options.get("exec", EXEC_MODE)
+
+    @property
+    def ttl(self) -> float:
+        """Seconds a successful result may be served from the result cache (0 = never)."""
+        return self.number("ttl")
+
+    @property
+    def job_timeout(self) -> float:
+        return self.number("timeout", JOB_TIMEOUT)
+
+    @property
+    def tier(self):
+        """Allowlist tier (from `# tier=N` or the `# Tier N:` section header), or None."""
+        tier = self.number("tier", -1)
+        return int(tier) if tier >= 0 else None
+
+    @property
+    def cost(self) -> float:
+        """Relative expense charged against the client's fair share and rate limit."""
+        return max(self.number("cost", 1.0), 0.01)
+
+# Section headers in allowed_cmds.txt, e.g. "# Tier 1: Safe Monitoring & Info"
+TIER_HEADER = re.compile(r"#\s*Tier\s+(\d+)\b", re.IGNORECASE)
 
 def read_allowlist():
+    """Parsed entries; entries below a `# Tier N` header get `tier=N` unless annotated otherwise."""
     if not ALLOWLIST_FILE.exists():
         return []
-    return [line.strip() for line in ALLOWLIST_FILE.read_text().splitlines() if line.strip() and not line.strip().startswith('#')]
+    entries, tier = [], None
+    for line in ALLOWLIST_FILE.read_text().splitlines():
+        line = line.strip()
+        if line.startswith('#'):
+            header = TIER_HEADER.match(line)
+            if header:
+                tier = header.group(1)
+        elif line:
+            entry = AllowEntry.parse(line)
+            if tier is not None:
+                entry.options.setdefault("tier", tier)
+            entries.append(entry)
+    return entries
+
+# Trie node key marking the end of an allowlist entry (tokens are always str)
+_END = None
+
+def compile_allowlist(entries):
+    """Build a token trie from allowlist entries, keyed by space-separated argv words."""
+    root = {}
+    for entry in entries:
+        node = root
+        for token in entry.command.split(" "):
+            node = node.setdefault(token, {})
+        node[_END] = entry
+    return root
+
+class AllowlistSnapshot:
+    """One immutable, compiled generation of the allowlist."""
+
+    def __init__(self, entries, generation, stat_key, load_ms):
+        self.commands = [entry.command for entry in entries]
+        self.trie = compile_allowlist(entries)
+        self.generation = generation
+        self.stat_key = stat_key
+        self.load_ms = load_ms
+        self.loaded_at = datetime.now().isoformat()
+        self.decisions = OrderedDict()
+
+    def lookup(self, requested: str):
+        """Return the longest allowlist entry matching `requested`, or None.
+
+        Same semantics as the old linear scan: an entry matches on an exact
+        match or when the request starts with the entry plus a space.
+        """
+        node = self.trie
+        match = None
+        for token in requested.split(" "):
+            node = node.get(token)
+            if node is None:
+                break
+            if _END in node:
+                match = node[_END]
+        return match
+
+class AllowlistIndex:
+    """Compiled allowlist that reloads itself when allowed_cmds.txt changes.
+
+    The file is stat()ed at most every ALLOWLIST_CHECK_INTERVAL seconds; a new
+    mtime, inode or size triggers a rebuild that is swapped in atomically, so
+    readers always see a complete generation. Recent decisions are kept in a
+    small LRU that is discarded together with its generation.
+    """
+
+    def __init__(self, path: Path, check_interval: float = ALLOWLIST_CHECK_INTERVAL,
+                 cache_size: int = DECISION_CACHE_SIZE):
+        self.path = path
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+        self._reload_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._next_check = 0.0
+        self._snapshot = self._load(generation=1, stat_key=self._stat_key())
+
+    def _stat_key(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _load(self, generation: int, stat_key):
+        started = time.perf_counter()
+        entries = read_allowlist()
+        load_ms = (time.perf_counter() - started) * 1000
+        return AllowlistSnapshot(entries, generation, stat_key, load_ms)
+
+    def snapshot(self) -> AllowlistSnapshot:
+        """Return the current generation, reloading first if the file changed."""
+        now = time.monotonic()
+        if now >= self._next_check:
+            with self._reload_lock:
+                if now >= self._next_check:
+                    stat_key = self._stat_key()
+                    if stat_key != self._snapshot.stat_key:
+                        self._snapshot = self._load(self._snapshot.generation + 1, stat_key)
+                    self._next_check = now + self.check_interval
+        return self._snapshot
+
+    def match(self, requested: str):
+        """Return the AllowEntry that permits `requested`, or None if denied."""
+        snap = self.snapshot()
+        with self._cache_lock:
+            if requested in snap.decisions:
+                snap.decisions.move_to_end(requested)
+                return snap.decisions[requested]
+        result = snap.lookup(requested)
+        with self._cache_lock:
+            snap.decisions[requested] = result
+            if len(snap.decisions) > self.cache_size:
+                snap.decisions.popitem(last=False)
+        return result
+
+    def is_allowed(self, requested: str) -> bool:
+        return self.match(requested) is not None
+
+allowlist_index = AllowlistIndex(ALLOWLIST_FILE)
+
+class ExecError(Exception):
+    """A command could not be run or finished abnormally; maps to an HTTP error."""
+
+    def __init__(self, status_code: int, error: str, headers: dict = None):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+        self.headers = headers
+
+    def response(self) -> JSONResponse:
+        return JSONResponse({"error": self.error}, status_code=self.status_code, headers=self.headers)
+
+class ClientState:
+    """Scheduling state of one client identity: WFQ finish tag, rate-limit bucket and counters."""
+
+    __slots__ = ("weight", "finish", "tokens", "updated", "queued", "in_flight", "dispatched",
+                 "rate_limited", "wait_s")
+
+    def __init__(self, weight: float, burst: float):
+        self.weight = weight
+        self.finish = 0.0
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.queued = 0
+        self.in_flight = 0
+        self.dispatched = 0
+        self.rate_limited = 0
+        self.wait_s = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "weight": self.weight,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "dispatched": self.dispatched,
+            "rate_limited": self.rate_limited,
+            "avg_wait_ms": round(self.wait_s / self.dispatched * 1000, 3) if self.dispatched else 0.0,
+        }
+
+class Lane:
+    """Waiters of one lane plus its wait-time counters."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.waiters = deque()  # fast lane: FIFO of (future, client, queued_at)
+        self.heap = []  # shared lane: (finish, seq, start, future, client, queued_at)
+        self.in_flight = 0
+        self.queued = 0
+        self.dispatched = 0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "dispatched": self.dispatched,
+            "avg_wait_ms": round(self.wait_s / self.dispatched * 1000, 3) if self.dispatched else 0.0,
+            "max_wait_ms": round(self.max_wait_s * 1000, 3),
+        }
+
+class ExecScheduler:
+    """Tier-aware admission control for running commands.
+
+    At most `limit` commands run at once. Entries of the `fast_tiers`
+    (monitoring) use the fast lane: they are served first and may use any
+    free slot, and `fast_slots` of the slots are reserved for them. All other
+    commands share the remaining slots through weighted fair queueing across
+    client identities: a waiting request's virtual finish tag advances by
+    cost/weight, so a client flooding the queue with `make` runs only delays
+    its own requests. Each client is also rate limited by a token bucket
+    (`rate` per second, `burst` tokens, 0 = unlimited) charged the command's cost.
+
+    Beyond `max_queue` waiting requests new ones are rejected immediately with
+    503 + Retry-After; a rate-limited request gets 429.
+    """
+
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float, fast_slots: int = 0,
+                 fast_tiers=(), weights: dict = None, rate: float = 0.0, burst: float = 1.0,
+                 max_clients: int = 1024):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.fast_slots = min(fast_slots, limit - 1)
+        self.fast_tiers = frozenset(fast_tiers)
+        self.weights = weights or {}
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        self.fast = Lane("fast")
+        self.shared = Lane("shared")
+        self._clients = OrderedDict()
+        self._vtime = 0.0
+        self._seq = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _busy(self, reason: str) -> ExecError:
+        self.rejected += 1
+        return ExecError(503, f"server busy: {reason}", {"Retry-After": str(RETRY_AFTER)})
+
+    def _client(self, name: str) -> ClientState:
+        state = self._clients.get(name)
+        if state is None:
+            state = self._clients[name] = ClientState(self.weights.get(name, 1.0), self.burst)
+            # Forget idle clients beyond max_clients, least recently seen first
+            for old in list(self._clients)[:max(len(self._clients) - self.max_clients, 0)]:
+                if not (self._clients[old].queued or self._clients[old].in_flight):
+                    del self._clients[old]
+        self._clients.move_to_end(name)
+        return state
+
+    def _charge(self, name: str, state: ClientState, cost: float) -> float:
+        """Take `cost` tokens from the client's bucket, or raise 429; returns what was taken."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        cost = min(cost, self.burst)
+        if state.tokens < cost:
+            state.rate_limited += 1
+            self.rate_limited += 1
+            retry = max(1, math.ceil((cost - state.tokens) / self.rate))
+            raise ExecError(429, f"rate limit exceeded for client {name}", {"Retry-After": str(retry)})
+        state.tokens -= cost
+        return cost
+
+    def _refund(self, state: ClientState, charged: float):
+        """Give back the tokens of a command that never got to run."""
+        state.tokens = min(self.burst, state.tokens + charged)
+
+    def lane(self, entries) -> Lane:
+        """The fast lane when every entry belongs to a fast tier, else the shared one."""
+        return self.fast if all(e.tier in self.fast_tiers for e in entries) else self.shared
+
+    def _can_run(self, lane: Lane) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        return lane is self.fast or self.shared.in_flight < self.limit - self.fast_slots
+
+    def _grant(self, lane: Lane, state: ClientState, waited: float):
+        self.in_flight += 1
+        lane.in_flight += 1
+        state.in_flight += 1
+        lane.dispatched += 1
+        state.dispatched += 1
+        lane.wait_s += waited
+        state.wait_s += waited
+        lane.max_wait_s = max(lane.max_wait_s, waited)
+        EXEC_LANE_WAIT.observe(waited, lane.name)
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while True:
+            if self.fast.waiters and self._can_run(self.fast):
+                future, state, queued_at = self.fast.waiters.popleft()
+                lane = self.fast
+            elif self.shared.heap and self._can_run(self.shared):
+                _, _, start, future, state, queued_at = heapq.heappop(self.shared.heap)
+                lane = self.shared
+                if future.done():
+                    continue
+                self._vtime = start
+            else:
+                return
+            if future.done():
+                continue  # gave up waiting
+            lane.queued -= 1
+            state.queued -= 1
+            self.queued -= 1
+            self._grant(lane, state, now - queued_at)
+            future.set_result(None)
+
+    async def acquire(self, client: str, *entries) -> tuple:
+        """Wait for a slot for a command (or pipeline) of `entries`; returns the token for release()."""
+        state = self._client(client)
+        charged = self._charge(client, state, sum(e.cost for e in entries))
+        lane = self.lane(entries)
+        waiting = lane.waiters if lane is self.fast else lane.heap
+        if not waiting and self._can_run(lane):
+            self._grant(lane, state, 0.0)
+            return lane, state
+        if self.queued >= self.max_queue:
+            self._refund(state, charged)
+            raise self._busy("exec queue full")
+        future = asyncio.get_running_loop().create_future()
+        queued_at = time.monotonic()
+        if lane is self.fast:
+            lane.waiters.append((future, state, queued_at))
+        else:
+            start = max(self._vtime, state.finish)
+            state.finish = start + sum(e.cost for e in entries) / state.weight
+            self._seq += 1
+            heapq.heappush(lane.heap, (state.finish, self._seq, start, future, state, queued_at))
+        lane.queued += 1
+        state.queued += 1
+        self.queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot on
+                self.release((lane, state))
+            else:
+                future.cancel()
+                lane.queued -= 1
+                state.queued -= 1
+                self.queued -= 1
+                self._refund(state, charged)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._busy("timed out waiting for an exec slot")
+            raise
+        return lane, state
+
+    def release(self, token: tuple):
+        lane, state = token
+        self.in_flight -= 1
+        lane.in_flight -= 1
+        state.in_flight -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, client: str, *entries):
+        token = await self.acquire(client, *entries)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+            "lanes": {
+                "fast": {"tiers": sorted(self.fast_tiers), "reserved_slots": self.fast_slots,
+                         **self.fast.stats()},
+                "shared": {"slots": self.limit - self.fast_slots, **self.shared.stats()},
+            },
+        }
+
+    def client_stats(self) -> dict:
+        return {name: state.stats() for name, state in self._clients.items()}
+
+exec_scheduler = ExecScheduler(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT, FAST_LANE_SLOTS, FAST_LANE_TIERS,
+                               CLIENT_WEIGHTS, CLIENT_RATE, CLIENT_BURST)
+
+def kill_process_group(proc):
+    """Kill a command started with start_new_session=True, including its children.
+
+    Its remaining output is discarded.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.close()
+
+@functools.lru_cache(maxsize=512)
+def _which(name: str, path: str):
+    return shutil.which(name, path=path)
+
+def resolve_binary(name: str):
+    """Absolute path of `name` on PATH, cached per (name, PATH)."""
+    if os.sep in name:
+        return name
+    return _which(name, os.environ.get("PATH", os.defpath))
+
+def split_cmd(cmd: str) -> list:
+    try:
+        argv = shlex.split(cmd)
+    except ValueError as e:
+        raise ExecError(400, f"cannot parse cmd: {e}")
+    if not argv:
+        raise ExecError(400, "no cmd provided")
+    return argv
+
+async def spawn(cmd: str, entry: AllowEntry, stdin=None, stdout=asyncio.subprocess.PIPE):
+    """Start `cmd` the way its allowlist entry asks; return (process, spawn_ms).
+
+    In argv mode the binary is resolved through a cached PATH lookup and
+    exec'd directly, skipping the intermediate /bin/sh. The process reports
+    its rusage through `proc.usage()` once it has exited. Raises
+    FileNotFoundError when the binary cannot be found. `stdin`/`stdout` may be
+    file descriptors, e.g. the ends of a pipe to another command.
+    """
+    kwargs = dict(stdin=stdin, stdout=stdout, stderr=asyncio.subprocess.PIPE, start_new_session=True)
+    started = time.perf_counter()
+    if entry.exec_mode == "argv":
+        argv = split_cmd(cmd)
+        binary = resolve_binary(argv[0])
+        if binary is None:
+            raise FileNotFoundError(f"{argv[0]}: command not found")
+        try:
+            proc = await accounting.create_subprocess([binary, *argv[1:]], **kwargs)
+        except FileNotFoundError:
+            # Binary moved or removed since it was cached
+            _which.cache_clear()
+            raise FileNotFoundError(f"{argv[0]}: command not found")
+    else:
+        proc = await accounting.create_subprocess(cmd, shell=True, **kwargs)
+    return proc, (time.perf_counter() - started) * 1000
+
+def not_found_result(e: FileNotFoundError) -> dict:
+    """Result matching what /bin/sh reports for a missing binary."""
+    return {"stdout": "", "stderr": f"{e}\n", "returncode": 127, "exec_mode": "argv", "spawn_ms": 0.0,
+            "usage": None}
+
+async def run_via_spawner(cmd: str, entry: AllowEntry, timeout: float) -> dict:
+    """Run a command through the spawner helper instead of forking this process."""
+    if entry.exec_mode == "argv":
+        argv = split_cmd(cmd)
+        binary = resolve_binary(argv[0])
+        if binary is None:
+            return not_found_result(FileNotFoundError(f"{argv[0]}: command not found"))
+        request = {"argv": [binary, *argv[1:]]}
+    else:
+        request = {"shell": cmd}
+    # The helper streams output frames into the bounded capture as the command produces them
+    captured = output_store.capture(OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES)
+    try:
+        try:
+            result = await spawner.run_async(timeout=timeout, socket_path=SPAWNER_SOCKET,
+                                             on_output=captured.feed, **request)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Helper went away (e.g. restarted with the other front end); start a new one
+            await asyncio.to_thread(ensure_spawner)
+            result = await spawner.run_async(timeout=timeout, socket_path=SPAWNER_SOCKET,
+                                             on_output=captured.feed, **request)
+        if result["timeout"]:
+            raise ExecError(504, "command timeout")
+    except BaseException:
+        await captured.discard()
+        raise
+    return {
+        **await captured.finish(cmd),
+        "returncode": result["returncode"],
+        "exec_mode": entry.exec_mode,
+        "spawn_ms": result["spawn_ms"],
+        "usage": accounting.usage(types.SimpleNamespace(**result["rusage"]), result["wall_ms"] / 1000,
+                                  rss_floor_kb=result["rusage"].get("rss_floor_kb"))
+                 if result.get("rusage") else None,
+    }
+
+def native_provider(cmd: str, entry: AllowEntry):
+    """The in-process provider serving this command, or None when it must be spawned."""
+    if not NATIVE_PROVIDERS or entry.options.get("exec", "native") != "native":
+        return None
+    return providers.lookup(cmd)
+
+async def run_native(provider, timeout: float) -> dict:
+    """Answer a command from its provider; runs on a thread since statvfs can block on dead mounts."""
+    try:
+        stdout, data = await asyncio.wait_for(asyncio.to_thread(provider), timeout)
+    except asyncio.TimeoutError:
+        raise ExecError(504, "command timeout")
+    return {"stdout": stdout, "stderr": "", "returncode": 0, "exec_mode": "native", "spawn_ms": 0.0,
+            "usage": None, "data": data}
+
+async def run_command(cmd: str, entry: AllowEntry, timeout: float = EXEC_TIMEOUT) -> dict:
+    """Run an (already allowlisted) command without blocking the event loop."""
+    provider = native_provider(cmd, entry)
+    if provider is not None:
+        try:
+            return await run_native(provider, timeout)
+        except (OSError, ValueError, KeyError, IndexError):
+            # Unexpected /proc or file layout: let the real binary answer
+            pass
+    if USE_SPAWNER:
+        return await run_via_spawner(cmd, entry, timeout)
+    try:
+        proc, spawn_ms = await spawn(cmd, entry)
+    except FileNotFoundError as e:
+        return not_found_result(e)
+    captured = output_store.capture(OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES)
+
+    async def pump(reader, name):
+        while data := await reader.read(STREAM_CHUNK_SIZE):
+            await captured.feed(name, data)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(pump(proc.stdout, "stdout"), pump(proc.stderr, "stderr"), proc.wait()), timeout)
+    except BaseException as e:
+        await captured.discard()
+        if isinstance(e, asyncio.TimeoutError):
+            raise ExecError(504, "command timeout")
+        raise
+    finally:
+        if proc.returncode is None:
+            kill_process_group(proc)
+            await proc.wait()
+            # Killed on timeout or cancellation: still count what it consumed
+            record_usage(entry, proc.usage(), proc.returncode)
+    return {
+        **await captured.finish(cmd),
+        "returncode": proc.returncode,
+        "exec_mode": entry.exec_mode,
+        "spawn_ms": round(spawn_ms, 3),
+        "usage": proc.usage(),
+    }
+
+async def run_pipeline(stages: list, timeout: float = EXEC_TIMEOUT) -> dict:
+    """Run allowlisted commands connected by OS pipes, like `a | b | c` in a shell.
+
+    `stages` is a list of (cmd, entry). Each stage's stdout is the next stage's
+    stdin through a pipe the processes share directly, so intermediate output
+    never passes through this server. Only the last stage's stdout and every
+    stage's stderr are captured. One timeout covers the whole pipeline.
+    """
+    captured = output_store.capture(OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES)
+    procs, results, waiters, pumps = [], [], [], []
+
+    async def pump(reader, name):
+        while data := await reader.read(STREAM_CHUNK_SIZE):
+            await captured.feed(name, data)
+
+    async def wait_stage(proc, result, started):
+        await proc.wait()
+        result["returncode"] = proc.returncode
+        result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        result["usage"] = proc.usage()
+
+    stdin = asyncio.subprocess.DEVNULL
+    try:
+        for i, (cmd, entry) in enumerate(stages):
+            last = i == len(stages) - 1
+            read_fd, write_fd = (None, asyncio.subprocess.PIPE) if last else os.pipe()
+            result = {"cmd": cmd, "exec_mode": entry.exec_mode}
+            started = time.perf_counter()
+            try:
+                proc, spawn_ms = await spawn(cmd, entry, stdin=stdin, stdout=write_fd)
+            except FileNotFoundError as e:
+                # Like a shell: the stage fails with 127 and its readers see EOF
+                await captured.feed("stderr", f"{e}\n".encode())
+                result.update(returncode=127, spawn_ms=0.0, duration_ms=0.0, usage=None)
+                proc = None
+            finally:
+                # The children hold their own copies of the pipe ends now
+                if isinstance(stdin, int) and stdin >= 0:
+                    os.close(stdin)
+                if not last:
+                    os.close(write_fd)
+                stdin = read_fd
+            results.append(result)
+            if proc is None:
+                continue
+            procs.append(proc)
+            result["spawn_ms"] = round(spawn_ms, 3)
+            waiters.append(wait_stage(proc, result, started))
+            pumps.append(pump(proc.stderr, "stderr"))
+            if last:
+                pumps.append(pump(proc.stdout, "stdout"))
+        await asyncio.wait_for(asyncio.gather(*pumps, *waiters), timeout)
+    except BaseException as e:
+        await captured.discard()
+        if isinstance(e, asyncio.TimeoutError):
+            raise ExecError(504, "pipeline timeout")
+        raise
+    finally:
+        if isinstance(stdin, int) and stdin >= 0:
+            os.close(stdin)
+        for coro in pumps + waiters:
+            coro.close()
+        for proc in procs:
+            if proc.returncode is None:
+                kill_process_group(proc)
+                await proc.wait()
+    return {
+        **await captured.finish(" | ".join(cmd for cmd, _ in stages)),
+        "returncode": results[-1]["returncode"],
+        "stages": results,
+    }
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class ClosingStreamingResponse(StreamingResponse):
+    """A streaming response that calls `on_close` however it ends.
+
+    A generator's `finally` only runs once the generator has started, and
+    Starlette skips `background` when the client disconnects; a client that
+    leaves before the first frame would leak whatever the handler acquired.
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Run the body's own cleanup first; a never-started generator just closes
+            await self.body_iterator.aclose()
+            self.on_close()
+
+async def stream_command(cmd: str, entry: AllowEntry, timeout: float = EXEC_TIMEOUT, queue_wait: float = 0.0,
+                         on_exit=None):
+    """Run a command and yield SSE frames for its output as it is produced.
+
+    stdout/stderr chunks are emitted as `stdout`/`stderr` events and the
+    stream ends with a single `exit` event carrying returncode, duration and usage,
+    which is also passed to `on_exit` if given.
+    Only a few chunks are buffered per command, so a slow client pushes back
+    on the pipe instead of growing server memory.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    try:
+        proc, spawn_ms = await spawn(cmd, entry)
+    except FileNotFoundError as e:
+        result = not_found_result(e)
+        exit_info = {"returncode": result["returncode"], "duration_ms": 0.0, "timeout": False}
+        if on_exit is not None:
+            on_exit(exit_info)
+        yield sse_event("stderr", {"data": result["stderr"]})
+        yield sse_event("exit", exit_info)
+        return
+    chunks = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+
+    async def pump(reader, name):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await reader.read(STREAM_CHUNK_SIZE)
+            text = decoder.decode(data, final=not data)
+            if text:
+                await chunks.put((name, text))
+            if not data:
+                break
+        await chunks.put((name, None))
+
+    pumps = [asyncio.create_task(pump(proc.stdout, "stdout")),
+             asyncio.create_task(pump(proc.stderr, "stderr"))]
+    timed_out = False
+    try:
+        open_streams = len(pumps)
+        while open_streams:
+            try:
+                name, text = await asyncio.wait_for(chunks.get(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                timed_out = True
+                break
+            if text is None:
+                open_streams -= 1
+            else:
+                yield sse_event(name, {"data": text})
+        if not timed_out:
+            try:
+                await asyncio.wait_for(proc.wait(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                timed_out = True
+    finally:
+        if proc.returncode is None:
+            kill_process_group(proc)
+            await proc.wait()
+        for task in pumps:
+            task.cancel()
+    usage = proc.usage(queue_wait)
+    record_usage(entry, usage, proc.returncode)
+    exit_info = {
+        "returncode": proc.returncode,
+        "duration_ms": round((time.monotonic() - started) * 1000, 3),
+        "spawn_ms": round(spawn_ms, 3),
+        "timeout": timed_out,
+        "usage": usage,
+    }
+    if on_exit is not None:
+        on_exit(exit_info)
+    yield sse_event("exit", exit_info)
+
+def check_cmd(cmd) -> AllowEntry:
+    """Return the allowlist entry permitting `cmd`, or raise ExecError if it may not run."""
+    if not cmd:
+        raise ExecError(400, "no cmd provided")
+    if not isinstance(cmd, str):
+        raise ExecError(400, "cmd must be a string")
+    # Allow exact matches or commands that start with an allowlist entry plus a space,
+    # e.g. 'ping -c 1' matches 'ping -c 1 10.10.10.1'
+    entry = allowlist_index.match(cmd)
+    if entry is None:
+        EXEC_DENIED.inc()
+        raise ExecError(403, f"DENIED: {cmd} not in allowlist")
+    if entry.exec_mode == "argv":
+        split_cmd(cmd)
+    return entry
+
+class ResultCache:
+    """TTL cache of command results with single-flight execution.
+
+    Only commands whose allowlist entry carries a `ttl` are cached, and only
+    successful runs are stored. Concurrent identical requests that miss the
+    cache wait on the one execution already in flight instead of spawning
+    their own.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_run(self, cmd: str, ttl: float, run) -> dict:
+        cached = self._results.get(cmd)
+        if cached is not None:
+            stored_at, result = cached
+            age = time.monotonic() - stored_at
+            if age < ttl:
+                self.hits += 1
+                self._results.move_to_end(cmd)
+                return {**result, "cached": True, "age": round(age, 3)}
+            del self._results[cmd]
+
+        pending = self._inflight.get(cmd)
+        if pending is not None:
+            self.coalesced += 1
+            stored_at, result = await asyncio.shield(pending)
+            return {**result, "cached": True, "age": round(time.monotonic() - stored_at, 3)}
+
+        self.misses += 1
+        pending = asyncio.get_running_loop().create_future()
+        # Mark the exception retrieved when nobody else was waiting for it
+        pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[cmd] = pending
+        try:
+            result = await run()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                pending.cancel()
+            else:
+                pending.set_exception(e)
+            raise
+        finally:
+            del self._inflight[cmd]
+        entry = (time.monotonic(), result)
+        pending.set_result(entry)
+        if result["returncode"] == 0:
+            self._results[cmd] = entry
+            if len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return {**result, "cached": False, "age": 0.0}
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+result_cache = ResultCache(RESULT_CACHE_SIZE)
+
+def trusted_proxy(peer: str) -> bool:
+    if peer == "local":
+        return "local" in TRUSTED_PROXIES
+    try:
+        address = ipaddress.ip_address(peer)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_NETWORKS)
+
+def client_id(request: Request) -> str:
+    """Identity used for fair queueing and rate limits: the peer address.
+
+    CLIENT_HEADER is only believed from a trusted proxy; anyone else could
+    pick a new identity per request to dodge its rate limit, or claim a
+    heavily weighted one.
+    """
+    peer = request.client.host if request.client else "local"
+    if CLIENT_HEADER and request.headers.get(CLIENT_HEADER) and trusted_proxy(peer):
+        return request.headers[CLIENT_HEADER]
+    return peer
+
+async def execute(cmd: str, entry: AllowEntry, client: str = "local") -> dict:
+    """Run an allowlisted command through the result cache and the scheduler."""
+    async def run():
+        queued_at = time.perf_counter()
+        try:
+            async with exec_scheduler.slot(client, entry):
+                started = time.perf_counter()
+                result = await run_command(cmd, entry)
+        except ExecError as e:
+            EXEC_REQUESTS.inc(entry.command, exec_outcome(e))
+            raise
+        observe_exec(entry, started - queued_at, time.perf_counter() - started, result)
+        if result["usage"] is not None:
+            result["usage"]["queue_wait_ms"] = round((started - queued_at) * 1000, 3)
+        record_usage(entry, result["usage"], result["returncode"])
+        return result
+
+    if entry.ttl > 0:
+        result = await result_cache.get_or_run(cmd, entry.ttl, run)
+        if result["cached"]:
+            EXEC_REQUESTS.inc(entry.command, "cached")
+        return result
+    return {**await run(), "cached": False, "age": 0.0}
+
+class JobRunner:
+    """Runs /jobs submissions in the background and records them in the JobStore.
+
+    Jobs have their own concurrency limit so long builds and upgrades never
+    take /exec slots. Output is appended to the store as it is produced.
+    """
+
+    def __init__(self, store: jobs.JobStore, concurrency: int, max_queued: int):
+        self.store = store
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = {}
+        self._procs = {}
+        self._started = set()
+        self.stopping = False
+
+    async def submit(self, cmd: str, entry: AllowEntry, job_id: str = None) -> str:
+        if len(self._tasks) - len(self._started) >= self.max_queued:
+            raise ExecError(503, "server busy: job queue full", {"Retry-After": str(RETRY_AFTER)})
+        if job_id is None:
+            job_id = await asyncio.to_thread(self.store.create, cmd, entry.job_timeout)
+        task = asyncio.create_task(self._run(job_id, cmd, entry))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return job_id
+
+    async def cancel(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.wait([task], timeout=5)
+        return True
+
+    async def recover(self):
+        """Re-queue jobs that were still waiting when the server last stopped."""
+        for job_id, cmd in await asyncio.to_thread(self.store.recover):
+            entry = allowlist_index.match(cmd)
+            if entry is None:
+                await self._finish(job_id, jobs.FAILED, error=f"DENIED: {cmd} not in allowlist", decision="denied")
+            else:
+                await self.submit(cmd, entry, job_id)
+
+    async def stop(self):
+        """Kill running jobs (recorded as interrupted); queued ones stay queued for the next start."""
+        self.stopping = True
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job_id: str, cmd: str, entry: AllowEntry):
+        try:
+            async with self._slots:
+                self._started.add(job_id)
+                await self._execute(job_id, cmd, entry)
+        except asyncio.CancelledError:
+            if self.stopping:
+                if job_id in self._started:
+                    await self._finish(job_id, jobs.INTERRUPTED, error="server stopped while the job was running")
+            else:
+                await self._finish(job_id, jobs.CANCELLED, error="cancelled")
+        finally:
+            self._started.discard(job_id)
+
+    async def _execute(self, job_id: str, cmd: str, entry: AllowEntry):
+        timeout = entry.job_timeout
+        try:
+            proc, _ = await spawn(cmd, entry)
+        except FileNotFoundError as e:
+            await self._finish(job_id, jobs.FAILED, 127, str(e))
+            return
+        self._procs[job_id] = proc
+        await asyncio.to_thread(self.store.mark_running, job_id, proc.pid)
+        seq = 0
+        total = 0
+        truncated = False
+
+        async def pump(reader, name):
+            nonlocal seq, total, truncated
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                data = await reader.read(STREAM_CHUNK_SIZE)
+                text = decoder.decode(data, final=not data)
+                if text and not truncated:
+                    total += len(data)
+                    if total > JOB_MAX_OUTPUT:
+                        truncated = True
+                        text = f"\n[output truncated after {JOB_MAX_OUTPUT} bytes]\n"
+                    chunk_seq = seq
+                    seq += 1
+                    # SQLite commits (and purge holding the store lock) never block the event loop
+                    await asyncio.to_thread(self.store.append_output, job_id, chunk_seq, name, text, total,
+                                            truncated)
+                if not data:
+                    break
+
+        try:
+            await asyncio.wait_for(asyncio.gather(pump(proc.stdout, "stdout"), pump(proc.stderr, "stderr"),
+                                                  proc.wait()), timeout)
+        except asyncio.TimeoutError:
+            await self._finish(job_id, jobs.TIMEOUT, error=f"killed after {timeout:g} seconds")
+        else:
+            await self._finish(job_id, jobs.SUCCEEDED if proc.returncode == 0 else jobs.FAILED, proc.returncode)
+        finally:
+            if proc.returncode is None:
+                kill_process_group(proc)
+                await proc.wait()
+            self._procs.pop(job_id, None)
+            record_usage(entry, proc.usage(), proc.returncode)
+
+    async def _finish(self, job_id: str, status: str, returncode: int = None, error: str = None,
+                      decision: str = "allowed"):
+        await asyncio.to_thread(self.store.finish, job_id, status, returncode, error)
+        JOBS_FINISHED.inc(status)
+        audit_log.record("job_finished", decision, job_id=job_id, status=status, returncode=returncode, error=error)
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._started),
+            "queued": len(self._tasks) - len(self._started),
+            "limit": self.concurrency,
+        }
+
+job_store = jobs.JobStore(JOBS_DB)
+job_runner = JobRunner(job_store, JOB_CONCURRENCY, JOB_MAX_QUEUED)
+
+output_store = capture.OutputStore(OUTPUT_SPILL_DIR, OUTPUT_TTL, OUTPUT_SPILL_MAX_BYTES)
+
+async def purge_outputs_periodically():
+    """Delete spilled /exec output whose handle has expired."""
+    while True:
+        await asyncio.sleep(OUTPUT_PURGE_INTERVAL)
+        await asyncio.to_thread(output_store.purge_expired)
+
+async def purge_jobs_periodically():
+    """Delete finished jobs older than JOB_RETENTION, once an hour."""
+    while True:
+        await asyncio.to_thread(job_store.purge, time.time() - JOB_RETENTION)
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+
+def health_payload() -> dict:
+    return {
+        "status": "ok",
+        "server": SERVER_NAME,
+        "exec": exec_scheduler.stats(),
+        "cache": result_cache.stats(),
+        "jobs": job_runner.stats(),
+        "output": output_store.stats(),
+        "watch": watch_hub.stats(),
+        "fleet": fleet.stats() if fleet else None,
+        "audit": audit_log.stats(),
+    }
 
 @app.get("/health")
-def health():
-    return {"status": "ok", "server": SERVER_NAME}
+async def health():
+    return health_payload()
 
 @app.get("/api/health")
-def api_health():
+async def api_health():
     # Alias for monitoring tools that expect /api/health
-    return {"status": "ok", "server": SERVER_NAME}
+    return health_payload()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of exec, cache and job metrics."""
+    return Response(registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/stats")
+async def get_stats(sort: str = "cpu_ms", limit: int = 50):
+    """Per-command resource usage totals since start, heaviest first."""
+    try:
+        commands = usage_stats.snapshot(sort, max(limit, 1))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {**usage_stats.totals(), "sort": sort, "by_command": commands}
+
+@app.get("/scheduler")
+async def get_scheduler():
+    """Per-lane and per-client queueing figures for tuning lanes, weights and rate limits."""
+    return {**exec_scheduler.stats(), "clients": exec_scheduler.client_stats()}
 
 @app.get("/commands")
 def list_commands():
     """Return the configured allowlisted commands."""
-    cmds = read_allowlist()
-    return {"commands": cmds, "count": len(cmds)}
+    snap = allowlist_index.snapshot()
+    return {
+        "commands": snap.commands,
+        "count": len(snap.commands),
+        "generation": snap.generation,
+        "loaded_at": snap.loaded_at,
+        "load_ms": round(snap.load_ms, 3),
+    }
+
+def shape_result(result: dict, structured: bool) -> dict:
+    """Keep a native provider's structured `data` only when the client asked for it."""
+    if structured:
+        result.setdefault("data", None)
+    else:
+        result.pop("data", None)
+    return result
 
 @app.post("/exec")
-def exec_allowlisted(payload: dict):
+async def exec_allowlisted(payload: dict, request: Request):
+    started = time.perf_counter()
+    client = client_id(request)
     cmd = payload.get("cmd", "")
-    if not cmd:
-        return JSONResponse({"error": "no cmd provided"}, status_code=400)
-    allowlist = read_allowlist()
-    # Allow exact matches or commands that start with an allowlist entry plus a space
-    def is_allowed(requested: str):
-        for a in allowlist:
-            if requested == a:
-                return True
-            # prefix match: allow 'ping -c' to match 'ping -c 1 10.10.10.1'
-            if requested.startswith(a + " "):
-                return True
-        return False
+    try:
+        result = await execute(cmd, check_cmd(cmd), client)
+    except ExecError as e:
+        audit_exec("exec", client, cmd, started, error=e)
+        return e.response()
+    audit_exec("exec", client, cmd, started, result)
+    return shape_result(result, bool(payload.get("structured")))
+
+@app.post("/exec/stream")
+async def exec_stream(payload: dict, request: Request):
+    """Like /exec, but streams output as Server-Sent Events while the command runs."""
+    queued_at = time.perf_counter()
+    client = client_id(request)
+    cmd = payload.get("cmd", "")
+    try:
+        entry = check_cmd(cmd)
+        token = await exec_scheduler.acquire(client, entry)
+    except ExecError as e:
+        audit_exec("exec_stream", client, cmd, queued_at, error=e)
+        return e.response()
+    queue_wait = time.perf_counter() - queued_at
+    EXEC_QUEUE_WAIT.observe(queue_wait, entry.command)
+
+    started = time.perf_counter()
+    exit_info = {}
+
+    async def frames():
+        nonlocal started
+        started = time.perf_counter()
+        async for frame in stream_command(cmd, entry, queue_wait=queue_wait, on_exit=exit_info.update):
+            yield frame
+
+    def finish():
+        exec_scheduler.release(token)
+        EXEC_REQUESTS.inc(entry.command, "stream")
+        EXEC_RUN.observe(time.perf_counter() - started, entry.command)
+        # No returncode when the client went away before the command finished
+        audit_exec("exec_stream", client, cmd, queued_at, status=200, returncode=exit_info.get("returncode"),
+                   timeout=exit_info.get("timeout", False))
+
+    return ClosingStreamingResponse(
+        frames(),
+        finish,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def release_watched(result: dict):
+    """Delete the spilled output of a watch run that is no longer shown."""
+    # A cacheable command's result (and its spill) may also be served to /exec clients
+    if not result.get("cacheable"):
+        output_store.delete(result["output_handle"])
+
+watch_hub = watches.WatchHub(WATCH_MAX_ACTIVE, WATCH_BUFFER, release_watched)
+
+async def run_watched(cmd: str) -> dict:
+    """One tick of a watch; the allowlist is checked again since it may have changed."""
+    try:
+        entry = check_cmd(cmd)
+    except ExecError as e:
+        raise watches.WatchError(e.status_code, e.error, final=True)
+    try:
+        return {**await execute(cmd, entry, "watch"), "cacheable": entry.ttl > 0}
+    except ExecError as e:
+        raise watches.WatchError(e.status_code, e.error)
+
+@app.get("/watch")
+async def watch_command(request: Request, cmd: str = "", interval: float = 5.0):
+    """Run an allowlisted command periodically and stream a snapshot, then line deltas (SSE).
+
+    All clients watching the same command at the same interval share one run.
+    The audit log records each subscription, not every periodic run.
+    """
+    started = time.perf_counter()
+    client = client_id(request)
+    try:
+        check_cmd(cmd)
+        if not WATCH_MIN_INTERVAL <= interval <= WATCH_MAX_INTERVAL:
+            raise ExecError(400, f"interval must be between {WATCH_MIN_INTERVAL:g} and {WATCH_MAX_INTERVAL} seconds")
+        watch, sub = watch_hub.subscribe(cmd, interval, functools.partial(run_watched, cmd))
+    except ExecError as e:
+        audit_exec("watch", client, cmd, started, error=e, interval=interval)
+        return e.response()
+    except watches.WatchError as e:
+        error = ExecError(e.status_code, e.error, {"Retry-After": str(RETRY_AFTER)})
+        audit_exec("watch", client, cmd, started, error=error, interval=interval)
+        return error.response()
+    audit_exec("watch", client, cmd, started, status=200, interval=interval)
+
+    async def frames():
+        while True:
+            try:
+                item = await asyncio.wait_for(sub.queue.get(), WATCH_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                return
+            yield sse_event(*item)
+
+    return ClosingStreamingResponse(
+        frames(),
+        functools.partial(watch_hub.unsubscribe, watch, sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/exec/batch")
+async def exec_batch(payload: dict, request: Request):
+    """Run several allowlisted commands concurrently and return per-command results.
+
+    Each command is checked and executed on its own; a denied, rejected or
+    timed-out command is reported in its result entry and does not fail the
+    rest of the batch.
+    """
+    cmds = payload.get("cmds")
+    if not isinstance(cmds, list) or not cmds:
+        return JSONResponse({"error": "cmds must be a non-empty list"}, status_code=400)
+    if len(cmds) > BATCH_MAX_CMDS:
+        return JSONResponse({"error": f"too many cmds (max {BATCH_MAX_CMDS})"}, status_code=400)
+    try:
+        parallelism = int(payload.get("parallelism", BATCH_MAX_PARALLELISM))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "parallelism must be an integer"}, status_code=400)
+    parallelism = max(1, min(parallelism, BATCH_MAX_PARALLELISM))
+    batch_slots = asyncio.Semaphore(parallelism)
+    structured = bool(payload.get("structured"))
+    client = client_id(request)
+    started = time.monotonic()
+
+    async def run_one(cmd):
+        item_started = time.perf_counter()
+        try:
+            entry = check_cmd(cmd)
+            async with batch_slots:
+                result = {"cmd": cmd, "status": 200, **shape_result(await execute(cmd, entry, client), structured)}
+            audit_exec("batch", client, cmd, item_started, result)
+        except ExecError as e:
+            audit_exec("batch", client, cmd, item_started, error=e)
+            result = {"cmd": cmd, "status": e.status_code, "error": e.error}
+        result["duration_ms"] = round((time.perf_counter() - item_started) * 1000, 3)
+        return result
+
+    results = await asyncio.gather(*(run_one(cmd) for cmd in cmds))
+    return {
+        "results": results,
+        "count": len(results),
+        "failed": sum(1 for r in results if r["status"] != 200 or r["returncode"] != 0),
+        "parallelism": parallelism,
+        "duration_ms": round((time.monotonic() - started) * 1000, 3),
+    }
+
+@app.post("/exec/pipeline")
+async def exec_pipeline(payload: dict, request: Request):
+    """Run allowlisted commands as a pipeline (`a | b | c`) without a client round trip.
+
+    Every stage is checked against the allowlist on its own; the pipeline
+    takes one exec slot and one EXEC_TIMEOUT for all of its stages.
+    """
+    cmds = payload.get("cmds")
+    if not isinstance(cmds, list) or not cmds:
+        return JSONResponse({"error": "cmds must be a non-empty list"}, status_code=400)
+    if len(cmds) > PIPELINE_MAX_STAGES:
+        return JSONResponse({"error": f"too many stages (max {PIPELINE_MAX_STAGES})"}, status_code=400)
+    arrived = time.perf_counter()
+    client = client_id(request)
+    try:
+        stages = []
+        for i, cmd in enumerate(cmds):
+            try:
+                stages.append((cmd, check_cmd(cmd)))
+            except ExecError as e:
+                raise ExecError(e.status_code, f"stage {i}: {e.error}", e.headers)
+        queued_at = time.perf_counter()
+        async with exec_scheduler.slot(client, *(entry for _, entry in stages)):
+            started = time.perf_counter()
+            try:
+                result = await run_pipeline(stages)
+            except ExecError as e:
+                for _, entry in stages:
+                    EXEC_REQUESTS.inc(entry.command, exec_outcome(e))
+                raise
+    except ExecError as e:
+        audit_exec("pipeline", client, cmds, arrived, error=e)
+        return e.response()
+    audit_exec("pipeline", client, cmds, arrived, result,
+               returncodes=[stage["returncode"] for stage in result["stages"]])
+    for (_, entry), stage in zip(stages, result["stages"]):
+        EXEC_REQUESTS.inc(entry.command, "ok" if stage["returncode"] == 0 else "error")
+        EXEC_SPAWN.observe(stage["spawn_ms"] / 1000, entry.command)
+        EXEC_RUN.observe(stage["duration_ms"] / 1000, entry.command)
+        if stage["usage"] is not None:
+            stage["usage"]["queue_wait_ms"] = round((started - queued_at) * 1000, 3)
+        record_usage(entry, stage["usage"], stage["returncode"])
+    EXEC_QUEUE_WAIT.observe(started - queued_at, stages[0][1].command)
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+@app.get("/output/{handle}")
+async def get_output_info(handle: str):
+    """Metadata of spilled output: command, expiry and the size of each spilled stream."""
+    meta = output_store.get(handle)
+    if meta is None:
+        return JSONResponse({"error": "output not found or expired"}, status_code=404)
+    return meta
+
+@app.get("/output/{handle}/{stream}")
+async def get_output_range(handle: str, stream: str, request: Request, offset: int = 0,
+                           length: int = OUTPUT_RANGE_MAX):
+    """Raw bytes of a spilled stream, by `offset`/`length` or a `Range: bytes=a-b` header.
+
+    Responses are gzip-compressed when the client accepts it and are capped at
+    OUTPUT_RANGE_MAX bytes; Content-Range and X-Total-Length tell where to continue.
+    """
+    range_header = request.headers.get("range", "")
+    suffix = None
+    if range_header.startswith("bytes="):
+        start, _, end = range_header[len("bytes="):].partition("-")
+        try:
+            if start:
+                offset = int(start)
+                length = int(end) - offset + 1 if end else OUTPUT_RANGE_MAX
+            else:
+                # bytes=-N: the last N bytes, placed once the total size is known
+                suffix = int(end)
+        except ValueError:
+            return JSONResponse({"error": "invalid Range header"}, status_code=416)
+    if offset < 0 or length < 0 or (suffix is not None and suffix < 0):
+        return JSONResponse({"error": "offset and length must not be negative"}, status_code=400)
+    try:
+        if suffix is not None:
+            found = await asyncio.to_thread(output_store.read_range, handle, stream, 0, 0)
+            if found is not None:
+                offset = max(found[1] - suffix, 0)
+                length = found[1] - offset
+        length = min(length, OUTPUT_RANGE_MAX)
+        found = await asyncio.to_thread(output_store.read_range, handle, stream, offset, length)
+    except FileNotFoundError:
+        # Evicted by reserve() between the lookup and the read
+        found = None
+    if found is None:
+        return JSONResponse({"error": "output not found or expired"}, status_code=404)
+    data, total = found
+    if (range_header or offset > 0) and offset >= total:
+        return JSONResponse({"error": "range not satisfiable"}, status_code=416,
+                            headers={"Content-Range": f"bytes */{total}", "Accept-Ranges": "bytes"})
+    headers = {"X-Total-Length": str(total), "Accept-Ranges": "bytes"}
+    if data:
+        headers["Content-Range"] = f"bytes {offset}-{offset + len(data) - 1}/{total}"
+    if "gzip" in request.headers.get("accept-encoding", "") and len(data) > 1024:
+        data = await asyncio.to_thread(gzip.compress, data, 6)
+        headers["Content-Encoding"] = "gzip"
+    status = 206 if offset > 0 or offset + length < total else 200
+    return Response(data, status_code=status, headers=headers, media_type="application/octet-stream")
+
+@app.delete("/output/{handle}")
+async def delete_output(handle: str):
+    """Delete spilled output before it expires."""
+    if not output_store.delete(handle):
+        return JSONResponse({"error": "output not found or expired"}, status_code=404)
+    return {"deleted": handle}
+
+@app.post("/jobs")
+async def submit_job(payload: dict, request: Request):
+    """Start an allowlisted command in the background and return its job id immediately."""
+    started = time.perf_counter()
+    client = client_id(request)
+    cmd = payload.get("cmd", "")
+    try:
+        job_id = await job_runner.submit(cmd, check_cmd(cmd))
+    except ExecError as e:
+        audit_exec("job", client, cmd, started, error=e)
+        return e.response()
+    # The outcome is recorded as a `job_finished` record with the same job_id
+    audit_exec("job", client, cmd, started, status=202, job_id=job_id)
+    return JSONResponse(await asyncio.to_thread(job_store.get, job_id), status_code=202)
+
+@app.get("/jobs")
+async def list_jobs(status: str = None, limit: int = 50):
+    """List recent jobs, newest first, optionally filtered by status."""
+    return {"jobs": await asyncio.to_thread(job_store.list, status, max(1, min(limit, 500))),
+            "counts": await asyncio.to_thread(job_store.counts)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return job
+
+@app.get("/jobs/{job_id}/output")
+async def get_job_output(job_id: str, since: int = 0, limit: int = 200):
+    """Output chunks from sequence number `since`; poll again with `next` to tail."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    chunks = await asyncio.to_thread(job_store.output, job_id, since, max(1, min(limit, 1000)))
+    return {
+        "id": job_id,
+        "status": job["status"],
+        "chunks": chunks,
+        "next": chunks[-1]["seq"] + 1 if chunks else since,
+        "done": job["status"] in jobs.FINAL_STATES,
+    }
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    if not await job_runner.cancel(job_id):
+        return JSONResponse({"error": f"job already {job['status']}"}, status_code=409)
+    return await asyncio.to_thread(job_store.get, job_id)
+
+# --- Federation: fan /exec and /commands out to peer nodes ---
+
+fleet = peers.Fleet(PEERS, PEER_POOL_SIZE) if PEERS else None
+if fleet:
+    registry.gauge_func("mcp_peers_healthy", "Federation peers currently considered healthy",
+                        lambda: fleet.stats()["healthy"])
+
+async def probe_peers_periodically():
+    """Probe every peer's /health; failed peers are skipped by fan-outs until a probe succeeds."""
+    while True:
+        await fleet.probe_all(min(PEER_TIMEOUT, 5))
+        await asyncio.sleep(PEER_HEALTH_INTERVAL)
+
+def select_peers(payload: dict) -> tuple:
+    """(targets, skipped) for a fan-out request; targets are Peer objects or SELF_PEER."""
+    names = payload.get("peers")
+    if names is not None and (not isinstance(names, list) or not all(isinstance(n, str) for n in names)):
+        raise ExecError(400, "peers must be a list of peer names")
+    targets, skipped = fleet.select([n for n in names if n != SELF_PEER] if names is not None else None)
+    if names is not None and SELF_PEER in names:
+        targets.insert(0, SELF_PEER)
+    if not targets:
+        raise ExecError(503, "no healthy peers selected", {"Retry-After": str(RETRY_AFTER)})
+    return targets, skipped
+
+def peer_timeout(payload: dict) -> float:
+    try:
+        return min(float(payload.get("timeout", PEER_TIMEOUT)), PEER_TIMEOUT)
+    except (TypeError, ValueError):
+        raise ExecError(400, "timeout must be a number")
+
+async def forward(target, method: str, path: str, body, timeout: float, client: str = SELF_PEER) -> dict:
+    """One peer's response as a result entry.
+
+    Connection failures exclude the peer until a health probe succeeds; a
+    timeout does not, since the peer may just be running a slow command.
+    """
+    started = time.perf_counter()
+    if target == SELF_PEER:
+        name = SELF_PEER
+        try:
+            if path == "/exec":
+                result = {"status": 200, **shape_result(await execute(body["cmd"], check_cmd(body["cmd"]), client),
+                                                        bool(body.get("structured")))}
+            else:
+                result = {"status": 200, **list_commands()}
+        except ExecError as e:
+            result = {"status": e.status_code, "error": e.error}
+    else:
+        name = target.name
+        try:
+            status, data = await target.request(method, path, body, timeout)
+            target.mark(True, latency_ms=(time.perf_counter() - started) * 1000)
+            result = {"status": status, **(data if isinstance(data, dict) else {"body": data})}
+            PEER_REQUESTS.inc(name, "ok" if status == 200 else "error")
+        except asyncio.TimeoutError:
+            result = {"status": None, "error": f"peer timed out after {timeout:g}s"}
+            PEER_REQUESTS.inc(name, "timeout")
+        except (peers.PeerError, OSError) as e:
+            target.mark(False, str(e))
+            result = {"status": None, "error": f"peer unreachable: {e}"}
+            PEER_REQUESTS.inc(name, "unreachable")
+    result["peer"] = name
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    if path == "/exec":
+        audit_log.record("fleet_exec", "denied" if result["status"] in (400, 403) else "allowed",
+                         client=client, cmd=body["cmd"], peer=name, status=result["status"],
+                         returncode=result.get("returncode"), error=result.get("error"),
+                         duration_ms=result["duration_ms"])
+    return result
+
+def fleet_failed(result: dict) -> bool:
+    return result["status"] != 200 or result.get("returncode", 0) != 0
+
+@app.get("/fleet/peers")
+async def fleet_peers():
+    """Configured peers with their health state."""
+    if fleet is None:
+        return JSONResponse({"error": "federation not configured (MCP_PEERS)"}, status_code=404)
+    return {"peers": {name: peer.stats() for name, peer in fleet.peers.items()},
+            "healthy": fleet.stats()["healthy"]}
+
+@app.post("/fleet/exec")
+async def fleet_exec(payload: dict, request: Request):
+    """Run a command on the selected peers (default: all healthy ones) and merge the results."""
+    if fleet is None:
+        return JSONResponse({"error": "federation not configured (MCP_PEERS)"}, status_code=404)
+    cmd = payload.get("cmd", "")
+    try:
+        if not isinstance(cmd, str) or not cmd.strip():
+            raise ExecError(400, "cmd is required")
+        targets, skipped = select_peers(payload)
+        timeout = peer_timeout(payload)
+    except ExecError as e:
+        return e.response()
+    body = {"cmd": cmd, "structured": bool(payload.get("structured"))}
+    started = time.monotonic()
+    results = await asyncio.gather(*(forward(t, "POST", "/exec", body, timeout, client_id(request))
+                                   for t in targets))
+    return {
+        "cmd": cmd,
+        "results": {r["peer"]: r for r in results},
+        "skipped": skipped,
+        "count": len(results),
+        "failed": sum(1 for r in results if fleet_failed(r)),
+        "duration_ms": round((time.monotonic() - started) * 1000, 3),
+    }
+
+@app.post("/fleet/exec/stream")
+async def fleet_exec_stream(payload: dict, request: Request):
+    """Like /fleet/exec, but sends each peer's result as an SSE `result` event as soon as it arrives."""
+    if fleet is None:
+        return JSONResponse({"error": "federation not configured (MCP_PEERS)"}, status_code=404)
+    cmd = payload.get("cmd", "")
+    try:
+        if not isinstance(cmd, str) or not cmd.strip():
+            raise ExecError(400, "cmd is required")
+        targets, skipped = select_peers(payload)
+        timeout = peer_timeout(payload)
+    except ExecError as e:
+        return e.response()
+
+    body = {"cmd": cmd, "structured": bool(payload.get("structured"))}
+    client = client_id(request)
+
+    async def frames():
+        started = time.monotonic()
+        tasks = [asyncio.create_task(forward(t, "POST", "/exec", body, timeout, client)) for t in targets]
+        failed = 0
+        try:
+            for name, reason in skipped.items():
+                yield sse_event("skipped", {"peer": name, "reason": reason})
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                failed += fleet_failed(result)
+                yield sse_event("result", result)
+            yield sse_event("done", {
+                "count": len(tasks),
+                "failed": failed,
+                "skipped": len(skipped),
+                "duration_ms": round((time.monotonic() - started) * 1000, 3),
+            })
+        finally:
+            # Client went away: stop waiting on the remaining peers
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(frames(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/fleet/commands")
+async def fleet_commands(peer_names: str = Query(None, alias="peers")):
+    """Allowlists of the selected peers (comma-separated `peers`, default all healthy ones).
 
-    if not is_allowed(cmd):
-        return JSONResponse({"error": f"DENIED: {cmd} not in allowlist"}, status_code=403)
+    `common` lists the commands allowed on every peer that answered.
+    """
+    if fleet is None:
+        return JSONResponse({"error": "federation not configured (MCP_PEERS)"}, status_code=404)
     try:
-        res = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=60)
-        return {"stdout": res.stdout, "stderr": res.stderr, "returncode": res.returncode}
-    except subprocess.TimeoutExpired:
-        return JSONResponse({"error": "command timeout"}, status_code=504)
+        targets, skipped = select_peers({"peers": peer_names.split(",")} if peer_names else {})
+    except ExecError as e:
+        return e.response()
+    results = await asyncio.gather(*(forward(t, "GET", "/commands", None, PEER_TIMEOUT) for t in targets))
+    answered = [set(r.get("commands", [])) for r in results if r["status"] == 200]
+    return {
+        "results": {r["peer"]: r for r in results},
+        "skipped": skipped,
+        "common": sorted(set.intersection(*answered)) if answered else [],
+    }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("MCP_PORT", 3030)))
+    sockets = []
+    if LISTEN_TCP:
+        sockets.append(listeners.tcp_socket(HOST, PORT))
+    if UDS_PATH:
+        sockets.append(listeners.unix_socket(UDS_PATH, UDS_MODE))
+        bound_uds = UDS_PATH
+    if not sockets:
+        raise SystemExit("nothing to listen on: set MCP_UDS or leave MCP_TCP=1")
+    config = uvicorn.Config(app, timeout_keep_alive=KEEPALIVE_TIMEOUT, backlog=listeners.BACKLOG)
+    uvicorn.Server(config).run(sockets=sockets)
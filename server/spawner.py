@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Fork-server ("zygote") helper for the MCP front ends
+Launches commands on behalf of server.py and web/app.py over a Unix socket
+
+The helper is a small stdlib-only Python process started before the API
+servers grow, so the cost of forking a command stays constant no matter how
+large the FastAPI/Flask worker's memory image becomes.
+
+Protocol (one request per connection, JSON lines):
+    -> {"argv": ["uptime"], "timeout": 60}     or {"shell": "df -h", "executable": "/bin/bash"}
+       (optional "env": {...} replaces the helper's environment for the command)
+    <- {"pid": 1234}
+    <- {"returncode": 0, "stdout": "...", "stderr": "", "timeout": false, "spawn_ms": 0.4,
+        "wall_ms": 3.1, "rusage": {"ru_utime": 0.001, "ru_maxrss": 20480, ..., "rss_floor_kb": 12288}}
+       (rss_floor_kb: the helper's own peak RSS, which the command's ru_maxrss starts from)
+
+With "stream": true in the request, output is sent as it is read instead of
+being collected, one frame per chunk, and the final result has empty
+stdout/stderr:
+    <- {"stream": "stdout", "data": "..."}
+
+Benchmark against direct forking:
+    python3 spawner.py --bench 200 --ballast-mb 512
+"""
+
+import argparse
+import asyncio
+import codecs
+import json
+import os
+import resource
+import selectors
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _default_socket() -> str:
+    """Socket path inside a directory only this user can enter."""
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "mcp", "spawner.sock")
+    if os.getuid() == 0:
+        return "/run/mcp/spawner.sock"
+    return os.path.join(tempfile.gettempdir(), f"mcp-spawner-{os.getuid()}", "spawner.sock")
+
+
+DEFAULT_SOCKET = _default_socket()
+# Output is returned in a single JSON line, so readers need a generous line limit
+MAX_LINE = 1 << 30
+# Bytes read from a pipe at a time (and the most output in one stream frame)
+READ_SIZE = 65536
+# struct_rusage fields returned with each result
+RUSAGE_FIELDS = ("ru_utime", "ru_stime", "ru_maxrss", "ru_inblock", "ru_oublock", "ru_nvcsw", "ru_nivcsw")
+
+
+def run_request(request: dict) -> tuple:
+    """Start the requested command; return (Popen, spawn_ms)."""
+    started = time.perf_counter()
+    if "argv" in request:
+        proc = subprocess.Popen(request["argv"], env=request.get("env"), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, start_new_session=True)
+    else:
+        proc = subprocess.Popen(request["shell"], shell=True, executable=request.get("executable"),
+                                env=request.get("env"), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                start_new_session=True)
+    return proc, (time.perf_counter() - started) * 1000
+
+
+def collect(proc: subprocess.Popen, timeout: float = None, on_output=None) -> tuple:
+    """Read stdout/stderr to EOF (killing the process group at the timeout), then reap.
+
+    Reaping with wait4() instead of Popen.wait() keeps the rusage of the command
+    and its children. Returns (stdout, stderr, timed_out, rusage); with
+    `on_output(name, data)` chunks are passed on as read and stdout/stderr are empty.
+    """
+    output = {proc.stdout: [], proc.stderr: []}
+    names = {proc.stdout: "stdout", proc.stderr: "stderr"}
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    timed_out = False
+    with selectors.DefaultSelector() as selector:
+        for pipe in output:
+            selector.register(pipe, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                timed_out = True
+                deadline = None
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                continue
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, READ_SIZE)
+                if data and on_output is not None:
+                    on_output(names[key.fileobj], data)
+                elif data:
+                    output[key.fileobj].append(data)
+                else:
+                    selector.unregister(key.fileobj)
+    proc.stdout.close()
+    proc.stderr.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return b"".join(output[proc.stdout]), b"".join(output[proc.stderr]), timed_out, rusage
+
+
+class SpawnHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            started = time.perf_counter()
+            proc, spawn_ms = run_request(request)
+        except Exception as e:
+            self.send({"error": str(e)})
+            return
+        self.send({"pid": proc.pid})
+        on_output = None
+        if request.get("stream"):
+            decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace")
+                        for name in ("stdout", "stderr")}
+
+            def on_output(name, data):
+                text = decoders[name].decode(data)
+                if text:
+                    self.send({"stream": name, "data": text})
+        stdout, stderr, timed_out, rusage = collect(proc, request.get("timeout"), on_output)
+        if on_output is not None:
+            for name, decoder in decoders.items():
+                if text := decoder.decode(b"", final=True):
+                    self.send({"stream": name, "data": text})
+        self.send({
+            "returncode": proc.returncode,
+            "stdout": stdout.decode(errors="replace"),
+            "stderr": stderr.decode(errors="replace"),
+            "timeout": timed_out,
+            "spawn_ms": round(spawn_ms, 3),
+            "wall_ms": round((time.perf_counter() - started) * 1000, 3),
+            "rusage": {**{field: getattr(rusage, field) for field in RUSAGE_FIELDS},
+                       "rss_floor_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+        })
+
+    def send(self, message: dict):
+        try:
+            self.wfile.write(json.dumps(message).encode() + b"\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class SpawnServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _private_dir(path: str):
+    """Create `path` with mode 0700, or check that an existing one is ours and private."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by uid {os.getuid()} with mode 0700")
+
+
+def _check_peer(sock: socket.socket, socket_path: str):
+    """Refuse to talk to a listener run by another user (someone squatting on the path)."""
+    if hasattr(socket, "SO_PEERCRED"):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _pid, uid, _gid = struct.unpack("3i", creds)
+    else:
+        uid = os.stat(socket_path).st_uid
+    if uid != os.getuid():
+        raise ConnectionRefusedError(f"{socket_path} is served by uid {uid}, not {os.getuid()}")
+
+
+def serve(socket_path: str):
+    if os.path.dirname(socket_path) == os.path.dirname(DEFAULT_SOCKET):
+        _private_dir(os.path.dirname(socket_path))
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    old_umask = os.umask(0o077)
+    try:
+        server = SpawnServer(socket_path, SpawnHandler)
+    finally:
+        os.umask(old_umask)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def is_running(socket_path: str) -> bool:
+    """True if a helper run by this user is accepting connections on `socket_path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        _check_peer(sock, socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def start_spawner(socket_path: str = DEFAULT_SOCKET, wait: float = 5.0):
+    """Start a helper listening on `socket_path` unless one is already running.
+
+    Returns the Popen of the started helper, or None when an existing helper
+    was found.
+    """
+    if is_running(socket_path):
+        return None
+    proc = subprocess.Popen([sys.executable, "-I", os.path.abspath(__file__), "--socket", socket_path],
+                            stdin=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"spawner exited with status {proc.returncode}")
+        if is_running(socket_path):
+            return proc
+        time.sleep(0.01)
+    proc.kill()
+    raise RuntimeError(f"spawner did not start listening on {socket_path}")
+
+
+def stop_spawner(proc):
+    if proc is not None and proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _request(argv=None, shell=None, executable=None, timeout=None, env=None, stream=False) -> bytes:
+    request = {"argv": argv} if argv is not None else {"shell": shell, "executable": executable}
+    request["timeout"] = timeout
+    if env is not None:
+        request["env"] = env
+    if stream:
+        request["stream"] = True
+    return json.dumps(request).encode() + b"\n"
+
+
+def _result(pid_line: bytes, result_line: bytes) -> dict:
+    first = json.loads(pid_line)
+    if "error" in first:
+        raise OSError(first["error"])
+    if not result_line:
+        raise ConnectionError("spawner closed the connection")
+    result = json.loads(result_line)
+    result["pid"] = first["pid"]
+    return result
+
+
+def run(argv=None, shell=None, executable=None, timeout=None, socket_path: str = DEFAULT_SOCKET,
+        env=None) -> dict:
+    """Run a command through the helper (blocking); give either argv or shell."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        _check_peer(sock, socket_path)
+        sock.sendall(_request(argv, shell, executable, timeout, env))
+        with sock.makefile("rb") as stream:
+            pid_line = stream.readline()
+            return _result(pid_line, stream.readline())
+
+
+async def run_async(argv=None, shell=None, executable=None, timeout=None,
+                    socket_path: str = DEFAULT_SOCKET, env=None, on_output=None) -> dict:
+    """asyncio version of run() for the FastAPI server.
+
+    With `on_output`, output is streamed: `await on_output(name, bytes)` is called
+    per chunk (stdout/stderr in the result are then empty), so the caller bounds
+    what it keeps instead of receiving the whole output in one line.
+    """
+    streaming = on_output is not None
+    # A stream frame is at most READ_SIZE characters, each escaped to at most 6 bytes
+    limit = 8 * READ_SIZE if streaming else MAX_LINE
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit=limit)
+    try:
+        _check_peer(writer.get_extra_info("socket"), socket_path)
+        writer.write(_request(argv, shell, executable, timeout, env, streaming))
+        await writer.drain()
+        pid_line = await reader.readline()
+        while True:
+            line = await reader.readline()
+            if not streaming or not line.startswith(b'{"stream"'):
+                return _result(pid_line, line)
+            frame = json.loads(line)
+            await on_output(frame["stream"], frame["data"].encode())
+    finally:
+        writer.close()
+
+
+def bench(iterations: int, ballast_mb: int, socket_path: str):
+    """Compare spawn+wait latency of direct subprocess.run against the helper."""
+    ballast = bytearray(ballast_mb * 1024 * 1024)
+    # Touch every page so the parent's RSS really is that large
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1
+    helper = start_spawner(socket_path)
+    try:
+        results = {}
+        for name, fn in (
+            ("direct", lambda: subprocess.run(["true"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)),
+            ("spawner", lambda: run(argv=["true"], socket_path=socket_path)),
+        ):
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - started) * 1000)
+            samples.sort()
+            results[name] = {
+                "p50_ms": round(samples[len(samples) // 2], 3),
+                "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+                "mean_ms": round(sum(samples) / len(samples), 3),
+            }
+        print(json.dumps({"iterations": iterations, "ballast_mb": ballast_mb, "results": results}, indent=2))
+    finally:
+        stop_spawner(helper)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command spawner helper for the MCP servers")
+    parser.add_argument("--socket", default=os.environ.get("MCP_SPAWNER_SOCKET", DEFAULT_SOCKET))
+    parser.add_argument("--bench", type=int, metavar="N", help="benchmark N spawns instead of serving")
+    parser.add_argument("--ballast-mb", type=int, default=0, help="grow the benchmark parent by this many MB")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.bench, args.ballast_mb, args.socket)
+    else:
+        serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
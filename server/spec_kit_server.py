@@ -4,26 +4,75 @@ MCP Server for GitHub Spec-Kit
 Exposes spec-kit commands as Model Context Protocol tools via stdio
 """
 
+import asyncio
+import contextvars
 import json
-import subprocess
+import signal
 import sys
 import os
+import threading
+import time
 from typing import Any
 
+import accounting
+import audit
+import specify_env
+import template_cache
+
+# specify path and uv environment, resolved once and re-resolved when they change
+toolchain = specify_env.Toolchain()
+# init unpacks templates from this local cache instead of downloading one per call
+templates = template_cache.TemplateCache()
+# Per-subcommand CPU/RSS/IO totals, returned by the `speckit/stats` method
+usage_stats = accounting.UsageStats()
+# Append-only JSON lines record of every specify run (audit.AUDIT_DIR/spec-kit.jsonl)
+audit_log = audit.open_log("spec-kit")
+# When the current tools/call started waiting for a concurrency slot
+call_queued_at = contextvars.ContextVar("call_queued_at", default=None)
+
+# Maximum tools/call requests running specify at the same time
+MAX_CONCURRENCY = int(os.environ.get("MCP_SPECKIT_MAX_CONCURRENCY", 4))
+COMMAND_TIMEOUT = 30
+
+PROTOCOL_VERSION = "2024-11-05"
+SERVER_INFO = {"name": "spec-kit-mcp-server", "version": "1.0.0"}
+
+# JSON-RPC 2.0 error codes
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
 # MCP Protocol implementation
 class MCPServer:
     def __init__(self):
+        # Recorded as the client in the audit log: clientInfo.name from initialize
+        self.client = "stdio"
         self.tools = {
             "specify_init": {
-                "description": "Initialize a new Specify project from the latest template",
+                "description": "Initialize a new Specify project from the latest template (served from the local template cache)",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                         "path": {
                             "type": "string",
-                            "description": "Directory path for new Specify project (defaults to current directory)"
+                            "description": "Directory path for new Specify project ('.' for the server's current directory)"
+                        },
+                        "ai": {
+                            "type": "string",
+                            "description": "AI assistant the template is for (e.g. 'claude', 'copilot', 'gemini')"
+                        },
+                        "script": {
+                            "type": "string",
+                            "enum": ["sh", "ps"],
+                            "description": "Script type of the template"
+                        },
+                        "force": {
+                            "type": "boolean",
+                            "description": "Merge into the current directory even if it is not empty"
                         }
-                    }
+                    },
+                    "required": ["path"]
                 }
             },
             "specify_check": {
@@ -60,11 +109,28 @@ class MCPServer:
             }
         }
 
-    def run_specify_command(self, command: str, args: list = None) -> dict:
-        """Execute a specify CLI command"""
+    async def run_specify_command(self, command: str, args: list = None) -> dict:
+        """Execute a specify CLI command and record it in the audit log"""
         if args is None:
             args = []
-        
+        started = time.perf_counter()
+        fields = {"client": self.client, "command": command, "args": args}
+        try:
+            result = await self.execute_specify_command(command, args)
+        except asyncio.CancelledError:
+            audit_log.record("specify", "allowed", **fields, error="cancelled",
+                             duration_ms=round((time.perf_counter() - started) * 1000, 3))
+            raise
+        # Rejected before anything ran: unknown subcommand or unsafe arguments
+        decision = "denied" if result.get("denied") else "allowed"
+        fields.update(returncode=result["returncode"], cached=result.get("cached", False))
+        if "template" in result:
+            fields["template"] = result["template"]["cache"]
+        audit_log.record("specify", decision, **fields, duration_ms=round((time.perf_counter() - started) * 1000, 3))
+        result.pop("denied", None)
+        return result
+
+    async def execute_specify_command(self, command: str, args: list) -> dict:
         try:
             # Validate command is whitelisted
             valid_commands = {'init', 'check', 'version', 'help'}
@@ -73,7 +139,8 @@ class MCPServer:
                     "success": False,
                     "stdout": "",
                     "stderr": f"Unknown command: {command}. Valid commands: {valid_commands}",
-                    "returncode": 1
+                    "returncode": 1,
+                    "denied": True
                 }
             
             # Validate args - check for shell injection attempts
@@ -83,7 +150,8 @@ class MCPServer:
                         "success": False,
                         "stdout": "",
                         "stderr": "All arguments must be strings",
-                        "returncode": 1
+                        "returncode": 1,
+                        "denied": True
                     }
                 # Block dangerous shell metacharacters
                 if any(c in arg for c in ['|', '&', ';', '$', '`', '\n', '\r']):
@@ -91,34 +159,75 @@ class MCPServer:
                         "success": False,
                         "stdout": "",
                         "stderr": f"Invalid characters in argument: {arg}",
-                        "returncode": 1
+                        "returncode": 1,
+                        "denied": True
                     }
             
-            # Build command - ensure uv environment is sourced
-            cmd = f"source ~/.local/bin/env && specify {command}"
-            if args:
-                # Use shlex.quote for safe argument quoting (if needed in future)
-                cmd += " " + " ".join(args)
-            
-            result = subprocess.run(
-                cmd,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            # init unpacks a cached template; options only the CLI knows still run specify
+            if command == "init":
+                options = template_cache.parse_init_args(args)
+                if options is not None:
+                    return await asyncio.to_thread(template_cache.init_project, templates, options)
+
+            # version/check answer from memory until the binary changes
+            memoized = toolchain.memoized(command, args)
+            if memoized is not None:
+                return dict(memoized, cached=True)
+
+            resolved = toolchain.current()
+            if resolved.path is None:
+                return {
+                    "success": False,
+                    "stdout": "",
+                    "stderr": "specify not found in ~/.local/bin or PATH (after sourcing ~/.local/bin/env)",
+                    "returncode": 127
+                }
+            started = time.perf_counter()
+            queued_at = call_queued_at.get()
+            try:
+                # Exec the resolved binary with the captured environment - no shell per call;
+                # reaped with wait4() so the result carries its rusage
+                proc = await accounting.create_subprocess(
+                    [resolved.path, command, *args],
+                    env=resolved.env,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True
+                )
+            except FileNotFoundError:
+                # specify was removed or moved since it was resolved
+                toolchain.invalidate()
+                raise
+            spawn_ms = (time.perf_counter() - started) * 1000
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), COMMAND_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                # Timed out or cancelled by the client: kill the whole process group
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                proc.close()
+                await proc.wait()
+                raise
             
-            return {
-                "success": result.returncode == 0,
-                "stdout": result.stdout,
-                "stderr": result.stderr,
-                "returncode": result.returncode
+            usage = proc.usage(started - queued_at if queued_at is not None else 0.0)
+            usage_stats.record(command, usage, proc.returncode == 0)
+            result = {
+                "success": proc.returncode == 0,
+                "stdout": stdout.decode(errors="replace"),
+                "stderr": stderr.decode(errors="replace"),
+                "returncode": proc.returncode,
+                "spawn_ms": round(spawn_ms, 3),
+                "usage": usage
             }
-        except subprocess.TimeoutExpired:
+            toolchain.remember(command, args, resolved, result)
+            return result
+        except asyncio.TimeoutError:
             return {
                 "success": False,
                 "stdout": "",
-                "stderr": "Command timed out after 30 seconds",
+                "stderr": f"Command timed out after {COMMAND_TIMEOUT} seconds",
                 "returncode": -1
             }
         except Exception as e:
@@ -129,19 +238,31 @@ class MCPServer:
                 "returncode": -1
             }
 
-    def handle_call_tool(self, tool_name: str, tool_input: dict) -> str:
+    async def handle_call_tool(self, tool_name: str, tool_input: dict) -> str:
         """Handle tool execution"""
         if tool_name == "specify_init":
-            path = tool_input.get("path", ".")
-            result = self.run_specify_command("init", [path] if path != "." else [])
+            path = tool_input.get("path", "")
+            if not path:
+                # An explicit "." is required to initialize the server's own directory
+                return json.dumps({
+                    "success": False,
+                    "stderr": "path parameter is required ('.' for the current directory)"
+                })
+            args = [path] if path != "." else ["--here"]
+            for option in ("ai", "script"):
+                if tool_input.get(option):
+                    args += [f"--{option}", str(tool_input[option])]
+            if tool_input.get("force"):
+                args.append("--force")
+            result = await self.run_specify_command("init", args)
             return json.dumps(result)
         
         elif tool_name == "specify_check":
-            result = self.run_specify_command("check")
+            result = await self.run_specify_command("check")
             return json.dumps(result)
         
         elif tool_name == "specify_version":
-            result = self.run_specify_command("version")
+            result = await self.run_specify_command("version")
             return json.dumps(result)
         
         elif tool_name == "specify_run_command":
@@ -152,7 +273,7 @@ class MCPServer:
                     "success": False,
                     "stderr": "command parameter is required"
                 })
-            result = self.run_specify_command(command, args)
+            result = await self.run_specify_command(command, args)
             return json.dumps(result)
         
         else:
@@ -161,38 +282,49 @@ class MCPServer:
                 "stderr": f"Unknown tool: {tool_name}"
             })
 
-    def process_request(self, request: dict) -> dict:
+    def stats(self, sort: str = "cpu_ms") -> dict:
+        """Resource usage of specify runs since start, per subcommand, heaviest first"""
+        return {**usage_stats.totals(), "by_command": usage_stats.snapshot(sort), "templates": templates.stats(),
+                "audit": audit_log.stats()}
+
+    def list_tools(self) -> list:
+        return [
+            {
+                "name": name,
+                "description": tool["description"],
+                "inputSchema": tool["inputSchema"]
+            }
+            for name, tool in self.tools.items()
+        ]
+
+    async def process_request(self, request: dict) -> dict:
         """Process MCP protocol request"""
         request_type = request.get("type")
         
         if request_type == "initialize":
             return {
                 "type": "initialize",
-                "protocolVersion": "2024-11-05",
+                "protocolVersion": PROTOCOL_VERSION,
                 "capabilities": {},
-                "serverInfo": {
-                    "name": "spec-kit-mcp-server",
-                    "version": "1.0.0"
-                }
+                "serverInfo": SERVER_INFO
             }
         
         elif request_type == "tools/list":
             return {
                 "type": "tools/list",
-                "tools": [
-                    {
-                        "name": name,
-                        "description": tool["description"],
-                        "inputSchema": tool["inputSchema"]
-                    }
-                    for name, tool in self.tools.items()
-                ]
+                "tools": self.list_tools()
+            }
+        
+        elif request_type == "stats":
+            return {
+                "type": "stats",
+                **self.stats(request.get("sort", "cpu_ms"))
             }
         
         elif request_type == "tools/call":
             tool_name = request.get("name")
             tool_input = request.get("arguments", {})
-            result = self.handle_call_tool(tool_name, tool_input)
+            result = await self.handle_call_tool(tool_name, tool_input)
             
             return {
                 "type": "tools/call",
@@ -206,41 +338,254 @@ class MCPServer:
                 "message": f"Unknown request type: {request_type}"
             }
 
+    async def process_rpc(self, request: dict):
+        """Process a JSON-RPC 2.0 request; returns the result, or None for notifications"""
+        method = request.get("method")
+        params = request.get("params") or {}
+
+        if method == "initialize":
+            client_info = params.get("clientInfo")
+            if isinstance(client_info, dict) and client_info.get("name"):
+                self.client = str(client_info["name"])
+            return {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {"tools": {}},
+                "serverInfo": SERVER_INFO
+            }
+
+        elif method == "tools/list":
+            return {"tools": self.list_tools()}
+
+        elif method == "tools/call":
+            result = await self.handle_call_tool(params.get("name"), params.get("arguments", {}))
+            return {
+                "content": [{"type": "text", "text": result}],
+                "isError": not json.loads(result).get("success", False)
+            }
+
+        elif method == "ping":
+            return {}
+
+        elif method == "speckit/stats":
+            try:
+                return self.stats(params.get("sort", "cpu_ms"))
+            except ValueError as e:
+                raise RPCError(INVALID_PARAMS, str(e))
+
+        elif isinstance(method, str) and method.startswith("notifications/"):
+            return None
+
+        raise RPCError(METHOD_NOT_FOUND, f"Method not found: {method}")
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+def is_call(message: dict) -> bool:
+    """True for requests that run specify (and so go through the concurrency limit)"""
+    return message.get("method", message.get("type")) == "tools/call"
+
+def is_cancel(message: dict) -> bool:
+    return message.get("method") == "notifications/cancelled" or message.get("type") == "cancel"
+
+class StdioSession:
+    """Reads requests from stdin and answers them concurrently on stdout
+
+    Each tools/call runs in its own task (at most MAX_CONCURRENCY run
+    specify at once), so responses can complete out of order; clients
+    correlate them by `id`. A single writer task owns stdout, so frames
+    never interleave.
+    """
+
+    def __init__(self, server: MCPServer, max_concurrency: int = MAX_CONCURRENCY):
+        self.server = server
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = {}  # request id -> task running the call
+        self.tasks = set()
+        self.outbox = asyncio.Queue()
+
+    def send(self, message):
+        self.outbox.put_nowait(json.dumps(message))
+
+    async def write_frames(self):
+        """Sole writer of stdout: batches queued frames into one write"""
+        while True:
+            frames = [await self.outbox.get()]
+            while not self.outbox.empty():
+                frames.append(self.outbox.get_nowait())
+            await asyncio.to_thread(write_stdout, "\n".join(frames) + "\n")
+            for _ in frames:
+                self.outbox.task_done()
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def handle_line(self, line: str):
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError as e:
+            self.send({"type": "error", "message": f"Invalid JSON: {e}"})
+            return
+        if isinstance(message, list):
+            if not message:
+                self.send(rpc_error(None, INVALID_REQUEST, "Empty batch"))
+                return
+            self.spawn(self.reply_batch([self.start(m) for m in message]))
+        elif not isinstance(message, dict):
+            self.send({"type": "error", "message": "Request must be a JSON object or array"})
+        elif is_cancel(message):
+            self.cancel(message)
+        else:
+            # Every request gets its own task, so initialize/tools/list never wait behind calls
+            self.spawn(self.reply(self.start(message)))
+
+    def cancel(self, message: dict):
+        """Cancel an in-flight call; the cancelled call gets no response"""
+        request_id = (message.get("params") or {}).get("requestId", message.get("id"))
+        # Its id is free again right away, even before the task has unwound
+        task = self.in_flight.pop(request_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def reply(self, pending):
+        response = await self.respond(pending)
+        if response is not None:
+            self.send(response)
+
+    async def reply_batch(self, pending: list):
+        responses = await asyncio.gather(*(self.respond(p) for p in pending))
+        responses = [r for r in responses if r is not None]
+        if responses:
+            self.send(responses)
+
+    def start(self, message):
+        """Begin handling a message as soon as it is read; respond() turns the result into its response.
+
+        Calls are registered in `in_flight` here rather than in a task of
+        their own, so a cancel read right behind its request finds the call.
+        """
+        if not isinstance(message, dict):
+            return rpc_error(None, INVALID_REQUEST, "Request must be a JSON object")
+        if is_cancel(message):
+            self.cancel(message)
+            return None
+        request_id = message.get("id")
+        if request_id is not None and request_id in self.in_flight:
+            return self.error_for(message, INVALID_REQUEST, f"Request id already in flight: {request_id}")
+        if not is_call(message):
+            return self.dispatch(message)
+        task = asyncio.create_task(self.call(message))
+        if request_id is not None:
+            self.in_flight[request_id] = task
+
+            def done(_):
+                if self.in_flight.get(request_id) is task:
+                    del self.in_flight[request_id]
+            task.add_done_callback(done)
+        return task
+
+    async def respond(self, pending) -> dict:
+        """Response for a started message, or None (notification or cancelled call)"""
+        if pending is None or isinstance(pending, dict):
+            return pending
+        if not isinstance(pending, asyncio.Task):
+            return await pending
+        await asyncio.wait([pending])
+        if pending.cancelled():
+            return None
+        return pending.result()
+
+    async def call(self, message: dict) -> dict:
+        call_queued_at.set(time.perf_counter())
+        async with self.slots:
+            return await self.dispatch(message)
+
+    async def dispatch(self, message: dict) -> dict:
+        request_id = message.get("id")
+        if "method" not in message:
+            # Original {"type": ...} protocol; the id (if any) is echoed back
+            try:
+                response = await self.server.process_request(message)
+            except Exception as e:
+                response = {"type": "error", "message": str(e)}
+            if request_id is not None:
+                response["id"] = request_id
+            return response
+        try:
+            result = await self.server.process_rpc(message)
+        except RPCError as e:
+            return self.error_for(message, e.code, str(e))
+        except Exception as e:
+            return self.error_for(message, INTERNAL_ERROR, str(e))
+        if request_id is None:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    @staticmethod
+    def error_for(message: dict, code: int, text: str) -> dict:
+        if "method" in message:
+            return rpc_error(message.get("id"), code, text)
+        response = {"type": "error", "message": text}
+        if message.get("id") is not None:
+            response["id"] = message["id"]
+        return response
+
+    async def run(self):
+        writer = asyncio.create_task(self.write_frames())
+        lines = asyncio.Queue()
+        # Blocking stdin reads happen in a daemon thread so Ctrl-C never waits on them
+        threading.Thread(target=read_stdin, args=(asyncio.get_running_loop(), lines), daemon=True).start()
+        try:
+            while True:
+                line = await lines.get()
+                if line is None:
+                    break
+                line = line.strip()
+                if line:
+                    self.handle_line(line)
+            # stdin closed: finish outstanding calls and flush their responses
+            while self.tasks:
+                await asyncio.wait(set(self.tasks))
+            await self.outbox.join()
+        finally:
+            writer.cancel()
+
+def rpc_error(request_id, code: int, message: str) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+def read_stdin(loop, lines: asyncio.Queue):
+    for line in sys.stdin:
+        loop.call_soon_threadsafe(lines.put_nowait, line)
+    loop.call_soon_threadsafe(lines.put_nowait, None)
+
+def write_stdout(data: str):
+    sys.stdout.write(data)
+    sys.stdout.flush()
+
 def main():
-    """Main entry point - read JSON-RPC messages from stdin"""
+    """Main entry point - read MCP requests from stdin and answer them concurrently"""
     server = MCPServer()
     
     # Log that server started
-    sys.stderr.write("Spec-Kit MCP Server started\n")
+    resolved = toolchain.current()
+    if template_cache.SEED:
+        try:
+            templates.seed(template_cache.SEED, replace=False)
+        except (template_cache.TemplateError, OSError) as e:
+            sys.stderr.write(f"Template seeding from {template_cache.SEED} failed: {e}\n")
+    sys.stderr.write(f"Spec-Kit MCP Server started (specify: {resolved.path or 'not found'})\n")
     sys.stderr.flush()
     
     try:
-        for line in sys.stdin:
-            line = line.strip()
-            if not line:
-                continue
-            
-            try:
-                request = json.loads(line)
-                response = server.process_request(request)
-                print(json.dumps(response), flush=True)
-            except json.JSONDecodeError as e:
-                print(json.dumps({
-                    "type": "error",
-                    "message": f"Invalid JSON: {e}"
-                }), flush=True)
-            except Exception as e:
-                print(json.dumps({
-                    "type": "error",
-                    "message": str(e)
-                }), flush=True)
-    
+        asyncio.run(StdioSession(server).run())
     except KeyboardInterrupt:
         sys.exit(0)
-    except EOFError:
-        # stdin closed, exit gracefully
-        sys.stderr.write("Spec-Kit MCP Server stopped\n")
-        sys.exit(0)
+    # stdin closed, exit gracefully
+    sys.stderr.write("Spec-Kit MCP Server stopped\n")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,135 @@
+"""
+Cached specify toolchain for the Spec-Kit front ends
+Captures the uv environment (~/.local/bin/env) and the absolute path of
+`specify` once, instead of starting bash and sourcing the env file on every
+call. Both are re-resolved only when the env file or the binary changes.
+
+Output of argument-less `specify version` / `specify check` is memoized and
+invalidated when the binary's mtime changes, so those tools answer from
+memory.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+ENV_FILE = os.path.expanduser("~/.local/bin/env")
+# uv installs specify into ~/.local/bin; searched before the captured PATH
+LOCAL_BIN = os.path.expanduser("~/.local/bin")
+# Subcommands whose argument-less output only depends on the installed binary
+MEMOIZED_COMMANDS = ("version", "check")
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def capture_env(env_file: str = ENV_FILE) -> dict:
+    """Environment after sourcing `env_file` in bash (os.environ if it does not exist)."""
+    env = dict(os.environ)
+    if not os.path.exists(env_file):
+        return env
+    result = subprocess.run(
+        ["/bin/bash", "-c", 'source "$1" >/dev/null 2>&1 && env -0', "bash", env_file],
+        capture_output=True, timeout=10,
+    )
+    if result.returncode != 0:
+        return env
+    captured = {}
+    for item in result.stdout.split(b"\0"):
+        key, sep, value = item.decode(errors="replace").partition("=")
+        if sep and key:
+            captured[key] = value
+    return captured or env
+
+
+class Resolved:
+    """A resolved toolchain: specify path, environment and the stat keys they came from."""
+
+    __slots__ = ("path", "env", "env_key", "binary_key", "resolved_at", "resolve_ms")
+
+    def __init__(self, path, env, env_key, binary_key, resolve_ms):
+        self.path = path
+        self.env = env
+        self.env_key = env_key
+        self.binary_key = binary_key
+        self.resolved_at = time.time()
+        self.resolve_ms = resolve_ms
+
+
+class Toolchain:
+    """Thread-safe cache of the resolved specify toolchain and memoized outputs."""
+
+    def __init__(self, env_file: str = ENV_FILE):
+        self.env_file = env_file
+        self._lock = threading.Lock()
+        self._resolved = None
+        self._memo = {}  # command -> (binary_key, result)
+        self.resolutions = 0
+        self.memo_hits = 0
+
+    def _is_current(self, resolved) -> bool:
+        # Two stat() calls; when specify was not found, watch the path uv would install it to
+        return (resolved is not None and _stat_key(self.env_file) == resolved.env_key
+                and _stat_key(resolved.path or os.path.join(LOCAL_BIN, "specify")) == resolved.binary_key)
+
+    def current(self) -> Resolved:
+        """Resolved toolchain, re-resolved if the env file or binary changed since last time."""
+        resolved = self._resolved
+        if self._is_current(resolved):
+            return resolved
+        with self._lock:
+            if self._is_current(self._resolved):
+                return self._resolved
+            started = time.perf_counter()
+            env_key = _stat_key(self.env_file)
+            env = capture_env(self.env_file)
+            path = shutil.which("specify", path=os.pathsep.join([LOCAL_BIN, env.get("PATH", os.defpath)]))
+            self._resolved = Resolved(path, env, env_key, _stat_key(path or os.path.join(LOCAL_BIN, "specify")),
+                                      (time.perf_counter() - started) * 1000)
+            self._memo.clear()
+            self.resolutions += 1
+            return self._resolved
+
+    def invalidate(self):
+        """Forget the resolution (e.g. after specify disappeared between resolve and exec)."""
+        with self._lock:
+            self._resolved = None
+            self._memo.clear()
+
+    def memoized(self, command: str, args) -> dict:
+        """Memoized result for `specify <command>` or None."""
+        if args or command not in MEMOIZED_COMMANDS:
+            return None
+        resolved = self.current()
+        entry = self._memo.get(command)
+        if entry is None or entry[0] != resolved.binary_key:
+            return None
+        self.memo_hits += 1
+        return entry[1]
+
+    def remember(self, command: str, args, resolved: Resolved, result: dict):
+        """Memoize a result that came from running the binary of `resolved`."""
+        if args or command not in MEMOIZED_COMMANDS or result.get("returncode", -1) < 0:
+            return
+        with self._lock:
+            if self._resolved is resolved:
+                self._memo[command] = (resolved.binary_key, result)
+
+    def stats(self) -> dict:
+        resolved = self._resolved
+        return {
+            "specify": resolved.path if resolved else None,
+            "resolved_at": datetime.fromtimestamp(resolved.resolved_at).isoformat() if resolved else None,
+            "resolve_ms": round(resolved.resolve_ms, 3) if resolved else None,
+            "resolutions": self.resolutions,
+            "memoized": sorted(self._memo),
+            "memo_hits": self.memo_hits,
+        }
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of Spec-Kit project templates
+`specify init` downloads the latest release template from GitHub on every
+call, which is slow and impossible without outbound network. The front ends
+instead fetch the release asset once, keep it on disk under its sha256 and
+unpack it themselves the way `specify init` does.
+
+Layout of the cache directory:
+    objects/<sha256>.zip    template archives, named by content
+    index.json              (ai, script) -> object, release tag and check times
+    lock                    flock()ed while the index is read-modify-written
+
+Upstream is contacted without holding the lock: a download goes to a temp
+file and is only moved into objects/ and the index under the lock.
+
+Refresh policy (MCP_TEMPLATE_REFRESH): "always" asks upstream on every init
+(a conditional request, so an unchanged release costs one 304), "never" only
+downloads what is missing, and a number of seconds re-checks cached templates
+that are older than that. With MCP_TEMPLATE_OFFLINE=1 upstream is never
+contacted; when upstream cannot be reached, a cached template is served stale.
+
+Pre-seed the cache from release zips (a directory or tarball of them), or
+from an unpacked template tree:
+    python3 template_cache.py seed ./spec-kit-templates.tar.gz
+    python3 template_cache.py seed ./my-template --ai claude --script sh
+    python3 template_cache.py list
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import http.client
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+from datetime import datetime
+
+CACHE_DIR = os.environ.get(
+    "MCP_TEMPLATE_CACHE_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "mcp", "spec-kit-templates"))
+# GitHub API base of the repository whose releases carry the templates
+UPSTREAM = os.environ.get("MCP_TEMPLATE_UPSTREAM", "https://api.github.com/repos/github/spec-kit")
+# "always", "never" or a number of seconds between upstream checks
+REFRESH = os.environ.get("MCP_TEMPLATE_REFRESH", "86400")
+OFFLINE = os.environ.get("MCP_TEMPLATE_OFFLINE", "0") == "1"
+FETCH_TIMEOUT = float(os.environ.get("MCP_TEMPLATE_FETCH_TIMEOUT", 30))
+# Template variant used when init does not pass --ai / --script
+DEFAULT_AI = os.environ.get("MCP_TEMPLATE_AI", "claude")
+DEFAULT_SCRIPT = os.environ.get("MCP_TEMPLATE_SCRIPT", "sh")
+# Directory, tarball or zip the front ends seed missing templates from at startup
+SEED = os.environ.get("MCP_TEMPLATE_SEED", "")
+
+# spec-kit release assets: spec-kit-template-<ai>-<script>-<tag>.zip
+ASSET_NAME = re.compile(r"^spec-kit-template-(?P<ai>.+)-(?P<script>sh|ps)-(?P<tag>v?[0-9][\w.+-]*)\.zip$")
+SCRIPT_TYPES = ("sh", "ps")
+# init options the cached path implements; anything else runs the specify CLI
+INIT_FLAGS = {"--here", "--force", "--no-git", "--ignore-agent-tools"}
+INIT_OPTIONS = {"--ai", "--script"}
+# Unreferenced archives are deleted once they are this old (another process may still be unpacking one)
+PRUNE_AFTER = 600
+
+
+class TemplateError(Exception):
+    pass
+
+
+def parse_init_args(args: list):
+    """Options of `specify init <args>` as a dict, or None if the cached path cannot honour them."""
+    options = {"project": None, "ai": DEFAULT_AI, "script": DEFAULT_SCRIPT, "here": False, "force": False,
+               "git": True}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        name, eq, value = arg.partition("=")
+        if name in INIT_OPTIONS:
+            if not eq:
+                if i + 1 >= len(args):
+                    return None
+                i += 1
+                value = args[i]
+            options[name[2:]] = value
+        elif arg in INIT_FLAGS:
+            if arg == "--here":
+                options["here"] = True
+            elif arg == "--force":
+                options["force"] = True
+            elif arg == "--no-git":
+                options["git"] = False
+        elif arg.startswith("-") or options["project"] is not None:
+            return None
+        else:
+            options["project"] = arg
+        i += 1
+    if options["project"] == ".":
+        options["project"], options["here"] = None, True
+    if options["script"] not in SCRIPT_TYPES or (options["project"] is None) == (not options["here"]):
+        return None
+    return options
+
+
+def _now() -> float:
+    return time.time()
+
+
+class TemplateCache:
+    """Templates by (ai, script) in a cache directory shared by every front end on the host."""
+
+    def __init__(self, cache_dir: str = CACHE_DIR, upstream: str = UPSTREAM, refresh: str = REFRESH,
+                 offline: bool = OFFLINE, timeout: float = FETCH_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.upstream = upstream.rstrip("/")
+        if refresh not in ("always", "never"):
+            refresh = float(refresh)
+        self.refresh = refresh
+        self.offline = offline
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._fetching = {}  # key -> lock, so one thread downloads a template while others wait
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.cache_dir, *parts)
+
+    def object_path(self, sha256: str) -> str:
+        return self._path("objects", f"{sha256}.zip")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """The index, held under the thread lock and the cache directory's flock."""
+        os.makedirs(self._path("objects"), exist_ok=True)
+        with self._lock:
+            fd = os.open(self._path("lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield self._read_index()
+            finally:
+                os.close(fd)
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self._path("index.json")) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        index.setdefault("templates", {})
+        index.setdefault("release", None)
+        return index
+
+    def _write_index(self, index: dict):
+        # Drop archives no template has pointed to for a while
+        keep = {entry["sha256"] for entry in index["templates"].values()}
+        for name in os.listdir(self._path("objects")):
+            path = self._path("objects", name)
+            if name[:-4] not in keep and _now() - os.stat(path).st_mtime > PRUNE_AFTER:
+                os.unlink(path)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=".index-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp, self._path("index.json"))
+
+    def _store(self, data: bytes) -> str:
+        """Write an archive under its sha256 (a no-op if it is already there)."""
+        _check_archive(io.BytesIO(data))
+        fd, tmp = tempfile.mkstemp(dir=self._path("objects"), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        sha256 = hashlib.sha256(data).hexdigest()
+        self._publish(tmp, sha256)
+        return sha256
+
+    def _publish(self, tmp: str, sha256: str):
+        """Move a checked archive into objects/ under its sha256, or drop it if that is already there."""
+        path = self.object_path(sha256)
+        if os.path.exists(path):
+            os.unlink(tmp)
+            os.utime(path)
+        else:
+            os.replace(tmp, path)
+
+    def _download(self, url: str) -> tuple:
+        """Fetch an archive into a temp file next to the objects; (temp path, sha256, size)."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self._path("objects"), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f, self._request(url, "application/octet-stream") as response:
+                while True:
+                    chunk = response.read(1 << 16)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            _check_archive(tmp)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return tmp, digest.hexdigest(), size
+
+    def _request(self, url: str, accept: str, etag: str = None):
+        headers = {"Accept": accept, "User-Agent": "mcp-spec-kit-template-cache"}
+        token = os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN")
+        if token and url.startswith("https://api.github.com/"):
+            headers["Authorization"] = f"Bearer {token}"
+        if etag:
+            headers["If-None-Match"] = etag
+        return urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout)
+
+    def _latest_release(self, cached: dict) -> dict:
+        """Latest release (tag and asset URLs), revalidated with the ETag of the last answer."""
+        try:
+            with self._request(f"{self.upstream}/releases/latest", "application/vnd.github+json",
+                               cached and cached.get("etag")) as response:
+                body = json.load(response)
+                etag = response.headers.get("ETag")
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and cached:
+                return dict(cached, checked_at=_now())
+            raise TemplateError(f"release lookup failed: HTTP {e.code} from {self.upstream}")
+        return {
+            "tag": body.get("tag_name"),
+            "etag": etag,
+            "checked_at": _now(),
+            "assets": {a["name"]: a["browser_download_url"] for a in body.get("assets", [])
+                       if a.get("name") and a.get("browser_download_url")},
+        }
+
+    def _due(self, entry: dict) -> bool:
+        if self.refresh == "always":
+            return True
+        if self.refresh == "never":
+            return False
+        return _now() - entry.get("checked_at", 0) >= self.refresh
+
+    def get(self, ai: str = DEFAULT_AI, script: str = DEFAULT_SCRIPT) -> tuple:
+        """(archive path, info) for a template, fetching it when missing or due for a check.
+
+        info reports `cache` ("hit", "miss" or "stale"), `fetch_ms` (time spent on
+        upstream), the release `tag`, `asset` and `sha256`. Raises TemplateError when
+        there is neither a usable cached template nor a way to fetch one.
+        """
+        key = f"{ai}-{script}"
+        started = time.perf_counter()
+        with self._lock:
+            fetching = self._fetching.setdefault(key, threading.Lock())
+        with fetching:
+            with self._locked() as index:
+                entry = self._cached(index, key)
+                if entry is not None and (self.offline or not self._due(entry)):
+                    return self._result(entry, "hit", started, contacted=False)
+                if self.offline:
+                    raise TemplateError(f"offline and no cached {key} template in {self.cache_dir}; "
+                                        f"seed it with `python3 template_cache.py seed <dir|tarball>`")
+                known = index["release"]
+            tmp = None
+            try:
+                release = self._latest_release(known)
+                pattern = f"spec-kit-template-{ai}-{script}"
+                assets = sorted(n for n in release["assets"] if pattern in n and n.endswith(".zip"))
+                if not assets:
+                    raise TemplateError(f"release {release['tag']} has no {pattern} asset")
+                asset = assets[0]
+                if entry is not None and entry["asset"] == asset and entry["tag"] == release["tag"]:
+                    with self._locked() as index:
+                        index["release"] = release
+                        entry = self._cached(index, key) or entry
+                        entry["checked_at"] = release["checked_at"]
+                        index["templates"][key] = entry
+                        self._write_index(index)
+                    return self._result(entry, "hit", started)
+                tmp, sha256, size = self._download(release["assets"][asset])
+                with self._locked() as index:
+                    index["release"] = release
+                    self._publish(tmp, sha256)
+                    tmp = None
+                    entry = index["templates"][key] = {
+                        "sha256": sha256, "size": size, "asset": asset, "tag": release["tag"],
+                        "source": release["assets"][asset], "fetched_at": _now(), "checked_at": _now(),
+                    }
+                    self._write_index(index)
+                return self._result(entry, "miss", started)
+            except (OSError, http.client.HTTPException, TemplateError, ValueError, KeyError) as e:
+                if entry is None:
+                    if isinstance(e, TemplateError):
+                        raise
+                    raise TemplateError(f"cannot fetch {key} template from {self.upstream}: {e}")
+                # Upstream unreachable or broken: the template we have beats no template
+                return self._result(entry, "stale", started, error=str(e))
+            finally:
+                if tmp is not None:
+                    os.unlink(tmp)
+
+    def _cached(self, index: dict, key: str):
+        """The index entry of a template whose archive is still on disk."""
+        entry = index["templates"].get(key)
+        if entry is not None and not os.path.exists(self.object_path(entry["sha256"])):
+            return None
+        return entry
+
+    def _result(self, entry: dict, outcome: str, started: float, contacted: bool = True, error: str = None):
+        if outcome == "hit":
+            self.hits += 1
+        elif outcome == "miss":
+            self.misses += 1
+        else:
+            self.stale += 1
+        info = {
+            "cache": outcome,
+            "fetch_ms": round((time.perf_counter() - started) * 1000, 3) if contacted else 0.0,
+            "tag": entry["tag"],
+            "asset": entry["asset"],
+            "sha256": entry["sha256"],
+            "offline": self.offline,
+        }
+        if error:
+            info["error"] = error
+        path = self.object_path(entry["sha256"])
+        # Handed out: keep it past PRUNE_AFTER even if another process replaces it meanwhile
+        os.utime(path)
+        return path, info
+
+    def seed(self, source: str, ai: str = None, script: str = None, replace: bool = True) -> list:
+        """Add templates from a release zip, a directory or tarball of them, or an unpacked template tree.
+
+        Release zips are keyed by their asset name; a template tree needs `ai`
+        and `script`. With replace=False templates already cached are kept.
+        Returns the (key, entry) pairs that were added.
+        """
+        archives = []  # (asset name, data)
+        if os.path.isdir(source):
+            names = sorted(os.listdir(source))
+            if any(ASSET_NAME.match(n) for n in names):
+                for name in names:
+                    if ASSET_NAME.match(name):
+                        with open(os.path.join(source, name), "rb") as f:
+                            archives.append((name, f.read()))
+            else:
+                archives.append((None, pack_tree(source)))
+        elif tarfile.is_tarfile(source):
+            with tarfile.open(source) as tar, tempfile.TemporaryDirectory() as tmp:
+                members = [m for m in tar.getmembers() if m.isfile()]
+                zips = [m for m in members if ASSET_NAME.match(os.path.basename(m.name))]
+                if zips:
+                    for member in sorted(zips, key=lambda m: m.name):
+                        archives.append((os.path.basename(member.name), tar.extractfile(member).read()))
+                else:
+                    # Python >= 3.11.4 refuses absolute paths, links out of the tree and devices
+                    tar.extractall(tmp, **({"filter": "data"} if hasattr(tarfile, "data_filter") else {}))
+                    archives.append((None, pack_tree(_single_root(tmp))))
+        elif zipfile.is_zipfile(source):
+            with open(source, "rb") as f:
+                archives.append((os.path.basename(source), f.read()))
+        else:
+            raise TemplateError(f"{source}: not a directory, tarball or zip")
+
+        added = []
+        with self._locked() as index:
+            for name, data in archives:
+                match = ASSET_NAME.match(name) if name else None
+                if match:
+                    key_ai, key_script, tag = match["ai"], match["script"], match["tag"]
+                elif ai and script:
+                    key_ai, key_script, tag = ai, script, "local"
+                    name = f"spec-kit-template-{ai}-{script}-local.zip"
+                else:
+                    raise TemplateError(f"{source}: cannot tell which template this is; pass --ai and --script")
+                if not replace and f"{key_ai}-{key_script}" in index["templates"]:
+                    continue
+                entry = {"sha256": self._store(data), "size": len(data), "asset": name, "tag": tag,
+                         "source": f"seed:{os.path.abspath(source)}", "fetched_at": _now(), "checked_at": _now()}
+                index["templates"][f"{key_ai}-{key_script}"] = entry
+                added.append((f"{key_ai}-{key_script}", entry))
+            self._write_index(index)
+        return added
+
+    def entries(self) -> dict:
+        with self._locked() as index:
+            return index["templates"]
+
+    def stats(self) -> dict:
+        return {"cache_dir": self.cache_dir, "offline": self.offline, "refresh": self.refresh,
+                "hits": self.hits, "misses": self.misses, "stale": self.stale}
+
+
+def _check_archive(source):
+    """Raise TemplateError unless source (a path or file object) is an intact zip."""
+    try:
+        with zipfile.ZipFile(source) as archive:
+            bad = archive.testzip()
+    except zipfile.BadZipFile as e:
+        raise TemplateError(f"not a template archive: {e}")
+    if bad is not None:
+        raise TemplateError(f"not a template archive: corrupt member {bad}")
+
+
+def _single_root(path: str) -> str:
+    entries = os.listdir(path)
+    if len(entries) == 1 and os.path.isdir(os.path.join(path, entries[0])):
+        return os.path.join(path, entries[0])
+    return path
+
+
+def pack_tree(root: str) -> bytes:
+    """Zip a template directory reproducibly (sorted names, fixed timestamps), so equal trees hash equal."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path):
+                    continue
+                info = zipfile.ZipInfo(os.path.relpath(path, root), date_time=(1980, 1, 1, 0, 0, 0))
+                info.external_attr = (os.stat(path).st_mode & 0o777) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, "rb") as f:
+                    archive.writestr(info, f.read())
+    return buffer.getvalue()
+
+
+def extract_template(archive_path: str, target: str) -> int:
+    """Unpack a template into target like specify init: a single top-level directory is flattened."""
+    target = os.path.realpath(target)
+    with zipfile.ZipFile(archive_path) as archive:
+        members = [m for m in archive.infolist() if m.filename.strip("/")]
+        roots = {m.filename.split("/", 1)[0] for m in members}
+        strip = ""
+        if len(roots) == 1 and roots != {".."} and all("/" in m.filename for m in members):
+            strip = roots.pop() + "/"
+        count = 0
+        for member in members:
+            name = member.filename[len(strip):]
+            if not name:
+                continue
+            dest = os.path.realpath(os.path.join(target, name))
+            if dest != target and not dest.startswith(target + os.sep):
+                raise TemplateError(f"unsafe path in template archive: {member.filename}")
+            if member.is_dir():
+                os.makedirs(dest, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with archive.open(member) as src, open(dest, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            count += 1
+    return count
+
+
+def ensure_executable_scripts(project: str):
+    """chmod +x the shell scripts under .specify/scripts, as specify init does."""
+    for dirpath, _, filenames in os.walk(os.path.join(project, ".specify", "scripts")):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if not name.endswith(".sh") or os.path.islink(path):
+                continue
+            with open(path, "rb") as f:
+                if f.read(2) != b"#!":
+                    continue
+            mode = os.stat(path).st_mode
+            os.chmod(path, mode | ((mode & 0o444) >> 2))
+
+
+def init_git(project: str) -> str:
+    """Initial commit like specify init; a note on what happened (never raises)."""
+    if shutil.which("git") is None:
+        return "git not found, repository not initialized"
+    inside = subprocess.run(["git", "rev-parse", "--is-inside-work-tree"], cwd=project, capture_output=True)
+    if inside.returncode == 0:
+        return "existing git repository detected, skipping git init"
+    for argv in (["git", "init", "-q"], ["git", "add", "."],
+                 ["git", "commit", "-q", "-m", "Initial commit from Specify template"]):
+        step = subprocess.run(argv, cwd=project, capture_output=True, text=True)
+        if step.returncode != 0:
+            return f"`{' '.join(argv[:2])}` failed: {step.stderr.strip()}"
+    return "git repository initialized"
+
+
+def init_project(cache: TemplateCache, options: dict, cwd: str = None) -> dict:
+    """`specify init` from the cache; a result dict like a specify run plus `template`."""
+    started = time.perf_counter()
+    cwd = cwd or os.getcwd()
+    project = cwd if options["here"] else os.path.join(cwd, options["project"])
+    try:
+        if not options["here"] and os.path.exists(project):
+            raise TemplateError(f"Directory '{options['project']}' already exists")
+        if options["here"] and os.listdir(project) and not options["force"]:
+            raise TemplateError(f"Current directory is not empty ({project}); pass --force to merge")
+        archive, info = cache.get(options["ai"], options["script"])
+        created = not os.path.exists(project)
+        try:
+            files = extract_template(archive, project)
+        except BaseException:
+            if created:
+                shutil.rmtree(project, ignore_errors=True)
+            raise
+        ensure_executable_scripts(project)
+        lines = [f"Initialized Specify project in {project}",
+                 f"Template {info['asset']} ({info['tag']}): {files} files, cache {info['cache']}"]
+        if info.get("error"):
+            lines.append(f"Upstream unavailable, used the cached template: {info['error']}")
+        if options["git"]:
+            lines.append(init_git(project))
+        result = {"success": True, "stdout": "\n".join(lines) + "\n", "stderr": "", "returncode": 0}
+    except (TemplateError, OSError, zipfile.BadZipFile) as e:
+        result = {"success": False, "stdout": "", "stderr": str(e), "returncode": 1}
+        info = None
+    result["template"] = info
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spec-Kit template cache for the MCP front ends")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    sub = parser.add_subparsers(dest="action", required=True)
+    seed = sub.add_parser("seed", help="add templates from a release zip, a directory/tarball of them, or a tree")
+    seed.add_argument("source")
+    seed.add_argument("--ai", help="template variant of an unpacked tree, e.g. claude")
+    seed.add_argument("--script", choices=SCRIPT_TYPES, help="script type of an unpacked tree")
+    fetch = sub.add_parser("fetch", help="fetch (or revalidate) a template from upstream now")
+    fetch.add_argument("--ai", default=DEFAULT_AI)
+    fetch.add_argument("--script", choices=SCRIPT_TYPES, default=DEFAULT_SCRIPT)
+    sub.add_parser("list", help="show cached templates")
+    args = parser.parse_args()
+
+    cache = TemplateCache(args.cache_dir)
+    try:
+        if args.action == "seed":
+            added = cache.seed(args.source, args.ai, args.script)
+            for key, entry in added:
+                print(f"{key}: {entry['asset']} ({entry['tag']}) sha256={entry['sha256']}")
+        elif args.action == "fetch":
+            path, info = cache.get(args.ai, args.script)
+            print(json.dumps(dict(info, path=path), indent=2))
+        else:
+            for key, entry in sorted(cache.entries().items()):
+                checked = datetime.fromtimestamp(entry["checked_at"]).isoformat(timespec="seconds")
+                print(f"{key}: {entry['asset']} ({entry['tag']}) {entry['size']} bytes, checked {checked}, "
+                      f"sha256={entry['sha256']}")
+    except TemplateError as e:
+        raise SystemExit(f"error: {e}")
+
+
+if __name__ == "__main__":
+    main()
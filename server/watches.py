@@ -0,0 +1,215 @@
+"""
+Shared periodic command watches for /watch
+Every distinct (command, interval) is run by one task, however many clients
+watch it. Subscribers get a full snapshot first and then only line-level
+deltas against the previous run; a run that changed nothing sends nothing.
+A watch stops as soon as its last subscriber leaves.
+
+Output too large for the response spills to disk under a new handle on every
+run; only the spill of the last run shown to subscribers is kept, and a run
+whose output differs from it in nothing but that handle counts as unchanged.
+"""
+
+import asyncio
+import difflib
+import time
+from datetime import datetime
+
+STREAMS = ("stdout", "stderr")
+
+
+class WatchError(Exception):
+    """A run failed; `final` ends the watch (e.g. the command left the allowlist)."""
+
+    def __init__(self, status_code: int, error: str, final: bool = False):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+        self.final = final
+
+
+def line_delta(old: list, new: list) -> list:
+    """Edits turning `old` lines into `new`; apply in order as lines[start:start + delete] = lines."""
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            ops.append({"start": j1, "delete": i2 - i1, "lines": new[j1:j2]})
+    return ops
+
+
+def apply_delta(lines: list, ops: list) -> list:
+    lines = list(lines)
+    for op in ops:
+        lines[op["start"]:op["start"] + op["delete"]] = op["lines"]
+    return lines
+
+
+class Subscriber:
+    """One client's queue of (event, data) pairs; None ends the stream."""
+
+    def __init__(self, buffer: int):
+        self.queue = asyncio.Queue(buffer)
+
+
+class Watch:
+    """One command run every `interval` seconds on behalf of its subscribers."""
+
+    def __init__(self, cmd: str, interval: float, run, buffer: int, release=None):
+        self.cmd = cmd
+        self.interval = interval
+        self.run = run
+        self.buffer = buffer
+        # release(result) frees the spilled output of a run that is no longer shown
+        self.release = release or (lambda result: None)
+        self.subscribers = set()
+        self.seq = 0
+        self.lines = None  # {stream: [lines]} of the last successful run
+        self.plain = None  # the same output as text, without its spill handle
+        self.output = None  # that run's result, which owns the spill being shown
+        self.result = None
+        self.last_error = None
+        self.runs = 0
+        self.task = None
+        self.closed = False
+
+    def snapshot(self) -> dict:
+        return {
+            "seq": self.seq,
+            "cmd": self.cmd,
+            "interval": self.interval,
+            **{name: "".join(self.lines[name]) for name in STREAMS},
+            "returncode": self.result["returncode"],
+            "exec_mode": self.result.get("exec_mode"),
+            "at": self.result["at"],
+        }
+
+    def subscribe(self) -> Subscriber:
+        sub = Subscriber(self.buffer)
+        if self.lines is not None:
+            sub.queue.put_nowait(("snapshot", self.snapshot()))
+        elif self.last_error is not None:
+            sub.queue.put_nowait(("error", self.last_error))
+        self.subscribers.add(sub)
+        return sub
+
+    def publish(self, event: str, data):
+        for sub in self.subscribers:
+            try:
+                sub.queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                # Slow client: drop what it has not read and resynchronize with a snapshot
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait(("snapshot", self.snapshot()) if self.lines is not None else (event, data))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.output is not None and self.output.get("output_handle"):
+            self.release(self.output)
+        for sub in self.subscribers:
+            while sub.queue.full():
+                sub.queue.get_nowait()
+            sub.queue.put_nowait(None)
+
+    def fail(self, error: WatchError):
+        self.runs += 1
+        self.last_error = {"seq": self.seq, "status": error.status_code, "error": error.error,
+                           "final": error.final, "at": datetime.now().isoformat()}
+        self.publish("error", self.last_error)
+
+    async def loop(self):
+        """Run until cancelled or a final error; subscribers' streams end with it either way."""
+        next_run = time.monotonic()
+        try:
+            while True:
+                try:
+                    self.update(await self.run())
+                except WatchError as e:
+                    self.fail(e)
+                    if e.final:
+                        return
+                except Exception as e:
+                    # A bug must not leave subscribers waiting on a watch that no longer runs
+                    self.fail(WatchError(500, f"watch failed: {e!r}", final=True))
+                    return
+                next_run += self.interval
+                # Never queue up missed ticks behind a slow command
+                next_run = max(next_run, time.monotonic())
+                await asyncio.sleep(next_run - time.monotonic())
+        finally:
+            self.close()
+
+    def update(self, result: dict):
+        self.runs += 1
+        self.last_error = None
+        handle = result.get("output_handle")
+        plain = {name: result[name].replace(handle, "") if handle else result[name] for name in STREAMS}
+        previous, previous_result = self.lines, self.result
+        kept = self.output.get("output_handle") if self.output is not None else None
+        if previous is not None and plain == self.plain and result["returncode"] == previous_result["returncode"]:
+            # Nothing changed but (maybe) the spill handle: keep showing the old spill
+            if handle and handle != kept:
+                self.release(result)
+            return
+        if kept and kept != handle:
+            self.release(self.output)
+        lines = {name: result[name].splitlines(keepends=True) for name in STREAMS}
+        self.lines, self.plain, self.output = lines, plain, result
+        self.result = {"returncode": result["returncode"], "exec_mode": result.get("exec_mode"),
+                       "at": datetime.now().isoformat()}
+        if previous is None:
+            self.seq += 1
+            self.publish("snapshot", self.snapshot())
+            return
+        delta = {name: line_delta(previous[name], lines[name]) for name in STREAMS}
+        self.seq += 1
+        self.publish("delta", {"seq": self.seq, "base": self.seq - 1, **delta,
+                               "returncode": result["returncode"], "at": self.result["at"]})
+
+
+class WatchHub:
+    """The active watches, keyed by command and interval."""
+
+    def __init__(self, max_watches: int, buffer: int = 16, release=None):
+        self.max_watches = max_watches
+        self.buffer = buffer
+        self.release = release
+        self._watches = {}
+
+    def subscribe(self, cmd: str, interval: float, run) -> tuple:
+        """(watch, subscriber), starting the watch if nobody is watching it yet."""
+        # Exact command text: whitespace may be significant inside quotes
+        key = (cmd, interval)
+        watch = self._watches.get(key)
+        if watch is None or watch.task.done():
+            if watch is None and len(self._watches) >= self.max_watches:
+                raise WatchError(503, f"too many active watches (max {self.max_watches})")
+            watch = self._watches[key] = Watch(cmd, interval, run, self.buffer, self.release)
+            watch.task = asyncio.create_task(watch.loop())
+        return watch, watch.subscribe()
+
+    def unsubscribe(self, watch: Watch, sub: Subscriber):
+        watch.subscribers.discard(sub)
+        if not watch.subscribers:
+            watch.task.cancel()
+            if self._watches.get((watch.cmd, watch.interval)) is watch:
+                del self._watches[(watch.cmd, watch.interval)]
+
+    async def close(self):
+        watches = list(self._watches.values())
+        self._watches.clear()
+        for watch in watches:
+            watch.task.cancel()
+            watch.close()
+        await asyncio.gather(*(w.task for w in watches), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "watches": len(self._watches),
+            "subscribers": sum(len(w.subscribers) for w in self._watches.values()),
+            "watched": [{"cmd": w.cmd, "interval": w.interval, "subscribers": len(w.subscribers),
+                         "runs": w.runs, "seq": w.seq} for w in self._watches.values()],
+        }
@@ -4,60 +4,445 @@ Web UI for GitHub Spec-Kit
 Provides a browser interface for prompt processing with spec-kit
 """
 
+import atexit
+import codecs
 import os
+import selectors
+import signal
 import subprocess
+import sys
 import json
-from pathlib import Path
-from flask import Flask, render_template, request, jsonify
+import threading
+import time
+import types
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from flask import Flask, Response, render_template, request, jsonify
+from werkzeug.serving import make_server
+
+# Shared helpers (spawner.py, metrics.py, specify_env.py, history.py, accounting.py, listeners.py,
+# template_cache.py, audit.py) live next to server.py, one directory up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+try:
+    import accounting
+except ImportError:
+    accounting = None
+try:
+    import spawner
+except ImportError:
+    spawner = None
+try:
+    import metrics
+except ImportError:
+    metrics = None
+try:
+    import specify_env
+except ImportError:
+    specify_env = None
+try:
+    import history
+except ImportError:
+    history = None
+try:
+    import listeners
+except ImportError:
+    listeners = None
+try:
+    import template_cache
+except ImportError:
+    template_cache = None
+try:
+    import audit
+except ImportError:
+    audit = None
 
 TEMPLATES_DIR = Path(os.environ.get("MCP_TEMPLATES_DIR", "/opt/mcp/templates"))
+WEB_HOST = os.environ.get("MCP_WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.environ.get("MCP_WEB_PORT", 5000))
+# Unix domain socket for co-located clients, in addition to TCP or (MCP_WEB_TCP=0) instead of it
+WEB_TCP = os.environ.get("MCP_WEB_TCP", "1") == "1"
+WEB_UDS = os.environ.get("MCP_WEB_UDS", "")
+WEB_UDS_MODE = int(os.environ.get("MCP_WEB_UDS_MODE", "660"), 8)
+# Launch specify through the spawner helper instead of forking the Flask process
+USE_SPAWNER = spawner is not None and os.environ.get("MCP_SPAWNER", "0") == "1"
+SPAWNER_SOCKET = os.environ.get("MCP_SPAWNER_SOCKET", spawner.DEFAULT_SOCKET if spawner else "")
+# Command history database (SQLite, WAL) and its bounds
+HISTORY_DB = Path(os.environ.get("MCP_HISTORY_DB", "/opt/mcp/data/history.db"))
+HISTORY_RING_SIZE = int(os.environ.get("MCP_HISTORY_RING", 100))
+HISTORY_MAX_ENTRIES = int(os.environ.get("MCP_HISTORY_MAX_ENTRIES", 10000))
+HISTORY_MAX_BYTES = int(os.environ.get("MCP_HISTORY_MAX_BYTES", 64 * 1024 * 1024))
+HISTORY_PAGE_MAX = 200
+# specify runs happen on this many worker threads; beyond MCP_WEB_MAX_PENDING queued/running jobs, 503
+WEB_WORKERS = int(os.environ.get("MCP_WEB_WORKERS", 4))
+WEB_MAX_PENDING = int(os.environ.get("MCP_WEB_MAX_PENDING", 32))
+# Finished jobs (and their output for stream replay) are kept this many seconds
+WEB_JOB_TTL = int(os.environ.get("MCP_WEB_JOB_TTL", 600))
+COMMAND_TIMEOUT = 60
+# {"wait": true} requests give up waiting after this many seconds (queue wait included)
+WEB_WAIT_TIMEOUT = int(os.environ.get("MCP_WEB_WAIT_TIMEOUT", COMMAND_TIMEOUT + 30))
+SSE_KEEPALIVE = 15
 app = Flask(__name__, template_folder=str(TEMPLATES_DIR))
 app.config['JSON_SORT_KEYS'] = False
 
-# Session storage for prompts (in-memory, could be extended to use database)
-prompts_history = []
+# specify path and uv environment, resolved once and re-resolved when they change
+toolchain = specify_env.Toolchain() if specify_env else None
+# init unpacks templates from the local cache shared with spec_kit_server.py
+templates = template_cache.TemplateCache() if template_cache else None
+
+# Persistent command history shared by all worker processes
+history_store = None
+if history is not None:
+    history_store = history.HistoryStore(HISTORY_DB, HISTORY_RING_SIZE, HISTORY_MAX_ENTRIES, HISTORY_MAX_BYTES)
+
+# Append-only JSON lines record of every /api/process request (audit.AUDIT_DIR/web.jsonl)
+audit_log = audit.open_log("web") if audit else None
+
+# Per-subcommand CPU/RSS/IO totals served on /api/stats
+usage_stats = accounting.UsageStats() if accounting else None
+
+# Background specify runs, keyed by job id
+job_pool = ThreadPoolExecutor(max_workers=WEB_WORKERS, thread_name_prefix="specify")
+web_jobs = OrderedDict()
+jobs_lock = threading.Lock()
+
+# Prometheus-style metrics served on /metrics (only when metrics.py is importable)
+in_flight = 0
+in_flight_lock = threading.Lock()
+if metrics is not None:
+    registry = metrics.Registry()
+    SPECIFY_REQUESTS = registry.counter(
+        "speckit_specify_requests_total", "specify runs by subcommand and outcome", ["command", "outcome"])
+    SPECIFY_RUN = registry.histogram("speckit_specify_run_seconds", "specify run time", ["command"])
+    SPECIFY_OUTPUT = registry.histogram(
+        "speckit_specify_output_bytes", "stdout+stderr size per run", ["command"], metrics.SIZE_BUCKETS)
+    registry.gauge_func("speckit_specify_in_flight", "specify commands currently running", lambda: in_flight)
+    registry.gauge_func("speckit_jobs_pending", "Web jobs queued or running",
+                        lambda: sum(1 for j in list(web_jobs.values()) if not j.done))
+    registry.counter_func("speckit_specify_memo_hits_total", "version/check answered from memory",
+                          lambda: toolchain.memo_hits if toolchain else 0)
+    registry.counter_func("speckit_template_cache_hits_total", "init templates served from the cache",
+                          lambda: templates.hits + templates.stale if templates else 0)
+    registry.counter_func("speckit_template_cache_misses_total", "init templates downloaded from upstream",
+                          lambda: templates.misses if templates else 0)
+    registry.counter_func("speckit_audit_written_total", "Audit records written",
+                          lambda: audit_log.written if audit_log else 0)
+    registry.counter_func("speckit_audit_dropped_total", "Audit records dropped because the buffer was full",
+                          lambda: audit_log.dropped if audit_log else 0)
+    registry.gauge_func("speckit_history_entries", "Entries in the history database",
+                        lambda: history_store.stats()["entries"] if history_store else 0)
 
-def run_specify_command(command: str, args: list = None) -> dict:
-    """Execute a specify CLI command"""
+def audit_specify(decision: str, **fields):
+    """Queue an audit record of a specify request; never blocks the request thread"""
+    if audit_log is not None:
+        audit_log.record("specify", decision, **fields)
+
+def observe_specify(command: str, result: dict, run_s: float):
+    """Record one specify run in the metrics"""
+    if metrics is None:
+        return
+    if result["returncode"] == -1 and "timed out" in result["stderr"]:
+        outcome = "timeout"
+    else:
+        outcome = "ok" if result["success"] else "error"
+    SPECIFY_REQUESTS.inc(command, outcome)
+    SPECIFY_RUN.observe(run_s, command)
+    SPECIFY_OUTPUT.observe(len(result["stdout"]) + len(result["stderr"]), command)
+
+def run_specify_command(command: str, args: list = None, on_output=None) -> dict:
+    """Execute a specify CLI command
+
+    `on_output(stream, text)` is called with stdout/stderr chunks as they are
+    produced (all at once for memoized results and spawner runs).
+    """
     if args is None:
         args = []
     
     try:
-        # Build command - ensure uv environment is sourced
-        cmd = f"source ~/.local/bin/env && specify {command}"
-        if args:
-            cmd += " " + " ".join(args)
-        
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            executable="/bin/bash",
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        
+        # init unpacks a cached template; options only the CLI knows still run specify
+        if command == "init" and templates is not None:
+            options = template_cache.parse_init_args(args)
+            if options is not None:
+                result = template_cache.init_project(templates, options)
+                emit_result(result, on_output)
+                return result
+
+        resolved = None
+        if toolchain is not None:
+            # version/check answer from memory until the binary changes
+            memoized = toolchain.memoized(command, args)
+            if memoized is not None:
+                emit_result(memoized, on_output)
+                return dict(memoized, cached=True)
+            resolved = toolchain.current()
+            if resolved.path is None:
+                return {
+                    "success": False,
+                    "stdout": "",
+                    "stderr": "specify not found in ~/.local/bin or PATH (after sourcing ~/.local/bin/env)",
+                    "returncode": 127
+                }
+            # Exec the resolved binary with the captured environment - no shell per call
+            popen_args = {"args": [resolved.path, command, *args], "env": resolved.env}
+        else:
+            # Build command - ensure uv environment is sourced
+            cmd = f"source ~/.local/bin/env && specify {command}"
+            if args:
+                cmd += " " + " ".join(args)
+            popen_args = {"args": cmd, "shell": True, "executable": "/bin/bash"}
+
+        if USE_SPAWNER:
+            if resolved is not None:
+                result = run_via_spawner(argv=popen_args["args"], env=resolved.env)
+            else:
+                result = run_via_spawner(popen_args["args"])
+            emit_result(result, on_output)
+        else:
+            try:
+                result = stream_process(popen_args, on_output)
+            except FileNotFoundError:
+                # specify was removed or moved since it was resolved
+                if toolchain is not None:
+                    toolchain.invalidate()
+                raise
+        if resolved is not None:
+            toolchain.remember(command, args, resolved, result)
+        return result
+    except Exception as e:
         return {
-            "success": result.returncode == 0,
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "returncode": result.returncode
+            "success": False,
+            "stdout": "",
+            "stderr": str(e),
+            "returncode": -1
         }
-    except subprocess.TimeoutExpired:
+
+def emit_result(result: dict, on_output):
+    if on_output is not None:
+        for stream in ("stdout", "stderr"):
+            if result[stream]:
+                on_output(stream, result[stream])
+
+def stream_process(popen_args: dict, on_output=None, timeout: float = COMMAND_TIMEOUT) -> dict:
+    """Run a process, passing output chunks to on_output as they arrive"""
+    started = time.perf_counter()
+    proc = subprocess.Popen(stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True, **popen_args)
+    streams = {proc.stdout: "stdout", proc.stderr: "stderr"}
+    decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in streams.values()}
+    output = {"stdout": [], "stderr": []}
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    with selectors.DefaultSelector() as selector:
+        for pipe in streams:
+            selector.register(pipe, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                name = streams[key.fileobj]
+                text = decoders[name].decode(data)
+                if text:
+                    output[name].append(text)
+                    if on_output is not None:
+                        on_output(name, text)
+    if timed_out:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    # wait4() keeps the rusage of specify and its children
+    rusage = accounting.wait(proc) if accounting else proc.wait()
+    wall_s = time.perf_counter() - started
+    proc.stdout.close()
+    proc.stderr.close()
+    if timed_out:
         return {
             "success": False,
             "stdout": "",
-            "stderr": "Command timed out after 60 seconds",
+            "stderr": f"Command timed out after {int(timeout)} seconds",
             "returncode": -1
         }
+    return {
+        "success": proc.returncode == 0,
+        "stdout": "".join(output["stdout"]),
+        "stderr": "".join(output["stderr"]),
+        "returncode": proc.returncode,
+        "usage": accounting.usage(rusage, wall_s) if accounting else None
+    }
+
+class WebJob:
+    """One specify run on the worker pool; output chunks are kept for SSE replay"""
+
+    def __init__(self, command: str, args: list, client: str):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.args = args
+        self.client = client
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.chunks = []  # (stream, text) in arrival order; the index is the SSE event id
+        self.result = None
+        self.history_id = None
+        self.duration_ms = None
+        self.cond = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def emit(self, stream: str, text: str):
+        with self.cond:
+            self.chunks.append((stream, text))
+            self.cond.notify_all()
+
+    def finish(self, result: dict, duration_ms: float, history_id):
+        with self.cond:
+            self.status = "succeeded" if result["success"] else "failed"
+            self.result = result
+            self.duration_ms = duration_ms
+            self.history_id = history_id
+            self.finished_at = time.time()
+            self.cond.notify_all()
+
+    def wait(self, since: int, timeout: float) -> tuple:
+        """Chunks from index `since` on (waiting up to timeout for new ones) and whether the job is done"""
+        with self.cond:
+            if len(self.chunks) <= since and not self.done:
+                self.cond.wait(timeout)
+            return self.chunks[since:], self.done
+
+    def to_dict(self) -> dict:
+        with self.cond:
+            job = {
+                "job_id": self.id,
+                "command": self.command,
+                "args": self.args,
+                "status": self.status,
+                "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+                "finished_at": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+                "duration_ms": self.duration_ms,
+                "history_id": self.history_id,
+            }
+            if self.done:
+                job.update(self.response())
+            else:
+                job["stdout"] = "".join(text for stream, text in self.chunks if stream == "stdout")
+                job["stderr"] = "".join(text for stream, text in self.chunks if stream == "stderr")
+            return job
+
+    def response(self) -> dict:
+        """The /api/process result body of a finished job"""
+        response = {
+            "success": self.result["success"],
+            "stdout": self.result["stdout"],
+            "stderr": self.result["stderr"],
+            "returncode": self.result["returncode"],
+            "cached": self.result.get("cached", False),
+            "usage": self.result.get("usage")
+        }
+        if "template" in self.result:
+            # Cached init: cache hit/miss/stale, fetch time and the template's release and sha256
+            response["template"] = self.result["template"]
+        return response
+
+def submit_job(command: str, args: list, client: str = "local"):
+    """Queue a specify run on the worker pool; None when too many are already pending"""
+    now = time.time()
+    with jobs_lock:
+        # Forget finished jobs once their output is no longer needed for replay
+        for job_id in [j.id for j in web_jobs.values() if j.done and now - j.finished_at > WEB_JOB_TTL]:
+            del web_jobs[job_id]
+        if sum(1 for j in web_jobs.values() if not j.done) >= WEB_MAX_PENDING:
+            return None
+        job = WebJob(command, args, client)
+        web_jobs[job.id] = job
+    job_pool.submit(run_job, job)
+    return job
+
+def run_job(job: WebJob):
+    global in_flight
+    with in_flight_lock:
+        in_flight += 1
+    with job.cond:
+        job.status = "running"
+    queue_wait_s = time.time() - job.created_at
+    started = time.perf_counter()
+    result, history_id = None, None
+    try:
+        try:
+            result = run_specify_command(job.command, job.args, job.emit)
+        finally:
+            with in_flight_lock:
+                in_flight -= 1
+        run_s = time.perf_counter() - started
+        observe_specify(job.command, result, run_s)
+        if result.get("usage") and not result.get("cached"):
+            result["usage"] = dict(result["usage"], queue_wait_ms=round(queue_wait_s * 1000, 3))
+            usage_stats.record(job.command, result["usage"], result["success"])
+        if history_store is not None:
+            try:
+                history_id = history_store.record(job.command, job.args, result, round(run_s * 1000, 3))
+            except Exception as e:
+                app.logger.warning("Failed to record history for job %s: %s", job.id, e)
+        fields = {"returncode": result["returncode"], "cached": result.get("cached", False)}
+        if "template" in result:
+            fields["template"] = result["template"]["cache"]
+        audit_specify("allowed", client=job.client, command=job.command, args=job.args, job_id=job.id, status=200,
+                      duration_ms=round(run_s * 1000, 3), queue_wait_ms=round(queue_wait_s * 1000, 3), **fields)
     except Exception as e:
+        app.logger.exception("Job %s failed", job.id)
+        if result is None:
+            result = {"success": False, "stdout": "", "stderr": f"Error running command: {e}", "returncode": -1}
+    finally:
+        # Always finish the job, or status polls and {"wait": true} callers never see it end
+        if result is None:
+            result = {"success": False, "stdout": "", "stderr": "Command was interrupted", "returncode": -1}
+        job.finish(result, round((time.perf_counter() - started) * 1000, 3), history_id)
+
+def sse_event(event: str, data: dict, event_id: int = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def start_spawner():
+    """Start (or reuse) the spawner helper and stop it again when the app exits"""
+    proc = spawner.start_spawner(SPAWNER_SOCKET)
+    if proc is not None:
+        atexit.register(spawner.stop_spawner, proc)
+
+def run_via_spawner(cmd: str = None, argv: list = None, env: dict = None) -> dict:
+    """Run a shell command (or argv) through the spawner helper"""
+    request = dict(argv=argv, env=env) if argv else dict(shell=cmd, executable="/bin/bash")
+    try:
+        result = spawner.run(timeout=COMMAND_TIMEOUT, socket_path=SPAWNER_SOCKET, **request)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Helper went away (e.g. restarted with the API server); start a new one
+        start_spawner()
+        result = spawner.run(timeout=COMMAND_TIMEOUT, socket_path=SPAWNER_SOCKET, **request)
+    if result["timeout"]:
         return {
             "success": False,
             "stdout": "",
-            "stderr": str(e),
+            "stderr": f"Command timed out after {COMMAND_TIMEOUT} seconds",
             "returncode": -1
         }
+    rusage = result.get("rusage")
+    return {
+        "success": result["returncode"] == 0,
+        "stdout": result["stdout"],
+        "stderr": result["stderr"],
+        "returncode": result["returncode"],
+        "usage": accounting.usage(types.SimpleNamespace(**rusage), result["wall_ms"] / 1000,
+                                  rss_floor_kb=rusage.get("rss_floor_kb"))
+                 if accounting and rusage else None
+    }
 
 @app.route('/')
 def index():
@@ -74,6 +459,25 @@ def api_health():
     """Alias for monitoring tools that expect /api/health"""
     return jsonify({"status": "ok", "service": "spec-kit-web"})
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of specify run metrics"""
+    if metrics is None:
+        return jsonify({"error": "metrics module not available"}), 404
+    return Response(registry.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Per-subcommand resource usage of specify runs since start, heaviest first"""
+    if usage_stats is None:
+        return jsonify({"error": "accounting module not available"}), 404
+    try:
+        limit = max(int(request.args.get('limit', 50)), 1)
+        commands = usage_stats.snapshot(request.args.get('sort', 'cpu_ms'), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({**usage_stats.totals(), "by_command": commands})
+
 @app.route('/api/commands', methods=['GET'])
 def get_commands():
     """Get available spec-kit commands"""
@@ -97,6 +501,29 @@ def get_commands():
         ]
     })
 
+def check_request(command: str, args) -> str:
+    """Why an /api/process request may not run, or None"""
+    if not command:
+        return "Command is required"
+    
+    # Validate command is a known spec-kit command
+    valid_commands = ['check', 'version', 'init', 'help']
+    if command not in valid_commands:
+        return f"Unknown command: {command}. Valid: {valid_commands}"
+    
+    # Validate args is a list
+    if not isinstance(args, list):
+        return "args must be an array"
+    
+    # Validate each arg is a string and doesn't contain shell metacharacters
+    for arg in args:
+        if not isinstance(arg, str):
+            return "Each arg must be a string"
+        # Basic check for dangerous shell characters
+        if any(c in arg for c in ['|', '&', ';', '$', '`', '\n']):
+            return f"Invalid characters in argument: {arg}"
+    return None
+
 @app.route('/api/process', methods=['POST'])
 def process_prompt():
     """Process a spec-kit command"""
@@ -107,71 +534,189 @@ def process_prompt():
         
         command = data.get('command', '').strip()
         args = data.get('args', [])
+        client = request.remote_addr or "local"
         
-        if not command:
-            return jsonify({"error": "Command is required"}), 400
-        
-        # Validate command is a known spec-kit command
-        valid_commands = ['check', 'version', 'init', 'help']
-        if command not in valid_commands and command != 'help':
-            return jsonify({"error": f"Unknown command: {command}. Valid: {valid_commands}"}), 400
-        
-        # Validate args is a list
-        if not isinstance(args, list):
-            return jsonify({"error": "args must be an array"}), 400
-        
-        # Validate each arg is a string and doesn't contain shell metacharacters
-        for arg in args:
-            if not isinstance(arg, str):
-                return jsonify({"error": "Each arg must be a string"}), 400
-            # Basic check for dangerous shell characters
-            if any(c in arg for c in ['|', '&', ';', '$', '`', '\n']):
-                return jsonify({"error": f"Invalid characters in argument: {arg}"}), 400
+        error = check_request(command, args)
+        if error is not None:
+            audit_specify("denied", client=client, command=command, args=args, status=400, error=error)
+            return jsonify({"error": error}), 400
         
-        # Run the command
-        result = run_specify_command(command, args)
+        # Run the command on the worker pool; the request thread returns immediately
+        job = submit_job(command, args, client)
+        if job is None:
+            audit_specify("allowed", client=client, command=command, args=args, status=503, error="busy")
+            return jsonify({"error": "Too many commands pending, try again shortly"}), 503, {"Retry-After": "2"}
         
-        # Store in history
-        history_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "command": command,
-            "args": args,
-            "result": result
-        }
-        prompts_history.append(history_entry)
+        if not data.get('wait', False):
+            return jsonify({
+                "job_id": job.id,
+                "status": job.status,
+                "stream": f"/api/jobs/{job.id}/stream",
+                "status_url": f"/api/jobs/{job.id}"
+            }), 202
         
-        return jsonify({
-            "success": result["success"],
-            "stdout": result["stdout"],
-            "stderr": result["stderr"],
-            "returncode": result["returncode"]
-        })
+        # Synchronous mode: {"wait": true} returns the result like before. The wait is
+        # bounded so a stuck job cannot hold a request thread; past it the caller gets
+        # the 202 body and can follow the job like an async one.
+        deadline = time.monotonic() + WEB_WAIT_TIMEOUT
+        with job.cond:
+            while not job.done:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                job.cond.wait(remaining)
+            done = job.done
+        if not done:
+            return jsonify({
+                "job_id": job.id,
+                "status": job.status,
+                "stream": f"/api/jobs/{job.id}/stream",
+                "status_url": f"/api/jobs/{job.id}",
+                "error": f"Command still {job.status} after {WEB_WAIT_TIMEOUT} seconds"
+            }), 202
+        return jsonify({"job_id": job.id, "history_id": job.history_id, **job.response()})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a background job, with the output produced so far"""
+    job = web_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """Server-Sent Events: stdout/stderr chunks as they are produced, then an exit event
+
+    Each chunk carries its index as the event id, so a reconnecting client
+    (Last-Event-ID) or `?since=` resumes without losing or repeating output.
+    """
+    job = web_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    try:
+        since = int(request.headers.get('Last-Event-ID', request.args.get('since', -1))) + 1
+    except ValueError:
+        return jsonify({"error": "since must be an integer"}), 400
+
+    def generate():
+        index = max(since, 0)
+        while True:
+            chunks, done = job.wait(index, SSE_KEEPALIVE)
+            for stream, text in chunks:
+                yield sse_event(stream, {"data": text}, index)
+                index += 1
+            if done and not chunks:
+                yield sse_event("exit", {
+                    "status": job.status,
+                    "success": job.result["success"],
+                    "returncode": job.result["returncode"],
+                    "cached": job.result.get("cached", False),
+                    "usage": job.result.get("usage"),
+                    "duration_ms": job.duration_ms,
+                    "history_id": job.history_id,
+                })
+                return
+            if not chunks:
+                yield ": keepalive\n\n"
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Get command history"""
+    """Get command history, newest first, with cursor pagination and filters"""
+    if history_store is None:
+        return jsonify({"error": "history module not available"}), 503
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), HISTORY_PAGE_MAX)
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+        success = request.args.get('success')
+        if success is not None:
+            if success.lower() not in ('true', 'false', '1', '0'):
+                raise ValueError(f"success must be true or false, got {success!r}")
+            success = success.lower() in ('true', '1')
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = history.parse_time(since) if since else None
+        until = history.parse_time(until) if until else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    entries, next_cursor = history_store.list(
+        limit, cursor, request.args.get('command') or None, success, since, until)
     return jsonify({
-        "history": prompts_history[-20:]  # Last 20 commands
+        "history": entries,
+        "next_cursor": next_cursor
     })
 
-@app.route('/api/history/<int:index>', methods=['GET'])
-def get_history_item(index):
-    """Get specific history item"""
-    if 0 <= index < len(prompts_history):
-        return jsonify(prompts_history[index])
+@app.route('/api/history/<int:entry_id>', methods=['GET'])
+def get_history_item(entry_id):
+    """Get a single history entry including its full output"""
+    entry = history_store.get(entry_id) if history_store is not None else None
+    if entry is not None:
+        return jsonify(entry)
     return jsonify({"error": "Not found"}), 404
 
 @app.route('/api/clear-history', methods=['POST'])
 def clear_history():
     """Clear command history"""
-    global prompts_history
-    prompts_history = []
+    if history_store is not None:
+        history_store.clear()
     return jsonify({"success": True, "message": "History cleared"})
 
+def serve():
+    """Serve the app on TCP and/or WEB_UDS, one threaded werkzeug server per listener.
+
+    werkzeug answers every request with Connection: close (it cannot tell an unread
+    request body from the next request), so HTTP keep-alive is only tuned on server.py.
+    """
+    if listeners is None:
+        app.run(host=WEB_HOST, port=WEB_PORT, debug=False)
+        return
+    bound = []
+    if WEB_TCP:
+        bound.append((WEB_HOST, WEB_PORT, listeners.tcp_socket(WEB_HOST, WEB_PORT)))
+    if WEB_UDS:
+        bound.append((f"unix://{WEB_UDS}", 0, listeners.unix_socket(WEB_UDS, WEB_UDS_MODE)))
+    if not bound:
+        raise SystemExit("nothing to listen on: set MCP_WEB_UDS or leave MCP_WEB_TCP=1")
+    servers = []
+    for host, port, sock in bound:
+        # werkzeug takes over a duplicate of the listening socket
+        servers.append(make_server(host, port, app, threaded=True, fd=sock.fileno()))
+        sock.close()
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads:
+        thread.start()
+    print(" * Listening on " + ", ".join(f"{host}:{port}" if port else host for host, port, _ in bound))
+    # Shut down cleanly on SIGTERM too, so the socket file and the spawner go away
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while all(thread.is_alive() for thread in threads):
+            threads[0].join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if WEB_UDS:
+            listeners.remove_unix_socket(WEB_UDS)
+
 if __name__ == '__main__':
     # Ensure templates directory exists
     TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    if toolchain is not None:
+        toolchain.current()
+    if USE_SPAWNER:
+        start_spawner()
+    if templates is not None and template_cache.SEED:
+        try:
+            templates.seed(template_cache.SEED, replace=False)
+        except (template_cache.TemplateError, OSError) as e:
+            app.logger.warning("Template seeding from %s failed: %s", template_cache.SEED, e)
+    serve()
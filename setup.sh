@@ -22,7 +22,7 @@ if ! id -u "$MCP_USER" >/dev/null 2>&1; then
 	useradd --system --create-home --home-dir /home/$MCP_USER --shell /usr/sbin/nologin $MCP_USER || \
 	useradd -m -s /bin/bash $MCP_USER || true
 fi
-mkdir -p "$SERVER_DIR" "$WEB_DIR"
+mkdir -p "$SERVER_DIR" "$WEB_DIR" "$MCP_BASE/data"
 chown -R $MCP_USER:$MCP_USER "$MCP_BASE" || true
 
 # System dependencies
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tests for the audit log (server/audit.py)
+Covers record format, batching, the bounded buffer and its drop counter,
+size rotation with compression, several processes sharing one file, and an
+unwritable log never failing the caller.
+"""
+
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+from audit import AuditLog
+
+
+def read_records(path: str) -> list:
+    """Records of the log and all of its rotated files"""
+    records = []
+    for name in glob.glob(path + "*"):
+        if name.endswith(".gz"):
+            with gzip.open(name, "rt") as f:
+                records += [json.loads(line) for line in f]
+        elif not name.endswith(".lock"):
+            with open(name) as f:
+                records += [json.loads(line) for line in f]
+    return records
+
+
+def with_tmp(test):
+    def run():
+        tmp = tempfile.mkdtemp(prefix="audit-test-")
+        try:
+            test(tmp)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    run.__name__ = test.__name__
+    return run
+
+
+@with_tmp
+def test_records(tmp):
+    path = os.path.join(tmp, "logs", "server.jsonl")
+    log = AuditLog(path, "server", flush_interval=0.05)
+    log.record("exec", "allowed", client="10.0.0.5", cmd="uptime", returncode=0, duration_ms=3.2)
+    log.record("exec", "denied", client="10.0.0.5", cmd="rm -rf /", status=403)
+    # Written and fsynced by the background thread without close()
+    deadline = time.monotonic() + 5
+    while log.written < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    first, second = read_records(path)
+    assert first["source"] == "server" and first["action"] == "exec" and first["decision"] == "allowed"
+    assert first["cmd"] == "uptime" and first["returncode"] == 0 and first["ts"].endswith("Z")
+    assert second["decision"] == "denied" and second["status"] == 403
+    log.close()
+    print("✅ records are appended as JSON lines by the background writer")
+
+
+@with_tmp
+def test_drops_when_full(tmp):
+    log = AuditLog(os.path.join(tmp, "web.jsonl"), "web", buffer=10)
+    started = time.perf_counter()
+    for i in range(5000):
+        log.record("specify", "allowed", i=i)
+    elapsed = time.perf_counter() - started
+    log.close()
+    stats = log.stats()
+    assert stats["dropped"] > 0 and stats["written"] + stats["dropped"] == 5000, stats
+    assert len(read_records(log.path)) == stats["written"]
+    assert elapsed < 2, f"record() blocked: {elapsed:.2f}s for 5000 records"
+    print(f"✅ a full buffer drops and counts records instead of blocking ({stats['dropped']} dropped)")
+
+
+@with_tmp
+def test_rotation(tmp):
+    path = os.path.join(tmp, "server.jsonl")
+    log = AuditLog(path, "server", buffer=100000, max_bytes=20000, backups=3)
+    for i in range(5000):
+        log.record("exec", "allowed", cmd="uptime", i=i)
+    log.close()
+    rotated = sorted(glob.glob(path + ".*.gz"))
+    assert rotated == [f"{path}.{n}.gz" for n in (1, 2, 3)], rotated
+    assert log.stats()["rotations"] > 3 and log.stats()["written"] == 5000
+    kept = sorted(r["i"] for r in read_records(path))
+    # The oldest files are gone; what is left is the most recent, contiguous run
+    assert kept == list(range(kept[0], 5000)) and kept[0] > 0
+    plain = AuditLog(os.path.join(tmp, "plain.jsonl"), "server", max_bytes=2000, backups=2, compress=False)
+    for i in range(200):
+        plain.record("exec", "allowed", i=i)
+    plain.close()
+    assert os.path.exists(plain.path + ".1") and not glob.glob(plain.path + "*.gz")
+    print("✅ full files are rotated, gzip-compressed and pruned to the backup count")
+
+
+def write_from_process(args):
+    path, source = args
+    log = AuditLog(path, source, buffer=100000, flush_interval=0.01, max_bytes=50000, backups=100)
+    for i in range(3000):
+        log.record("exec", "allowed", i=i)
+    log.close(30)
+    return log.stats()["written"]
+
+
+@with_tmp
+def test_shared_file(tmp):
+    path = os.path.join(tmp, "shared.jsonl")
+    with multiprocessing.Pool(3) as pool:
+        written = pool.map(write_from_process, [(path, f"p{n}") for n in range(3)])
+    records = read_records(path)
+    assert sum(written) == 9000 and len(records) == 9000
+    assert len({(r["source"], r["i"]) for r in records}) == 9000
+    print("✅ processes sharing one file lose no records across rotations")
+
+
+@with_tmp
+def test_disabled_and_unwritable(tmp):
+    disabled = AuditLog(None, "server")
+    disabled.record("exec", "allowed")
+    assert disabled.stats()["written"] == 0 and disabled._thread is None
+    blocker = os.path.join(tmp, "not-a-dir")
+    open(blocker, "w").close()
+    broken = AuditLog(os.path.join(blocker, "server.jsonl"), "server")
+    broken.record("exec", "allowed")
+    broken.close()
+    stats = broken.stats()
+    assert stats["failed"] == 1 and stats["written"] == 0 and stats["last_error"]
+    print("✅ a disabled or unwritable log never fails the request")
+
+
+if __name__ == "__main__":
+    print("Testing the audit log")
+    print()
+
+    success = True
+    for test in (test_records, test_drops_when_full, test_rotation, test_shared_file, test_disabled_and_unwritable):
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e!r}")
+            success = False
+
+    if success:
+        print("🎉 All tests passed!")
+    else:
+        print("💥 Some tests failed.")
+        sys.exit(1)
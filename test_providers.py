@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Parity tests for the native Tier 1 providers (server/providers.py)
+Runs each provider next to the real binary and compares the text output.
+Needs no running server; binaries that are not installed are skipped.
+Values that move between the two runs (clock, free memory) are retried a few times.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+import providers
+
+# The real binaries must print the C-locale formats the providers reproduce
+ENV = {**os.environ, "LC_ALL": "C"}
+ATTEMPTS = 5
+
+
+def check_parity(cmd):
+    binary = cmd.split()[0]
+    if shutil.which(binary) is None:
+        print(f"⏭️  {cmd}: {binary} not installed, skipped")
+        return
+    provider = providers.lookup(cmd)
+    for attempt in range(ATTEMPTS):
+        real = subprocess.run(cmd, shell=True, capture_output=True, text=True, env=ENV)
+        native, data = provider()
+        if native == real.stdout:
+            break
+        time.sleep(0.2)
+    assert real.returncode == 0, f"{cmd} exited {real.returncode}: {real.stderr}"
+    assert native == real.stdout, f"{cmd} differs:\n--- native\n{native}--- real\n{real.stdout}"
+    assert isinstance(data, dict)
+    print(f"✅ {cmd}: identical output" + (f" (after {attempt + 1} attempts)" if attempt else ""))
+
+
+def test_parity():
+    for cmd in providers.PROVIDERS:
+        check_parity(cmd)
+
+
+def test_structured():
+    _, up = providers.uptime()
+    assert len(up["load_average"]) == 3 and up["uptime_seconds"] > 0
+    _, mem = providers.free("m")
+    assert mem["mem"]["total"] >= mem["mem"]["used"] > 0
+    _, df = providers.df(inodes=False)
+    root = [fs for fs in df["filesystems"] if fs["mounted_on"] == "/"]
+    assert root and root[0]["size"] == root[0]["used"] + root[0]["available"] + (
+        os.statvfs("/").f_bfree - os.statvfs("/").f_bavail) * os.statvfs("/").f_frsize
+    _, uname = providers.uname()
+    assert uname["release"] == os.uname().release
+    print("✅ structured data is consistent")
+
+
+def test_human_sizes():
+    # gnulib human_readable() with df -h options: base 1024, rounded up
+    cases = {0: "0", 1023: "1023", 1024: "1.0K", 1025: "1.1K", 10 * 1024: "10K", 10 * 1024 + 1: "11K",
+             1024 ** 2 - 1: "1.0M", 1024 ** 3 * 252: "252G", int(1024 ** 3 * 5.91): "6.0G"}
+    for size, expected in cases.items():
+        assert providers._human(size) == expected, f"{size}: {providers._human(size)} != {expected}"
+    # procps free -h
+    cases = {0: "0B", 9 * 1024 + 100: "9.1Mi", 529408: "517Mi", 6157312: "5.9Gi"}
+    for kib, expected in cases.items():
+        assert providers._free_size(kib, "h") == expected, f"{kib}: {providers._free_size(kib, 'h')} != {expected}"
+    print("✅ size formatting matches df -h and free -h")
+
+
+def test_utmp():
+    login = int(time.time()) - 3600
+    records = [
+        providers.UTMP_RECORD.pack(2, 0, b"~", b"~~", b"reboot", b"6.1.0", 0, 0, 0, login, 0, 0, 0, 0, 0),
+        providers.UTMP_RECORD.pack(7, 1234, b"pts/0", b"ts/0", b"alice", b"10.0.0.5", 0, 0, 0, login, 0,
+                                   0, 0, 0, 0),
+        providers.UTMP_RECORD.pack(7, 1235, b"tty1", b"tty1", b"bob", b"", 0, 0, 0, login, 0, 0, 0, 0, 0),
+        providers.UTMP_RECORD.pack(8, 1236, b"pts/1", b"ts/1", b"", b"", 0, 0, 0, login, 0, 0, 0, 0, 0),
+    ]
+    with tempfile.NamedTemporaryFile(suffix=".utmp") as f:
+        f.write(b"".join(records))
+        f.flush()
+        sessions = providers.read_utmp(f.name)
+        saved, providers.UTMP = providers.UTMP, f.name
+        try:
+            text, data = providers.who()
+            up, _ = providers.uptime()
+            if shutil.which("who"):
+                real = subprocess.run(["who", f.name], capture_output=True, text=True, env=ENV).stdout
+                assert text == real, f"who differs:\n--- native\n{text}--- real\n{real}"
+        finally:
+            providers.UTMP = saved
+    assert struct.calcsize(providers.UTMP_RECORD.format) == 384
+    assert [s["user"] for s in sessions] == ["alice", "bob"]
+    assert data["users"][0]["host"] == "10.0.0.5" and data["users"][1]["host"] is None
+    assert text.splitlines()[0].startswith("alice    pts/0        ") and text.splitlines()[0].endswith("(10.0.0.5)")
+    assert " 2 users,  load average: " in up
+    print("✅ utmp sessions parsed like who(1)")
+
+
+def test_c_locale():
+    assert providers.c_locale({}) and providers.c_locale({"LANG": "C.UTF-8"})
+    assert providers.c_locale({"LANG": "de_DE.UTF-8", "LC_ALL": "POSIX"})
+    assert providers.c_locale({"LC_CTYPE": "en_US.UTF-8"})  # character set only
+    assert not providers.c_locale({"LANG": "en_US.UTF-8"})
+    assert not providers.c_locale({"LANG": "C", "LC_TIME": "de_DE.UTF-8"})
+    print("✅ providers are only used where the binaries would print the C locale")
+
+
+if __name__ == "__main__":
+    print("Testing native providers against the real binaries")
+    print()
+
+    success = True
+    for test in (test_parity, test_structured, test_human_sizes, test_utmp, test_c_locale):
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+            success = False
+
+    if success:
+        print("🎉 All tests passed!")
+    else:
+        print("💥 Some tests failed.")
+        sys.exit(1)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for the stdio session of the spec-kit MCP server (server/spec_kit_server.py)
+Feeds JSON-RPC lines to a StdioSession backed by a stub server whose tool
+calls take a while, the way a client pipelining requests and cancels would.
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+os.environ.setdefault("MCP_AUDIT_DIR", "")
+import spec_kit_server
+
+
+class StubServer:
+    """Answers every request after `delay` seconds and remembers which calls finished"""
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self.finished = []
+
+    async def process_rpc(self, message: dict):
+        await asyncio.sleep(self.delay)
+        self.finished.append(message.get("id"))
+        return {"content": []}
+
+
+def call(request_id) -> str:
+    return json.dumps({"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+                       "params": {"name": "specify_check", "arguments": {}}})
+
+
+def cancelled(request_id) -> str:
+    return json.dumps({"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": request_id}})
+
+
+def run_session(script) -> tuple:
+    """Run script(session) against a stub server; returns (ids answered, ids the server finished)"""
+    server = StubServer()
+    sent = []
+
+    async def main():
+        session = spec_kit_server.StdioSession(server)
+        session.send = lambda frame: sent.extend(frame if isinstance(frame, list) else [frame])
+        await script(session)
+        while session.tasks:
+            await asyncio.wait(set(session.tasks))
+
+    asyncio.run(main())
+    return [frame.get("id") for frame in sent], server.finished
+
+
+def test_pipelined_cancel():
+    async def script(session):
+        # Read in one burst: no task has run yet when the cancel is handled
+        session.handle_line(call(5))
+        session.handle_line(cancelled(5))
+        session.handle_line(call(6))
+
+    answered, finished = run_session(script)
+    assert answered == [6] and finished == [6], (answered, finished)
+    print("✅ a cancel read right behind its request stops the call")
+
+
+def test_batch_cancel():
+    async def script(session):
+        session.handle_line(f"[{call(7)}, {cancelled(7)}, {call(8)}]")
+
+    answered, finished = run_session(script)
+    assert answered == [8] and finished == [8], (answered, finished)
+    print("✅ a cancel inside the same batch stops the call")
+
+
+def test_running_cancel():
+    async def script(session):
+        session.handle_line(call(9))
+        await asyncio.sleep(0.1)
+        session.handle_line(cancelled(9))
+        session.handle_line(call(9))  # the id is free again once the call is cancelled
+
+    answered, finished = run_session(script)
+    assert answered == [9] and finished == [9], (answered, finished)
+    print("✅ a cancel for a running call stops it and frees its id")
+
+
+if __name__ == "__main__":
+    print("Testing the spec-kit MCP stdio session")
+    print()
+
+    success = True
+    for test in (test_pipelined_cancel, test_batch_cancel, test_running_cancel):
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e!r}")
+            success = False
+
+    if success:
+        print("🎉 All tests passed!")
+    else:
+        print("💥 Some tests failed.")
+        sys.exit(1)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Tests for the Spec-Kit template cache (server/template_cache.py)
+A local HTTP server stands in for the GitHub releases API, so no network is
+needed. Covers hits and misses, ETag revalidation, offline mode, stale
+fallback, seeding, unpacking and the specify_init tool result.
+"""
+
+import asyncio
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+import template_cache
+from template_cache import TemplateCache, TemplateError
+
+ASSET = "spec-kit-template-claude-sh-{tag}.zip"
+
+
+def make_template(tag: str, root: str = "") -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr(f"{root}.specify/memory/constitution.md", f"# Constitution {tag}\n")
+        archive.writestr(f"{root}.specify/scripts/bash/common.sh", "#!/usr/bin/env bash\necho common\n")
+        archive.writestr(f"{root}.claude/commands/specify.md", "specify\n")
+    return buffer.getvalue()
+
+
+class Upstream:
+    """Stand-in for api.github.com/repos/github/spec-kit with one release."""
+
+    def __init__(self):
+        self.tag = "v0.0.1"
+        self.archive = make_template(self.tag)
+        self.down = False
+        self.download_delay = 0
+        self.requests = {"release": 0, "not_modified": 0, "download": 0}
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if upstream.down:
+                    self.send_error(503)
+                    return
+                if self.path == "/releases/latest":
+                    upstream.requests["release"] += 1
+                    etag = f'"{upstream.tag}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        upstream.requests["not_modified"] += 1
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    name = ASSET.format(tag=upstream.tag)
+                    body = json.dumps({"tag_name": upstream.tag, "assets": [
+                        {"name": name, "browser_download_url": f"{upstream.url}/download/{name}"},
+                        {"name": "spec-kit-template-claude-ps-x.zip", "browser_download_url": "unused"},
+                    ]}).encode()
+                elif self.path == f"/download/{ASSET.format(tag=upstream.tag)}":
+                    upstream.requests["download"] += 1
+                    time.sleep(upstream.download_delay)
+                    body = upstream.archive
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("ETag", f'"{upstream.tag}"')
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def release(self, tag: str, root: str = ""):
+        self.tag = tag
+        self.archive = make_template(tag, root)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def with_upstream(test):
+    def run():
+        upstream = Upstream()
+        tmp = tempfile.mkdtemp(prefix="template-cache-test-")
+        try:
+            test(upstream, tmp)
+        finally:
+            upstream.close()
+            shutil.rmtree(tmp, ignore_errors=True)
+    run.__name__ = test.__name__
+    return run
+
+
+@with_upstream
+def test_miss_then_hit(upstream, tmp):
+    cache = TemplateCache(os.path.join(tmp, "cache"), upstream.url, refresh="3600")
+    path, info = cache.get("claude", "sh")
+    assert info["cache"] == "miss" and info["fetch_ms"] > 0 and info["tag"] == "v0.0.1"
+    assert os.path.basename(path) == f"{info['sha256']}.zip"
+    with open(path, "rb") as f:
+        assert f.read() == upstream.archive
+    _, info = cache.get("claude", "sh")
+    assert info["cache"] == "hit" and info["fetch_ms"] == 0.0
+    assert upstream.requests == {"release": 1, "not_modified": 0, "download": 1}
+    print("✅ first init downloads the template, the next one is served from disk")
+
+
+@with_upstream
+def test_revalidation(upstream, tmp):
+    cache = TemplateCache(os.path.join(tmp, "cache"), upstream.url, refresh="always")
+    _, first = cache.get("claude", "sh")
+    _, info = cache.get("claude", "sh")
+    assert info["cache"] == "hit" and info["sha256"] == first["sha256"]
+    assert upstream.requests == {"release": 2, "not_modified": 1, "download": 1}
+    upstream.release("v0.0.2", root="spec-kit-template-claude-sh-v0.0.2/")
+    path, info = cache.get("claude", "sh")
+    assert info["cache"] == "miss" and info["tag"] == "v0.0.2" and info["sha256"] != first["sha256"]
+    # The replaced archive stays for PRUNE_AFTER seconds, in case someone is still unpacking it
+    assert os.path.exists(cache.object_path(first["sha256"])) and os.path.exists(path)
+    print("✅ refresh=always revalidates with If-None-Match and picks up a new release")
+
+
+@with_upstream
+def test_offline(upstream, tmp):
+    TemplateCache(os.path.join(tmp, "cache"), upstream.url).get("claude", "sh")
+    offline = TemplateCache(os.path.join(tmp, "cache"), upstream.url, refresh="always", offline=True)
+    _, info = offline.get("claude", "sh")
+    assert info["cache"] == "hit" and info["offline"] and upstream.requests["release"] == 1
+    try:
+        TemplateCache(os.path.join(tmp, "empty"), upstream.url, offline=True).get("claude", "sh")
+        raise AssertionError("offline miss did not fail")
+    except TemplateError as e:
+        assert "offline" in str(e) and "seed" in str(e)
+    print("✅ offline mode serves the cache and never contacts upstream")
+
+
+@with_upstream
+def test_upstream_down(upstream, tmp):
+    cache = TemplateCache(os.path.join(tmp, "cache"), upstream.url, refresh="0")
+    cache.get("claude", "sh")
+    upstream.down = True
+    _, info = cache.get("claude", "sh")
+    assert info["cache"] == "stale" and "503" in info["error"]
+    try:
+        TemplateCache(os.path.join(tmp, "empty"), upstream.url).get("claude", "sh")
+        raise AssertionError("fetch without upstream or cache did not fail")
+    except TemplateError as e:
+        assert "503" in str(e)
+    print("✅ an unreachable upstream falls back to the cached template")
+
+
+@with_upstream
+def test_download_outside_lock(upstream, tmp):
+    cache = TemplateCache(os.path.join(tmp, "cache"), upstream.url, refresh="3600")
+    tree = os.path.join(tmp, "tree")
+    with zipfile.ZipFile(io.BytesIO(make_template("v9"))) as archive:
+        archive.extractall(tree)
+    cache.seed(tree, "gemini", "sh")
+    upstream.download_delay = 1.0
+    results = []
+    fetchers = [threading.Thread(target=lambda: results.append(cache.get("claude", "sh")[1])) for _ in range(2)]
+    for fetcher in fetchers:
+        fetcher.start()
+    time.sleep(0.3)
+    started = time.monotonic()
+    _, info = cache.get("gemini", "sh")
+    assert "claude-sh" not in cache.entries()
+    assert info["cache"] == "hit" and time.monotonic() - started < 0.5, "blocked behind the download"
+    for fetcher in fetchers:
+        fetcher.join()
+    # The second caller waited for the first download instead of starting its own
+    assert sorted(r["cache"] for r in results) == ["hit", "miss"] and upstream.requests["download"] == 1
+    assert not [n for n in os.listdir(os.path.join(tmp, "cache", "objects")) if n.startswith(".tmp-")]
+    print("✅ a slow download does not hold up other templates or the index")
+
+
+@with_upstream
+def test_seed(upstream, tmp):
+    zips = os.path.join(tmp, "zips")
+    os.makedirs(zips)
+    for name, tag in (("claude-sh", "v0.0.7"), ("copilot-ps", "v0.0.7")):
+        with open(os.path.join(zips, f"spec-kit-template-{name}-{tag}.zip"), "wb") as f:
+            f.write(make_template(tag))
+    tarball = os.path.join(tmp, "templates.tar.gz")
+    with tarfile.open(tarball, "w:gz") as tar:
+        tar.add(zips, arcname="templates")
+
+    from_dir = TemplateCache(os.path.join(tmp, "a"), upstream.url, offline=True)
+    assert sorted(key for key, _ in from_dir.seed(zips)) == ["claude-sh", "copilot-ps"]
+    from_tar = TemplateCache(os.path.join(tmp, "b"), upstream.url, offline=True)
+    assert sorted(key for key, _ in from_tar.seed(tarball)) == ["claude-sh", "copilot-ps"]
+    assert from_dir.entries()["claude-sh"]["sha256"] == from_tar.entries()["claude-sh"]["sha256"]
+    _, info = from_tar.get("copilot", "ps")
+    assert info["cache"] == "hit" and info["tag"] == "v0.0.7"
+
+    # An unpacked tree is packed reproducibly: the same tree always gets the same sha256
+    tree = os.path.join(tmp, "tree")
+    with zipfile.ZipFile(io.BytesIO(make_template("v9"))) as archive:
+        archive.extractall(tree)
+    tree_cache = TemplateCache(os.path.join(tmp, "c"), upstream.url, offline=True)
+    (_, first), = tree_cache.seed(tree, "gemini", "sh")
+    (_, again), = tree_cache.seed(tree, "gemini", "sh")
+    assert first["sha256"] == again["sha256"] and first["tag"] == "local"
+    try:
+        tree_cache.seed(tree)
+        raise AssertionError("tree without --ai/--script was seeded")
+    except TemplateError:
+        pass
+    assert from_dir.seed(zips, replace=False) == []
+    print("✅ seeding from a directory, a tarball and an unpacked tree")
+
+
+@with_upstream
+def test_init_project(upstream, tmp):
+    upstream.release("v0.0.3", root="spec-kit-template-claude-sh-v0.0.3/")
+    cache = TemplateCache(os.path.join(tmp, "cache"), upstream.url)
+    options = template_cache.parse_init_args(["demo", "--ai", "claude", "--no-git"])
+    result = template_cache.init_project(cache, options, cwd=tmp)
+    assert result["success"], result
+    assert result["template"]["cache"] == "miss" and result["template"]["tag"] == "v0.0.3"
+    project = os.path.join(tmp, "demo")
+    with open(os.path.join(project, ".specify", "memory", "constitution.md")) as f:
+        assert f.read() == "# Constitution v0.0.3\n"
+    assert os.stat(os.path.join(project, ".specify", "scripts", "bash", "common.sh")).st_mode & stat.S_IXUSR
+
+    again = template_cache.init_project(cache, options, cwd=tmp)
+    assert not again["success"] and "already exists" in again["stderr"]
+
+    evil = os.path.join(tmp, "evil.zip")
+    with zipfile.ZipFile(evil, "w") as archive:
+        archive.writestr("../escaped.txt", "x")
+        archive.writestr("README.md", "x")
+    try:
+        template_cache.extract_template(evil, os.path.join(tmp, "victim"))
+        raise AssertionError("path traversal was unpacked")
+    except TemplateError:
+        assert not os.path.exists(os.path.join(tmp, "escaped.txt"))
+    print("✅ init unpacks the cached template like specify init")
+
+
+def test_parse_init_args():
+    parse = template_cache.parse_init_args
+    assert parse(["app"])["project"] == "app"
+    assert parse(["--here", "--force", "--script=ps"]) == {
+        "project": None, "ai": template_cache.DEFAULT_AI, "script": "ps", "here": True, "force": True, "git": True}
+    assert parse(["."])["here"]
+    # No project, two projects, bad script type or CLI-only options: leave it to specify
+    for args in ([], ["a", "b"], ["app", "--script", "bat"], ["app", "--github-token", "t"], ["app", "--here"]):
+        assert parse(args) is None, args
+    print("✅ init arguments the cache cannot honour fall back to the specify CLI")
+
+
+@with_upstream
+def test_tool_result(upstream, tmp):
+    import spec_kit_server
+    saved = spec_kit_server.templates
+    spec_kit_server.templates = TemplateCache(os.path.join(tmp, "cache"), upstream.url)
+    try:
+        server = spec_kit_server.MCPServer()
+        call = lambda path: json.loads(asyncio.run(server.handle_call_tool(
+            "specify_init", {"path": os.path.join(tmp, path), "ai": "claude"})))
+        first, second = call("one"), call("two")
+        # No path must not initialize the server's own working directory
+        missing = json.loads(asyncio.run(server.handle_call_tool("specify_init", {"ai": "claude"})))
+    finally:
+        spec_kit_server.templates = saved
+    assert first["success"] and first["template"]["cache"] == "miss" and first["template"]["fetch_ms"] > 0
+    assert second["success"] and second["template"]["cache"] == "hit"
+    assert os.path.isdir(os.path.join(tmp, "two", ".specify"))
+    assert not missing["success"] and "path" in missing["stderr"]
+    print("✅ specify_init reports cache hit/miss and fetch time, and requires a path")
+
+
+if __name__ == "__main__":
+    print("Testing the Spec-Kit template cache against a local upstream")
+    print()
+
+    success = True
+    for test in (test_miss_then_hit, test_revalidation, test_offline, test_upstream_down,
+                 test_download_outside_lock, test_seed,
+                 test_init_project, test_parse_init_args, test_tool_result):
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e!r}")
+            success = False
+
+    if success:
+        print("🎉 All tests passed!")
+    else:
+        print("💥 Some tests failed.")
+        sys.exit(1)